@@ -4,59 +4,231 @@ Tools for data analytics.
 """
 
 from PortfolioOptimizer import GlobalVariables as gv
+from PortfolioOptimizer.BatchOptimizer import BatchOptimizer
+from PortfolioOptimizer.BatchPortfolioMetrics import BatchPortfolioMetrics
 from PortfolioOptimizer.DataTools import DataTools
-from PortfolioOptimizer.Optimizer import Optimizer
+from PortfolioOptimizer.MomentTools import OnlineMoments
+from PortfolioOptimizer.Optimizer import Optimizer, SolverStats
+from PortfolioOptimizer.PoolTools import get_pool
 from PortfolioOptimizer.PortfolioMetrics import PortfolioMetrics
+from PortfolioOptimizer.SharedMemoryTools import SharedArray
+from PortfolioOptimizer.TimingTools import get_timer, span
 
 import numpy as np
 import pandas as pd
 import random
+import time
 
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed, wait
 from itertools import repeat
+from typing import Iterator, Union
 
 
 class AnalyticTools(object):
     def __init__(self) -> None:
-        pass
+        # the telemetry of the last single optimization and the totals
+        # for the last bootstrap's samples
+        self.telemetry = None
+        self.solver_stats = None
 
     def _stock_bond_vol(self, return_data: pd.DataFrame,
-                       objective_selection: str) -> float:
+                       objective_selection: str,
+                       indices: np.ndarray = None,
+                       moments: OnlineMoments = None) -> np.ndarray:
         """Calculate the volatility of the stock and bond portfolio given
-            a desired weight in each."""
-        # multiply by 100 since the optimizer needs higher values to work
-        bench_rets = return_data * 100
+            a desired weight in each, either over all the data or for each
+            bootstrap sample's row positions at once. The mix is a single
+            series of returns, so the volatility of any sample is just the
+            std of that series at the sample's positions. Over all the
+            data, it comes straight from the moments if we have them."""
         # the weights are defined in the GlobalVariables file
-        bench_weights = gv.OBJECTIVE_CHOICES[objective_selection][1]
-        opt_engine = Optimizer(bench_rets)
-        bench_stddev = opt_engine.stddev(bench_weights)
+        bench_weights = np.array(gv.OBJECTIVE_CHOICES[objective_selection][1])
+        if moments is not None and indices is None:
+            cov = moments.cov(['acwi', 'bnd'], ddof=0).to_numpy()
+            return np.sqrt(bench_weights @ cov @ bench_weights)
+        bench_rets = return_data[['acwi', 'bnd']].to_numpy(dtype=float) @ \
+            bench_weights
+        if indices is not None:
+            bench_rets = bench_rets[indices]
+        bench_stddev = np.std(bench_rets, axis=-1)
 
         return bench_stddev
 
     def run_optimization(self, user_return_data: pd.DataFrame,
                          obj_func: str, objective_selection: str,
-                         return_data: pd.DataFrame) -> pd.DataFrame:
+                         return_data: pd.DataFrame,
+                         bench_stddev: float = None,
+                         x0: np.ndarray = None,
+                         moments: OnlineMoments = None) -> pd.DataFrame:
         """Run the optimization based on the user's asset choices returns
-            and the objective function selected by the user."""
+            and the objective function selected by the user. If
+            bench_stddev is given, it is used as the volatility of the
+            benchmark mix of stocks and bonds rather than working it out
+            from return_data. If x0 is given, the optimization starts from
+            those weights, such as the solution for all the data when this
+            is a bootstrap sample. If moments are given for return_data,
+            which needs to have no missing values for the user's assets,
+            the means and covariances come from them rather than from
+            going over the full history."""
         # multiply by 100 since the optimizer needs higher values to work
-        opt_engine = Optimizer(user_return_data * 100)
+        if moments is not None:
+            columns = list(user_return_data.columns)
+            opt_engine = Optimizer(
+                user_return_data * 100,
+                mu=moments.mean(columns).to_numpy() * 100,
+                cov=moments.cov(columns, ddof=0).to_numpy() * 100 ** 2)
+        else:
+            opt_engine = Optimizer(user_return_data * 100)
         if obj_func == 'max_return':
             # if we want the max return, we need to find the vol of
             # the benchmark mix of stocks and bonds
-            bench_stddev = self._stock_bond_vol(
-                return_data[['acwi', 'bnd']], objective_selection)
-            weights = opt_engine.optimize(obj_func, bench_stddev)
+            if bench_stddev is None:
+                bench_stddev = self._stock_bond_vol(return_data,
+                                                    objective_selection,
+                                                    moments=moments)
+            # the Optimizer multiplies by 100 again, so the target needs
+            # to be on the same scale
+            weights = opt_engine.optimize(obj_func,
+                                          float(bench_stddev) * 100 ** 2,
+                                          x0=x0)
         else:
-            weights = opt_engine.optimize(obj_func)
+            weights = opt_engine.optimize(obj_func, x0=x0)
+        self.telemetry = opt_engine.telemetry
 
         return weights
 
+    def shared_optimization(self, spec: tuple, indices: np.ndarray,
+                            obj_func: str, objective_selection: str,
+                            bench_stddev: float = None,
+                            x0: np.ndarray = None) -> np.ndarray:
+        """
+        Run the optimization for one bootstrap sample in a worker process,
+            building the sample from the return data in shared memory.
+        :param spec: The SharedArray spec of the user's return data.
+        :param indices: The row positions of the bootstrap sample.
+        :param obj_func: The objective function to use for the
+            optimization.
+        :param objective_selection: The objective selection to use for the
+            optimization.
+        :param bench_stddev: The volatility of the benchmark mix of stocks
+            and bonds over the sample, if the objective function is
+            max_return.
+        :param x0: The weights to start the optimization from.
+        :return weights: The weights for the optimized portfolio.
+        :return telemetry: The telemetry of the optimization, which is
+            sent back from the worker so the parent can add it up.
+        """
+        user_return_data = pd.DataFrame(SharedArray.attach(spec)[indices])
+        weights = self.run_optimization(user_return_data, obj_func,
+                                        objective_selection, None,
+                                        bench_stddev=bench_stddev, x0=x0)
+
+        return weights, self.telemetry
+
+    def batch_optimization(self, user_data: np.ndarray, indices: np.ndarray,
+                           obj_func: str, objective_selection: str,
+                           bench_stddev: np.ndarray = None,
+                           stats: SolverStats = None) -> list:
+        """
+        Run the optimization for every bootstrap sample at once with the
+            batched optimizer.
+        :param user_data: The return data for the investments the user
+            will use, with shape (T, N).
+        :param indices: The row positions of the bootstrap samples, with
+            shape (n_boot, L).
+        :param obj_func: The objective function to use for the
+            optimization.
+        :param objective_selection: The objective selection to use for the
+            optimization, which will define the weights of the benchmark
+            if the objective function is max_return.
+        :param bench_stddev: The volatility of the benchmark mix of stocks
+            and bonds over each bootstrap sample, with shape (n_boot,),
+            if the objective function is max_return.
+        :param stats: If given, the samples and time are added to it.
+        :return bs_weights: The weights for each bootstrap sample that
+            has a solution.
+        """
+        start = time.perf_counter()
+        with span('batch_solve', method=obj_func,
+                  samples=len(indices)) as fields:
+            # multiply by 100 to stay on the same scale as the Optimizer,
+            # and get the moments of the samples from their row positions
+            # rather than gathering them
+            opt_engine = BatchOptimizer.from_indices(user_data * 100,
+                                                     indices)
+            if obj_func == 'max_return':
+                # the target is the vol of the benchmark mix of stocks and
+                # bonds over the same dates as each sample, on the same
+                # scale
+                weights = opt_engine.optimize(
+                    obj_func, np.asarray(bench_stddev) * 100)
+            else:
+                weights = opt_engine.optimize(obj_func)
+
+            # if the volatility of the benchmark is higher than any of the
+            # investments, there are no weights so we skip that sample
+            bs_weights = [x for x in weights if not np.isnan(x).any()]
+            fields['solved'] = len(bs_weights)
+        if stats is not None:
+            stats.add_batch(len(indices), len(bs_weights),
+                            time.perf_counter() - start)
+
+        return bs_weights
+
     def bootstrap_optimization(self, user_return_data: pd.DataFrame,
                                obj_func: str, objective_selection: str,
-                               return_data: pd.DataFrame) -> pd.DataFrame:
+                               return_data: pd.DataFrame,
+                               engine: str = gv.DEFAULT_BOOTSTRAP_ENGINE,
+                               client_id: str = 'default',
+                               bs_count: int = gv.DEFAULT_BOOTSTRAP_COUNT,
+                               trunc: float = gv.DEFAULT_BOOTSTRAP_TRUNC,
+                               seed: int = None,
+                               tol: float = gv.DEFAULT_BOOTSTRAP_TOL,
+                               min_count: int = gv.DEFAULT_BOOTSTRAP_MIN_COUNT,
+                               max_count: int = gv.DEFAULT_BOOTSTRAP_MAX_COUNT,
+                               batch_size: int =
+                               gv.DEFAULT_BOOTSTRAP_BATCH_SIZE) \
+            -> pd.DataFrame:
         """Bootstrap the return data and run the optimization based on the
             user's asset choices returns and the objective function
-            selected by the user.
+            selected by the user. The parameters are the same as for
+            bootstrap_weights.
+        :return weights: The bootstrapped weights for the optimized
+            portfolio, averaged across the samples.
+        """
+        bs_weights = self.bootstrap_weights(
+            user_return_data, obj_func, objective_selection, return_data,
+            engine, client_id, bs_count, trunc, seed, tol, min_count,
+            max_count, batch_size)
+
+        # average the weights
+        # we need to handle if all the weights are None
+        if bs_weights:
+            weights = pd.DataFrame(bs_weights).mean()
+        else:
+            weights = None
+
+        return weights
+
+    def bootstrap_weights(self, user_return_data: pd.DataFrame,
+                          obj_func: str, objective_selection: str,
+                          return_data: pd.DataFrame,
+                          engine: str = gv.DEFAULT_BOOTSTRAP_ENGINE,
+                          client_id: str = 'default',
+                          bs_count: int = gv.DEFAULT_BOOTSTRAP_COUNT,
+                          trunc: float = gv.DEFAULT_BOOTSTRAP_TRUNC,
+                          seed: int = None,
+                          tol: float = gv.DEFAULT_BOOTSTRAP_TOL,
+                          min_count: int = gv.DEFAULT_BOOTSTRAP_MIN_COUNT,
+                          max_count: int = gv.DEFAULT_BOOTSTRAP_MAX_COUNT,
+                          batch_size: int = gv.DEFAULT_BOOTSTRAP_BATCH_SIZE) \
+            -> list:
+        """Bootstrap the return data and run the optimization for each
+            sample, keeping the weights of every sample. If tol is given,
+            the number of samples adapts to how stable the average weights
+            are: samples are drawn in batches until the standard error of
+            every average weight is under tol, so an easy portfolio stops
+            early and a hard one gets more samples.
         :param user_return_data: The return data for the investments the
             user will use.
         :param obj_func: The objective function to use for the
@@ -65,53 +237,368 @@ class AnalyticTools(object):
             optimization, which will define the weights of the benchmark
             if the objective function is max_return.
         :param return_data: The return data for the benchmark.
-        :return weights: The bootstrapped weights for the optimized
-            portfolio.
+        :param engine: Either 'batched' to solve all the bootstrap samples
+            at once with the BatchOptimizer, or 'process' to run one
+            Optimizer per sample on the app-wide worker pool.
+        :param client_id: The client, such as a session, to queue the
+            worker pool tasks under, so that runs from different clients
+            share the pool fairly.
+        :param bs_count: The number of bootstrap samples, if tol is None.
+        :param trunc: The percentage of data to keep in each sample.
+        :param seed: The seed for bootstrapping. If None, we pick one at
+            random.
+        :param tol: The largest standard error of the average weights to
+            stop at. If None, we always draw bs_count samples.
+        :param min_count: The fewest samples to draw if tol is given.
+        :param max_count: The most samples to draw if tol is given, even
+            if the average weights haven't settled.
+        :param batch_size: The number of samples to draw at a time if tol
+            is given.
+        :return bs_weights: The weights for each sample that has a
+            solution. The totals of the telemetry of the samples'
+            optimizations, including those without a solution, are kept
+            in self.solver_stats.
         """
-        # get a bootstrap generator for the user's return data
+        # get the bootstrap samples for the user's return data as row
+        # positions, so we never build a DataFrame per sample
         data_engine = DataTools()
-        seed = random.randint(0, 100000)
-        gen = data_engine.get_bootstrap_data_ts(
-            user_return_data, seed, gv.DEFAULT_BOOTSTRAP_COUNT,
-            trunc=gv.DEFAULT_BOOTSTRAP_TRUNC)
-
-        # get all the bootstrap data so we can parallelize
-        bs_data = []
-        bs_bench_data = []
-        for _ in range(gv.DEFAULT_BOOTSTRAP_COUNT):
-            curr_bs_data = next(gen)
-            bs_data.append(curr_bs_data)
-            # we want the benchmark to also have the same dates as the
-            # bootstrap data
-            bs_bench_data.append(return_data.loc[curr_bs_data.index,
-                                 ['acwi', 'bnd']])
-
-        # get the weights for each bootstrap
+        if seed is None:
+            seed = random.randint(0, 100000)
+        # in the adaptive mode, the positions for as many samples as we
+        # could need are drawn up front, so the samples we do use are the
+        # same as the first ones of a run with a fixed count
+        if tol is None:
+            batch_size = bs_count
+        else:
+            bs_count = max(max_count, min_count)
+        indices = data_engine.get_bootstrap_indices_ts(
+            user_return_data, seed, bs_count, trunc=trunc)
+
+        # the vol of the benchmark over each sample, from the same row
+        # positions on the same dates as the user's returns
+        bench_stddev = None
+        if obj_func == 'max_return':
+            bench_stddev = self._stock_bond_vol(
+                return_data.loc[user_return_data.index], objective_selection,
+                indices)
+        user_data = user_return_data.to_numpy(dtype=float)
+
+        # get the weights for each bootstrap, a batch at a time
         bs_weights = []
-        with ProcessPoolExecutor() as executor:
-            for curr_weights in executor.map(self.run_optimization,
-                                             bs_data, repeat(obj_func),
-                                             repeat(objective_selection),
-                                             bs_bench_data):
-                # if the volatility of the benchmark is higher than any of
-                # the investments, we can't get weights under 100% so we
-                # return None and skip this iteration
-                if curr_weights is not None:
-                    bs_weights.append(curr_weights)
+        stats = SolverStats()
+        if engine == 'batched':
+            for start in range(0, bs_count, batch_size):
+                end = start + batch_size
+                bs_weights.extend(self.batch_optimization(
+                    user_data, indices[start:end], obj_func,
+                    objective_selection,
+                    None if bench_stddev is None else
+                    bench_stddev[start:end], stats))
+                if tol is not None and self._settled(bs_weights, end, tol,
+                                                     min_count):
+                    break
+        else:
+            # the samples are close to all the data, so every sample starts
+            # from the solution for all the data rather than equal weights
+            x0 = self.run_optimization(user_return_data, obj_func,
+                                       objective_selection, return_data)
+            # the workers read the return data from shared memory and only
+            # get sent the positions for each sample
+            with SharedArray(user_data) as shared:
+                for start in range(0, bs_count, batch_size):
+                    end = start + batch_size
+                    for curr_weights, telemetry in get_pool().map(
+                            client_id, self.shared_optimization,
+                            repeat(shared.spec), indices[start:end],
+                            repeat(obj_func), repeat(objective_selection),
+                            repeat(None) if bench_stddev is None else
+                            bench_stddev[start:end], repeat(x0)):
+                        stats.add(telemetry)
+                        # if the volatility of the benchmark is higher than
+                        # any of the investments, we can't get weights
+                        # under 100% so we return None and skip this
+                        # iteration
+                        if curr_weights is not None:
+                            bs_weights.append(curr_weights)
+                    if tol is not None and self._settled(
+                            bs_weights, end, tol, min_count):
+                        break
 
-        # average the weights
-        try:
-            weights = pd.DataFrame(bs_weights).mean()
-        # we need to handle if all the weights are None
-        except TypeError:
-            weights = None
+        # record the totals for the run, so the time lost to samples
+        # without a solution shows up next to the other stages
+        self.solver_stats = stats
+        summary = stats.summary()
+        # the timer counts the spans as calls itself, so the number of
+        # solves needs its own name
+        summary['solves'] = summary.pop('calls')
+        get_timer().record('bootstrap_solves', summary.pop('seconds'),
+                           engine=engine, method=obj_func, **summary)
+
+        return bs_weights
+
+    def _settled(self, bs_weights: list, drawn: int, tol: float,
+                 min_count: int) -> bool:
+        """Check whether enough samples have been drawn and the standard
+            error of every average weight is under the tolerance."""
+        if drawn < min_count or len(bs_weights) < 2:
+            return False
+        stderr = np.std(bs_weights, axis=0, ddof=1) / np.sqrt(
+            len(bs_weights))
+
+        return bool(np.max(stderr) <= tol)
+
+    def bootstrap_metrics(self, user_return_data: pd.DataFrame,
+                          bs_weights: list, drawdown: bool = True,
+                          var: bool = True) -> Union[dict, None]:
+        """
+        Calculate the metrics of every bootstrap sample's portfolio over
+            all the data at once, so we can show how much they vary
+            rather than just the metrics of the average.
+        :param user_return_data: The return data for the investments the
+            user will use.
+        :param bs_weights: The weights for each sample, in the same order
+            as the columns of user_return_data.
+        :param drawdown: Whether to include the max drawdown.
+        :param var: Whether to include the value at risk.
+        :return metrics: The metrics, each as an array with one value per
+            sample, or None if there are no samples.
+        """
+        if not len(bs_weights):
+            return None
+        with span('metrics', portfolios=len(bs_weights)):
+            metrics_engine = BatchPortfolioMetrics(user_return_data,
+                                                   np.vstack(bs_weights))
+            return metrics_engine.metrics(drawdown, var)
+
+    def frontier_optimization(self, user_return_data: pd.DataFrame,
+                              return_data: pd.DataFrame,
+                              objective_selections: list = None,
+                              bootstrap: bool = True,
+                              bs_count: int = gv.DEFAULT_BOOTSTRAP_COUNT,
+                              trunc: float = gv.DEFAULT_BOOTSTRAP_TRUNC,
+                              seed: int = None) -> dict:
+        """
+        Run the max_return optimization for several stock and bond mixes
+            in one pass along the efficient frontier, so the cost is close
+            to a single optimization rather than one per mix.
+        :param user_return_data: The return data for the investments the
+            user will use.
+        :param return_data: The return data for the benchmark.
+        :param objective_selections: The objective selections for the
+            stock and bond mixes. If None, we use every max_return
+            objective.
+        :param bootstrap: Whether to bootstrap the optimizations, using
+            the same samples for every mix.
+        :param bs_count: The number of bootstrap samples.
+        :param trunc: The percentage of data to keep in each sample.
+        :param seed: The seed for bootstrapping. If None, we pick one at
+            random.
+        :return weights: The weights for each objective selection, which
+            are None if the benchmark volatility is too high.
+        """
+        if objective_selections is None:
+            objective_selections = [k for k, v in gv.OBJECTIVE_CHOICES.items()
+                                    if v[0] == 'max_return']
+        bench_data = return_data.loc[user_return_data.index]
+        user_data = user_return_data.to_numpy(dtype=float)
+
+        if not bootstrap:
+            # the Optimizer multiplies by 100 again, so the targets need
+            # to be on the same scale
+            bench_stddev = [float(self._stock_bond_vol(bench_data, x)) *
+                            100 ** 2 for x in objective_selections]
+            opt_engine = Optimizer(user_return_data * 100)
+            return dict(zip(objective_selections,
+                            opt_engine.efficient_frontier(bench_stddev)))
+
+        data_engine = DataTools()
+        if seed is None:
+            seed = random.randint(0, 100000)
+        indices = data_engine.get_bootstrap_indices_ts(
+            user_return_data, seed, bs_count, trunc=trunc)
+        # the vol of each benchmark mix over each sample, with shape
+        # (n_boot, K)
+        bench_stddev = np.stack([
+            self._stock_bond_vol(bench_data, x, indices) for x in
+            objective_selections], axis=1)
+        opt_engine = BatchOptimizer.from_indices(user_data * 100, indices)
+        frontier = opt_engine.efficient_frontier(bench_stddev * 100)
+
+        weights = {}
+        for k, objective_selection in enumerate(objective_selections):
+            # if the volatility of the benchmark is higher than any of the
+            # investments, there are no weights so we skip that sample
+            bs_weights = frontier[:, k]
+            bs_weights = bs_weights[~np.isnan(bs_weights).any(axis=1)]
+            weights[objective_selection] = None
+            if len(bs_weights):
+                weights[objective_selection] = pd.DataFrame(bs_weights).mean()
 
         return weights
 
+    def shared_batch_optimization(self, spec: tuple, imputation: int,
+                                  indices: np.ndarray, obj_func: str,
+                                  objective_selection: str,
+                                  bench_stddev: np.ndarray = None) -> list:
+        """
+        Run the batched optimization for a chunk of bootstrap samples of
+            one imputation in a worker process, from the positions of
+            their rows in the return data in shared memory.
+        :param spec: The SharedArray spec of the user's return data for
+            every imputation, with shape (n_imp, T, N).
+        :param imputation: The position of the imputation to sample.
+        :param indices: The row positions of the bootstrap samples, with
+            shape (n_boot, L).
+        :param obj_func: The objective function to use for the
+            optimization.
+        :param objective_selection: The objective selection to use for the
+            optimization.
+        :param bench_stddev: The volatility of the benchmark mix of stocks
+            and bonds over each sample, if the objective function is
+            max_return.
+        :return bs_weights: The weights for each bootstrap sample that
+            has a solution.
+        """
+        user_data = SharedArray.attach(spec)[imputation]
+
+        return self.batch_optimization(user_data, indices, obj_func,
+                                       objective_selection, bench_stddev)
+
+    def imputed_bootstrap_optimization(
+            self, imp_user_data: list, obj_func: str,
+            objective_selection: str, return_data: pd.DataFrame,
+            client_id: str = 'default',
+            bs_count: int = gv.DEFAULT_BOOTSTRAP_COUNT,
+            trunc: float = gv.DEFAULT_BOOTSTRAP_TRUNC, seed: int = None,
+            chunk_size: int = gv.DEFAULT_BOOTSTRAP_CHUNK_SIZE) -> Iterator:
+        """
+        Bootstrap every imputation of the user's return data and run the
+            optimizations as one set of tasks on the app-wide worker pool,
+            so the imputations and samples all run across every core at
+            once rather than one imputation after the other.
+        :param imp_user_data: The return data for the investments the user
+            will use, for each imputation. They need the same dates.
+        :param obj_func: The objective function to use for the
+            optimization.
+        :param objective_selection: The objective selection to use for the
+            optimization, which will define the weights of the benchmark
+            if the objective function is max_return.
+        :param return_data: The return data for the benchmark.
+        :param client_id: The client, such as a session, to queue the
+            worker pool tasks under.
+        :param bs_count: The number of bootstrap samples per imputation.
+        :param trunc: The percentage of data to keep in each sample.
+        :param seed: The seed for bootstrapping. If None, we pick one at
+            random.
+        :param chunk_size: The number of samples in each task. If None, we
+            split the samples so each worker gets about two tasks, since
+            the batched optimizer is faster on bigger chunks.
+        :return results: A generator of the position of an imputation,
+            the number of samples in a chunk of its samples and the
+            weights for the samples in the chunk that have a solution, in
+            the order the tasks finish.
+        """
+        data_engine = DataTools()
+        if seed is None:
+            seed = random.randint(0, 100000)
+        # each imputation gets its own independent samples
+        seeds = np.random.SeedSequence(seed).generate_state(
+            len(imp_user_data))
+
+        # put every imputation's returns in one shared block that holds
+        # the data for every task
+        all_data = np.stack([x.to_numpy(dtype=float) for x in imp_user_data])
+        bench_data = return_data.loc[imp_user_data[0].index]
+
+        pool = get_pool()
+        if chunk_size is None:
+            chunk_size = -(-len(imp_user_data) * bs_count //
+                           (2 * pool.max_workers))
+        chunk_size = max(min(chunk_size, bs_count), 1)
+        imp_indices = []
+        imp_bench_stddev = []
+        for i, user_return_data in enumerate(imp_user_data):
+            indices = data_engine.get_bootstrap_indices_ts(
+                user_return_data, int(seeds[i]), bs_count, trunc=trunc)
+            imp_indices.append(indices)
+            # the vol of the benchmark over each sample
+            bench_stddev = None
+            if obj_func == 'max_return':
+                bench_stddev = self._stock_bond_vol(
+                    bench_data, objective_selection, indices)
+            imp_bench_stddev.append(bench_stddev)
+
+        with SharedArray(all_data) as shared:
+            futures = {}
+            # queue the chunks round-robin across the imputations, so a
+            # caller that stops early has samples for every imputation
+            for start in range(0, bs_count, chunk_size):
+                end = start + chunk_size
+                for i, (indices, bench_stddev) in enumerate(
+                        zip(imp_indices, imp_bench_stddev)):
+                    chunk = indices[start:end]
+                    future = pool.submit(
+                        client_id, self.shared_batch_optimization,
+                        shared.spec, i, chunk, obj_func,
+                        objective_selection,
+                        None if bench_stddev is None else
+                        bench_stddev[start:end])
+                    futures[future] = (i, chunk.shape[0])
+
+            try:
+                for future in as_completed(futures):
+                    yield (*futures[future], future.result())
+            finally:
+                # if the caller stops early, drop the tasks that haven't
+                # been handed to a worker yet. the ones that have can't be
+                # cancelled, so wait for them to finish reading the
+                # shared memory before it is freed
+                for future in futures:
+                    future.cancel()
+                wait(futures)
+
+    def running_summary(self, bs_weights: list, bs_metrics: list,
+                        columns: list,
+                        z: float = gv.DEFAULT_CONFIDENCE_Z) -> tuple:
+        """
+        Summarize the bootstrap samples finished so far, so a display can
+            show where the results are heading before every sample is
+            done.
+        :param bs_weights: The weights for each finished sample.
+        :param bs_metrics: The metrics for the finished samples, as a list
+            of the dictionaries returned by bootstrap_metrics.
+        :param columns: The names of the investments, in the same order as
+            the weights.
+        :param z: The number of standard errors on either side of the
+            average for the confidence bands.
+        :return weights: The average weight of each investment, with its
+            standard error and confidence band, as the columns 'Mean',
+            'Std Error', 'Lower' and 'Upper'.
+        :return metrics: The average of each metric across the samples,
+            with the same columns.
+        """
+        def summarize(samples: np.ndarray, index: list) -> pd.DataFrame:
+            mean = samples.mean(axis=0)
+            stderr = samples.std(axis=0, ddof=1) / np.sqrt(len(samples)) \
+                if len(samples) > 1 else np.full(samples.shape[1], np.nan)
+            return pd.DataFrame({'Mean': mean, 'Std Error': stderr,
+                                 'Lower': mean - z * stderr,
+                                 'Upper': mean + z * stderr}, index=index)
+
+        weights = summarize(np.vstack(bs_weights), list(columns))
+        bs_metrics = [x for x in bs_metrics if x is not None]
+        names = list(bs_metrics[0].keys()) if bs_metrics else []
+        metrics = summarize(np.column_stack(
+            [np.concatenate([x[k] for x in bs_metrics]) for k in names]),
+            names) if names else None
+
+        return weights, metrics
+
     def portfolio_metrics(self, port_returns: pd.DataFrame, weights: list,
                           obj_func: str, objective_selection: str,
                           return_data: pd.DataFrame,
-                          metrics: dict) -> dict:
+                          metrics: dict,
+                          moments: OnlineMoments = None) -> dict:
         """
         Calculate the metrics for the portfolio and a benchmark if
             we are looking at optimizing for max return. This is for
@@ -126,12 +613,32 @@ class AnalyticTools(object):
         :param return_data: The return data that includes the benchmark
             assets.
         :param metrics: The metrics dictionary that we will append to.
+        :param moments: The moments of return_data, if port_returns are
+            all of its rows, so the metrics don't need the full history.
         :return metrics: The metrics dictionary with the new metrics
             appended. Includes the average, volatility, and Sharpe ratio.
             As well as the same for the benchmark if the objective is
             max_return.
         """
-        metrics_engine = PortfolioMetrics(port_returns, weights)
+        with span('metrics', portfolios=1):
+            return self._portfolio_metrics(port_returns, weights, obj_func,
+                                           objective_selection, return_data,
+                                           metrics, moments)
+
+    def _portfolio_metrics(self, port_returns: pd.DataFrame, weights: list,
+                           obj_func: str, objective_selection: str,
+                           return_data: pd.DataFrame, metrics: dict,
+                           moments: OnlineMoments = None) -> dict:
+        """Calculate the metrics for the portfolio and any benchmark,
+            with the same parameters as portfolio_metrics."""
+        mu = cov = bench_mu = bench_cov = None
+        if moments is not None:
+            columns = list(port_returns.columns)
+            mu = moments.mean(columns).to_numpy()
+            cov = moments.cov(columns, ddof=0).to_numpy()
+            bench_mu = moments.mean(['acwi', 'bnd']).to_numpy()
+            bench_cov = moments.cov(['acwi', 'bnd'], ddof=0).to_numpy()
+        metrics_engine = PortfolioMetrics(port_returns, weights, mu, cov)
         if metrics:
             metrics['Average'].append(metrics_engine.mean())
             metrics['Volatility'].append(metrics_engine.stddev())
@@ -148,7 +655,8 @@ class AnalyticTools(object):
             # weights of the stocks and bonds
             bench_rets = return_data[['acwi', 'bnd']]
             bench_weights = gv.OBJECTIVE_CHOICES[objective_selection][1]
-            bench_metrics_engine = PortfolioMetrics(bench_rets, bench_weights)
+            bench_metrics_engine = PortfolioMetrics(bench_rets, bench_weights,
+                                                    bench_mu, bench_cov)
             # then calculate the metrics for the benchmark
             if 'Bench Average' not in metrics:
                 metrics['Bench Average'] = [bench_metrics_engine.mean()]
@@ -164,6 +672,22 @@ class AnalyticTools(object):
 
         return metrics
 
+    def combine_metrics(self, metrics: dict, new_metrics: dict) -> dict:
+        """
+        Combine the metrics from another set of data, such as another
+            imputation, with the metrics so far.
+        :param metrics: The metrics so far, which might be empty.
+        :param new_metrics: The metrics to add, as returned by
+            portfolio_metrics.
+        :return metrics: The metrics dictionary with the new metrics
+            appended. The inputs are left as they are.
+        """
+        metrics = {k: list(v) for k, v in metrics.items()}
+        for k, v in new_metrics.items():
+            metrics[k] = metrics.get(k, []) + list(v)
+
+        return metrics
+
     def average_metrics(self, imp_metrics: dict) -> dict:
         """Label the imputed metrics."""
         metrics = {
@@ -0,0 +1,742 @@
+"""
+A batched optimizer for solving many portfolio optimizations at once.
+:class BatchOptimizer: Solves the long-only, fully-invested problems for
+    a stack of return samples in one vectorized pass.
+"""
+
+import numpy as np
+
+from typing import Tuple, Union
+
+
+class BatchOptimizer(object):
+    """
+    Solves the long-only, fully-invested problems for a stack of return
+    samples in one vectorized pass. Every problem in the stack is solved
+    together with projected gradient steps, so the cost of a solve is a
+    handful of batched (N x N) matrix products rather than one scipy
+    call per sample.
+    """
+    def __init__(self, returns: np.ndarray = None, mu: np.ndarray = None,
+                 cov: np.ndarray = None, max_iter: int = 2000,
+                 tol: float = 1e-9) -> None:
+        """
+        :param returns: The stacked returns with shape (n_boot, T, N),
+            one (T x N) sample of asset returns per resample. A single
+            (T x N) sample is also accepted.
+        :param mu: The mean returns with shape (n_boot, N) if the
+            moments have already been calculated, in which case returns
+            isn't needed.
+        :param cov: The covariance matrices with shape (n_boot, N, N)
+            that go with mu.
+        :param max_iter: The maximum number of projected gradient steps
+            for each inner solve.
+        :param tol: The tolerance on the change in weights for an inner
+            solve to count as converged.
+        """
+        if returns is not None:
+            returns = np.asarray(returns, dtype=float)
+            if returns.ndim == 2:
+                returns = returns[np.newaxis, :, :]
+            # the moments for every resample in a couple of einsum calls,
+            # using the population covariance so that the volatility
+            # matches np.std of the portfolio returns
+            mu = np.einsum('btn->bn', returns) / returns.shape[1]
+            centered = returns - mu[:, np.newaxis, :]
+            cov = np.einsum('btn,btm->bnm', centered, centered) / \
+                returns.shape[1]
+        elif mu is None or cov is None:
+            raise ValueError("BatchOptimizer needs either the returns or "
+                             "both mu and cov.")
+        mu = np.asarray(mu, dtype=float)
+        cov = np.asarray(cov, dtype=float)
+        if mu.ndim == 1:
+            mu = mu[np.newaxis, :]
+            cov = cov[np.newaxis, :, :]
+
+        self.mu = mu
+        self.cov = cov
+        self.n_boot, self.n_assets = mu.shape
+        self.max_iter = max_iter
+        self.tol = tol
+        # the step size for each problem is 1 / the largest eigenvalue of
+        # its covariance matrix, which is the Lipschitz constant of the
+        # gradient of the quadratic objectives
+        lipschitz = np.linalg.eigvalsh(cov)[:, -1]
+        self.step = 1 / np.maximum(lipschitz, np.finfo(float).tiny)
+        # the ends of the frontier only depend on the moments, so they are
+        # found once and shared by every target
+        self._w_min = None
+        self._w_sharpe = None
+
+    @classmethod
+    def from_indices(cls, data: np.ndarray, indices: np.ndarray,
+                     **kwargs) -> 'BatchOptimizer':
+        """
+        Set up the optimizer for resamples of one set of returns from the
+            positions of their rows, without gathering every resample.
+            Each resample's moments only depend on how many times it
+            holds each row, so they come from two matrix products with
+            the counts, which is much faster than going over the stacked
+            resamples.
+        :param data: The returns with shape (T, N).
+        :param indices: The positions of the rows in each resample, with
+            shape (n_boot, L).
+        :param kwargs: Anything else to pass to BatchOptimizer.
+        :return optimizer: The optimizer for the resamples.
+        """
+        data = np.asarray(data, dtype=float)
+        indices = np.asarray(indices)
+        n_boot, length = indices.shape
+        n_rows, n_assets = data.shape
+        # how many times each row is in each resample
+        flat = indices + n_rows * np.arange(n_boot)[:, np.newaxis]
+        counts = np.bincount(flat.ravel(), minlength=n_boot * n_rows)
+        counts = counts.reshape(n_boot, n_rows).astype(float)
+        # center on the full sample first so that taking the square of the
+        # mean off the mean of the squares doesn't lose precision
+        shift = data.mean(axis=0)
+        centered = data - shift
+        mu = counts @ centered / length
+        outer = (centered[:, :, np.newaxis] *
+                 centered[:, np.newaxis, :]).reshape(n_rows, -1)
+        cov = (counts @ outer).reshape(n_boot, n_assets, n_assets) / \
+            length - mu[:, :, np.newaxis] * mu[:, np.newaxis, :]
+
+        return cls(mu=mu + shift, cov=cov, **kwargs)
+
+    def _subset(self, rows: np.ndarray) -> 'BatchOptimizer':
+        """Get an optimizer for some of the resamples, sharing the step
+            sizes already worked out rather than finding them again."""
+        sub = object.__new__(BatchOptimizer)
+        sub.__dict__.update(self.__dict__)
+        sub.mu = self.mu[rows]
+        sub.cov = self.cov[rows]
+        sub.step = self.step[rows]
+        sub.n_boot = len(rows)
+        sub._w_min = None if self._w_min is None else self._w_min[rows]
+        sub._w_sharpe = None if self._w_sharpe is None else \
+            self._w_sharpe[rows]
+
+        return sub
+
+    def _cov_dot(self, weights: np.ndarray) -> np.ndarray:
+        """Multiply each covariance matrix by its own weight vector."""
+        return np.matmul(self.cov, weights[:, :, np.newaxis])[:, :, 0]
+
+    def stddev(self, weights: np.ndarray) -> np.ndarray:
+        """
+        Calculate the standard deviation of each portfolio.
+        :param weights: The weights with shape (n_boot, N).
+        :return stddev: The standard deviation for each resample.
+        """
+        variance = np.einsum('bn,bn->b', weights, self._cov_dot(weights))
+
+        return np.sqrt(np.maximum(variance, 0))
+
+    def mean(self, weights: np.ndarray) -> np.ndarray:
+        """
+        Calculate the mean return of each portfolio.
+        :param weights: The weights with shape (n_boot, N).
+        :return mean: The mean return for each resample.
+        """
+        return np.einsum('bn,bn->b', weights, self.mu)
+
+    @staticmethod
+    def _project_simplex(values: np.ndarray) -> np.ndarray:
+        """Project each row onto the long-only, fully-invested simplex."""
+        n_assets = values.shape[1]
+        ordered = -np.sort(-values, axis=1)
+        cum_sum = np.cumsum(ordered, axis=1) - 1
+        ranks = np.arange(1, n_assets + 1)
+        # the number of holdings left after the projection is the last
+        # position where the sorted value is above the running threshold
+        support = np.sum(ordered - cum_sum / ranks > 0, axis=1)
+        theta = cum_sum[np.arange(values.shape[0]), support - 1] / support
+
+        return np.maximum(values - theta[:, np.newaxis], 0)
+
+    @staticmethod
+    def _project_positive(values: np.ndarray) -> np.ndarray:
+        """Project each row onto the long-only orthant."""
+        return np.maximum(values, 0)
+
+    def _solve_qp(self, weights: np.ndarray, linear: np.ndarray,
+                  project, active: np.ndarray = None,
+                  max_iter: int = None, tol: float = None) -> np.ndarray:
+        """
+        Minimize 0.5 * w'Sw - linear'w for every problem in the stack with
+            accelerated projected gradient (FISTA) steps.
+        :param weights: The starting weights with shape (n_boot, N).
+        :param linear: The linear term of the objective for each problem.
+        :param project: The projection onto the feasible set.
+        :param active: A boolean mask of the problems to solve. The rest
+            are passed through untouched.
+        :param max_iter: The maximum number of steps, defaulting to the
+            one set at initialization.
+        :param tol: The convergence tolerance, defaulting to the one set
+            at initialization.
+        :return weights: The optimal weights.
+        """
+        max_iter = self.max_iter if max_iter is None else max_iter
+        tol = self.tol if tol is None else tol
+        if active is None:
+            active = np.ones(self.n_boot, dtype=bool)
+        weights = weights.copy()
+        if not active.any():
+            return weights
+
+        cov = self.cov[active]
+        step = self.step[active][:, np.newaxis]
+        linear = linear[active]
+        curr = weights[active]
+        momentum = curr.copy()
+        t_curr = 1.
+        for _ in range(max_iter):
+            grad = np.matmul(cov, momentum[:, :, np.newaxis])[:, :, 0] - \
+                linear
+            new = project(momentum - step * grad)
+            t_new = (1 + np.sqrt(1 + 4 * t_curr ** 2)) / 2
+            change = new - curr
+            momentum = new + ((t_curr - 1) / t_new) * change
+            curr = new
+            t_curr = t_new
+            scale = np.maximum(np.abs(curr).max(), 1.)
+            if np.abs(change).max() <= tol * scale:
+                break
+        weights[active] = curr
+
+        return weights
+
+    def _support_system(self, support: np.ndarray,
+                        budget: bool) -> np.ndarray:
+        """
+        Build the KKT matrix of the equality constrained problem on the
+            given holdings. Assets outside the support get an identity
+            row so that their weight solves to 0.
+        :param support: A boolean mask with shape (n_boot, N) of the
+            assets that are held.
+        :param budget: Whether the weights need to sum to 1, which adds
+            a row and column for the multiplier.
+        :return kkt: The KKT matrices.
+        """
+        n_assets = self.n_assets
+        size = n_assets + 1 if budget else n_assets
+        kkt = np.zeros((self.n_boot, size, size))
+        pair = support[:, :, np.newaxis] & support[:, np.newaxis, :]
+        kkt[:, :n_assets, :n_assets] = np.where(pair, self.cov, 0)
+        diag = np.arange(n_assets)
+        kkt[:, diag, diag] += ~support
+        if budget:
+            kkt[:, :n_assets, n_assets] = support
+            kkt[:, n_assets, :n_assets] = support
+
+        return kkt
+
+    def _polish_sharpe(self, y: np.ndarray) -> Tuple[np.ndarray,
+                                                     np.ndarray]:
+        """
+        Solve the Sharpe Ratio problem exactly on the holdings found by
+            the projected gradient steps and check that it is optimal.
+        :param y: The approximate solution of min 0.5 * y'Sy - mu'y.
+        :return y: The polished solution.
+        :return exact: Whether the polished solution passed the
+            optimality checks, per resample.
+        """
+        support = y > self.tol * np.maximum(y.max(axis=1, keepdims=True),
+                                            np.finfo(float).tiny)
+        kkt = self._support_system(support, False)
+        rhs = np.where(support, self.mu, 0)
+        try:
+            exact_y = np.linalg.solve(kkt, rhs[:, :, np.newaxis])[:, :, 0]
+        except np.linalg.LinAlgError:
+            return y, np.zeros(self.n_boot, dtype=bool)
+        # the KKT conditions are that held assets are long and the
+        # gradient for assets that aren't held points outside the orthant
+        grad = self._cov_dot(exact_y) - self.mu
+        scale = np.abs(self.mu).max(axis=1, keepdims=True) + \
+            np.finfo(float).tiny
+        exact = np.all(exact_y >= -1e-12 * np.abs(exact_y).max(
+            axis=1, keepdims=True), axis=1) & np.all(
+            support | (grad >= -1e-8 * scale), axis=1)
+        y = np.where(exact[:, np.newaxis], np.maximum(exact_y, 0), y)
+
+        return y, exact
+
+    def _frontier_line(self, support: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        Solve the fully-invested problem min 0.5 * w'Sw - s * mu'w on the
+            given holdings. For fixed holdings the solution is affine in
+            s, w = w_a + s * w_c, and so is the budget multiplier.
+        :param support: A boolean mask with shape (n_boot, N) of the
+            assets that are held.
+        :return w_a: The weights at s = 0.
+        :return w_c: The change in weights per unit of s.
+        :return nu_a: The budget multiplier at s = 0.
+        :return nu_c: The change in the budget multiplier per unit of s.
+        """
+        n_assets = self.n_assets
+        kkt = self._support_system(support, True)
+        rhs = np.zeros((self.n_boot, n_assets + 1, 2))
+        rhs[:, n_assets, 0] = 1
+        rhs[:, :n_assets, 1] = np.where(support, self.mu, 0)
+        sol = np.linalg.solve(kkt, rhs)
+
+        return (sol[:, :n_assets, 0], sol[:, :n_assets, 1],
+                sol[:, n_assets, 0], sol[:, n_assets, 1])
+
+    def _check_frontier(self, weights: np.ndarray, s_val: np.ndarray,
+                        nu: np.ndarray, support: np.ndarray) -> np.ndarray:
+        """
+        Check the KKT conditions of a frontier solution, which are that
+            held assets are long and that the multipliers on the assets
+            that aren't held are non-negative.
+        :return exact: Whether each solution is optimal.
+        """
+        mult = self._cov_dot(weights) - s_val[:, np.newaxis] * self.mu + \
+            nu[:, np.newaxis]
+        scale = np.abs(self.cov).max(axis=(1, 2))[:, np.newaxis]
+
+        return np.isfinite(weights).all(axis=1) & \
+            np.all(weights >= -1e-10, axis=1) & \
+            np.all(support | (mult >= -1e-8 * scale), axis=1)
+
+    @staticmethod
+    def _clean_weights(weights: np.ndarray) -> np.ndarray:
+        """Clip the rounding noise off exact weights and renormalize."""
+        weights = np.maximum(np.nan_to_num(weights), 0)
+
+        return weights / np.maximum(weights.sum(axis=1, keepdims=True),
+                                    np.finfo(float).tiny)
+
+    def _polish_min_variance(self, weights: np.ndarray) -> Tuple[np.ndarray,
+                                                                 np.ndarray]:
+        """
+        Solve the minimum variance problem exactly on the holdings found
+            by the projected gradient steps.
+        :param weights: The approximate solutions.
+        :return weights: The polished solutions.
+        :return exact: Whether the polished solution passed the
+            optimality checks, per resample.
+        """
+        support = weights > 1e-7
+        try:
+            w_a, _, nu_a, _ = self._frontier_line(support)
+        except np.linalg.LinAlgError:
+            return weights, np.zeros(self.n_boot, dtype=bool)
+        exact = self._check_frontier(w_a, np.zeros(self.n_boot), nu_a,
+                                     support)
+        weights = np.where(exact[:, np.newaxis], self._clean_weights(w_a),
+                           weights)
+
+        return weights, exact
+
+    def _polish_frontier(self, weights: np.ndarray, tgt_stddev: np.ndarray,
+                         active: np.ndarray) -> Tuple[np.ndarray,
+                                                      np.ndarray]:
+        """
+        Solve for the frontier portfolio with the target volatility
+            exactly on the holdings found by the bisection. Since the
+            solution is affine in s for fixed holdings, the volatility
+            target is a quadratic in s.
+        :param weights: The approximate solutions.
+        :param tgt_stddev: The target standard deviation per resample.
+        :param active: A boolean mask of the resamples to polish.
+        :return weights: The polished solutions.
+        :return exact: Whether the polished solution passed the
+            optimality checks, per resample.
+        """
+        support = np.nan_to_num(weights) > 1e-7
+        try:
+            exact_w, s_val, nu, valid = self._frontier_point(support,
+                                                             tgt_stddev)
+        except np.linalg.LinAlgError:
+            return weights, np.zeros(self.n_boot, dtype=bool)
+
+        exact = active & valid & \
+            self._check_frontier(exact_w, s_val, nu, support)
+        weights = np.where(exact[:, np.newaxis],
+                           self._clean_weights(exact_w), weights)
+
+        return weights, exact
+
+    def _frontier_point(self, support: np.ndarray,
+                        tgt_stddev: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        Solve for the frontier portfolio with the target volatility on
+            the given holdings. Since the solution is affine in s for
+            fixed holdings, the volatility target is a quadratic in s.
+        :return weights: The weights, which may not be long only.
+        :return s_val: The value of s for each solution.
+        :return nu: The budget multiplier for each solution.
+        :return valid: Whether the target could be reached on the rising
+            side of the frontier on the holdings.
+        """
+        w_a, w_c, nu_a, nu_c = self._frontier_line(support)
+
+        # solve the quadratic for the root on the rising side
+        cov_c = self._cov_dot(w_c)
+        quad_a = np.einsum('bn,bn->b', w_c, cov_c)
+        quad_b = np.einsum('bn,bn->b', w_a, cov_c)
+        quad_c = np.einsum('bn,bn->b', w_a, self._cov_dot(w_a)) - \
+            tgt_stddev ** 2
+        disc = quad_b ** 2 - quad_a * quad_c
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s_val = (-quad_b + np.sqrt(np.maximum(disc, 0))) / quad_a
+        weights = w_a + s_val[:, np.newaxis] * w_c
+        nu = nu_a + s_val * nu_c
+
+        return weights, s_val, nu, (disc >= 0) & (s_val >= 0)
+
+    def _walk_frontier(self, weights: np.ndarray, tgt_stddev: np.ndarray,
+                       active: np.ndarray,
+                       max_steps: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Move from the holdings of a nearby frontier portfolio to the ones
+            for the target volatility, like an active set method. Each
+            step solves exactly on the current holdings and, where that
+            isn't optimal, drops the assets that went short and adds the
+            ones whose multipliers say they should be held.
+        :param weights: The nearby solutions.
+        :param tgt_stddev: The target standard deviation per resample.
+        :param active: A boolean mask of the resamples to solve.
+        :param max_steps: The most changes of holdings to try.
+        :return weights: The solutions, where they were found.
+        :return exact: Whether each solution was found and is optimal.
+        """
+        weights = np.nan_to_num(weights)
+        support = weights > 1e-7
+        # a resample with no holdings has nothing to start from, so try
+        # holding everything
+        support[~support.any(axis=1)] = True
+        exact = np.zeros(self.n_boot, dtype=bool)
+        for _ in range(max_steps):
+            rows = np.flatnonzero(active & ~exact)
+            if not rows.size:
+                break
+            # only solve the resamples that are left, since a few can take
+            # many more steps than the rest
+            sub = self._subset(rows)
+            sub_support = support[rows]
+            try:
+                step_w, s_val, nu, valid = sub._frontier_point(
+                    sub_support, tgt_stddev[rows])
+            except np.linalg.LinAlgError:
+                break
+            solved = valid & sub._check_frontier(step_w, s_val, nu,
+                                                 sub_support)
+            weights[rows[solved]] = sub._clean_weights(step_w[solved])
+            exact[rows[solved]] = True
+
+            scale = np.abs(sub.cov).max(axis=(1, 2))[:, np.newaxis]
+            mult = sub._cov_dot(step_w) - s_val[:, np.newaxis] * sub.mu + \
+                nu[:, np.newaxis]
+            new_support = (sub_support & ~(step_w < -1e-10)) | \
+                (~sub_support & (mult < -1e-8 * scale))
+            new_support[~new_support.any(axis=1)] = True
+            support[rows[~solved]] = new_support[~solved]
+
+        return weights, exact
+
+    def _solve_polished(self, weights: np.ndarray, linear: np.ndarray,
+                        project, polish, round_iter: int = 100) -> np.ndarray:
+        """
+        Get close with a round of cheap projected gradient steps, then
+            solve exactly on the holdings found. Only the problems where
+            the holdings weren't right yet get another round, until we
+            reach the maximum number of steps.
+        :param weights: The starting weights with shape (n_boot, N).
+        :param linear: The linear term of the objective for each problem.
+        :param project: The projection onto the feasible set.
+        :param polish: The exact solve on the holdings found, which also
+            reports which problems it solved.
+        :param round_iter: The number of steps in each round.
+        :return weights: The optimal weights.
+        """
+        remaining = np.ones(self.n_boot, dtype=bool)
+        for _ in range(max(self.max_iter // round_iter, 1)):
+            weights = self._solve_qp(weights, linear, project, remaining,
+                                     max_iter=round_iter, tol=self.tol)
+            polished, exact = polish(weights)
+            weights = np.where((remaining & exact)[:, np.newaxis], polished,
+                               weights)
+            remaining &= ~exact
+            if not remaining.any():
+                break
+
+        return weights
+
+    def min_variance(self) -> np.ndarray:
+        """
+        Find the minimum variance portfolio for each resample.
+        :return weights: The weights with shape (n_boot, N).
+        """
+        x0 = np.full((self.n_boot, self.n_assets), 1 / self.n_assets)
+
+        return self._solve_polished(x0, np.zeros_like(self.mu),
+                                    self._project_simplex,
+                                    self._polish_min_variance)
+
+    def sharpe_ratio(self) -> np.ndarray:
+        """
+        Find the maximum Sharpe Ratio portfolio for each resample. The
+            Sharpe Ratio is scale invariant, so this solves the
+            equivalent problem min 0.5 * y'Sy - mu'y over y >= 0 and
+            rescales y to be fully invested.
+        :return weights: The weights with shape (n_boot, N).
+        """
+        y0 = np.zeros((self.n_boot, self.n_assets))
+        y = self._solve_polished(y0, self.mu, self._project_positive,
+                                 self._polish_sharpe)
+        total = y.sum(axis=1)
+
+        weights = np.zeros_like(y)
+        has_sol = total > 0
+        weights[has_sol] = y[has_sol] / total[has_sol, np.newaxis]
+        # if no asset has a positive mean, the best we can do is hold the
+        # asset with the least negative Sharpe Ratio
+        if not has_sol.all():
+            asset_vol = np.sqrt(np.diagonal(self.cov, axis1=1, axis2=2))
+            asset_sharpe = self.mu / np.maximum(asset_vol,
+                                                np.finfo(float).tiny)
+            best = np.argmax(asset_sharpe[~has_sol], axis=1)
+            weights[np.flatnonzero(~has_sol), best] = 1
+
+        return weights
+
+    def _bisect_frontier(self, weights: np.ndarray, tgt_stddev: np.ndarray,
+                         s_lo: np.ndarray, s_hi: np.ndarray,
+                         active: np.ndarray, bisect_iter: int,
+                         max_iter: int = None,
+                         tol: float = None) -> np.ndarray:
+        """
+        Bisect on s for the frontier portfolio with the target volatility,
+            warm starting each inner solve from the last one.
+        :return weights: The weights from the last bisection step.
+        """
+        for _ in range(bisect_iter):
+            s_mid = (s_lo + s_hi) / 2
+            weights = self._solve_qp(weights, s_mid[:, np.newaxis] * self.mu,
+                                     self._project_simplex, active,
+                                     max_iter=max_iter, tol=tol)
+            too_low = self.stddev(weights) < tgt_stddev
+            s_lo = np.where(too_low, s_mid, s_lo)
+            s_hi = np.where(too_low, s_hi, s_mid)
+
+        return weights
+
+    @staticmethod
+    def max_return_on_edges(mu: np.ndarray, cov: np.ndarray,
+                            tgt_stddev: np.ndarray) -> np.ndarray:
+        """
+        Find the maximum return portfolio with a standard deviation equal
+            to a target above the volatility of the highest returning
+            asset, where getting to the target means giving up return.
+
+        The set of long-only portfolios that are at least as volatile as
+            the target isn't convex, but along any line of equal return
+            the volatility is highest at the ends, so one of the best
+            portfolios holds at most two assets. Along the edge between
+            two assets the variance is a quadratic in the weight of the
+            second, so we solve it for every pair and keep the highest
+            return. This is exact and deterministic, so every engine gets
+            the same answer.
+        :param mu: The mean returns with shape (n_boot, N).
+        :param cov: The covariance matrices with shape (n_boot, N, N).
+        :param tgt_stddev: The target standard deviations with shape
+            (n_boot,).
+        :return weights: The weights with shape (n_boot, N). Targets that
+            no portfolio meets, such as ones above the volatility of every
+            asset, are a row of NaNs.
+        """
+        n_boot, n_assets = mu.shape
+        asset_var = np.diagonal(cov, axis1=1, axis2=2)
+        # every pair of assets, with each asset on its own as a pair with
+        # itself, so a target equal to one asset's volatility is covered
+        first, second = np.triu_indices(n_assets)
+        var_a = asset_var[:, first]
+        var_b = asset_var[:, second]
+        cov_ab = cov[:, first, second]
+        tgt_var = tgt_stddev[:, np.newaxis] ** 2
+        # the variance at weight t on the second asset is
+        # quad * t^2 + lin * t + var_a
+        quad = var_a - 2 * cov_ab + var_b
+        lin = 2 * (cov_ab - var_a)
+        root = np.sqrt(np.maximum(lin ** 2 - 4 * quad * (var_a - tgt_var),
+                                  0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_val = np.stack([(-lin - root) / (2 * quad),
+                              (-lin + root) / (2 * quad)], axis=-1)
+        # the variance doesn't change along the edge if the pair is the
+        # same asset, or two perfectly correlated ones as volatile
+        t_val = np.where(np.isfinite(t_val), t_val, 0)
+        t_val = np.clip(t_val, 0, 1)
+        t_var = (quad[..., np.newaxis] * t_val + lin[..., np.newaxis]) * \
+            t_val + var_a[..., np.newaxis]
+        met = np.abs(np.sqrt(np.maximum(t_var, 0)) -
+                     tgt_stddev[:, np.newaxis, np.newaxis]) <= \
+            1e-6 * tgt_stddev[:, np.newaxis, np.newaxis]
+        ret = mu[:, first, np.newaxis] * (1 - t_val) + \
+            mu[:, second, np.newaxis] * t_val
+        ret = np.where(met, ret, -np.inf).reshape(n_boot, -1)
+
+        weights = np.full((n_boot, n_assets), np.nan)
+        best = np.argmax(ret, axis=1)
+        rows = np.flatnonzero(np.isfinite(ret[np.arange(n_boot), best]))
+        pair, end = np.divmod(best[rows], 2)
+        t_best = t_val[rows, pair, end]
+        weights[rows] = 0
+        np.add.at(weights, (rows, first[pair]), 1 - t_best)
+        np.add.at(weights, (rows, second[pair]), t_best)
+
+        return weights
+
+    def max_return(self, tgt_stddev: Union[float, np.ndarray],
+                   bisect_iter: int = 50,
+                   weights0: np.ndarray = None) -> np.ndarray:
+        """
+        Find the maximum return portfolio with a standard deviation equal
+            to the target for each resample.
+
+        Fully-invested portfolios on the efficient frontier are the
+            solutions of min 0.5 * w'Sw - s * mu'w over the simplex, and
+            their volatility increases with s, so we bisect on s for
+            every resample at once. Targets below the minimum variance
+            portfolio are met by scaling the max Sharpe Ratio portfolio
+            down and holding the rest in cash. Targets above the
+            volatility of the highest returning asset are past the top
+            of the frontier, and are solved exactly over every pair of
+            assets with max_return_on_edges. Targets above the
+            volatility of every asset are infeasible and get a row of
+            NaNs.
+        :param tgt_stddev: The target standard deviation, either one for
+            all resamples or one per resample.
+        :param bisect_iter: The number of bisection steps on s for any
+            resample that can't be solved exactly on the holdings found
+            by the coarse bisection.
+        :param weights0: The solutions for a nearby target, such as the
+            neighbouring point on the frontier. Their holdings are tried
+            first, and only the resamples where they aren't right for
+            this target are bisected.
+        :return weights: The weights with shape (n_boot, N).
+        """
+        tgt_stddev = np.broadcast_to(
+            np.asarray(tgt_stddev, dtype=float), (self.n_boot,)).copy()
+        weights = np.full((self.n_boot, self.n_assets), np.nan)
+
+        # a target above the volatility of every asset can't be met
+        asset_var = np.diagonal(self.cov, axis1=1, axis2=2)
+        feasible = tgt_stddev ** 2 <= asset_var.max(axis=1) * (1 + 1e-9)
+
+        # the top of the frontier is the highest returning asset, and a
+        # target above it has to give up return to take on more
+        # volatility
+        rows = np.arange(self.n_boot)
+        top = np.argmax(self.mu, axis=1)
+        top_vol = np.sqrt(asset_var[rows, top])
+        at_top = feasible & (tgt_stddev >= top_vol)
+        if at_top.any():
+            weights[at_top] = self.max_return_on_edges(
+                self.mu[at_top], self.cov[at_top], tgt_stddev[at_top])
+
+        # the bottom of the frontier is the minimum variance portfolio
+        if self._w_min is None:
+            self._w_min = self.min_variance()
+        w_min = self._w_min
+        min_vol = self.stddev(w_min)
+        in_cash = feasible & ~at_top & (tgt_stddev < min_vol)
+        if in_cash.any():
+            if self._w_sharpe is None:
+                self._w_sharpe = self.sharpe_ratio()
+            w_sharpe = self._w_sharpe
+            sharpe_vol = self.stddev(w_sharpe)
+            scale = tgt_stddev / np.maximum(sharpe_vol, np.finfo(float).tiny)
+            weights[in_cash] = w_sharpe[in_cash] * \
+                np.minimum(scale[in_cash], 1)[:, np.newaxis]
+
+        # everything else is on the frontier, so bisect on s between the
+        # minimum variance portfolio (s = 0) and the smallest s where the
+        # top asset alone is optimal
+        on_frontier = feasible & ~at_top & ~in_cash
+        # the holdings often stay the same between nearby targets, or only
+        # change by an asset or two, in which case a few exact solves are
+        # all we need. if that doesn't work, or there is no nearby target,
+        # walk up from the minimum variance portfolio instead, which only
+        # adds or drops an asset or two per step and costs a batched
+        # solve of the (N x N) systems, much less than a bisection step
+        for start in (weights0, w_min):
+            if start is None or not on_frontier.any():
+                continue
+            warm, exact = self._walk_frontier(start, tgt_stddev,
+                                              on_frontier, self.n_assets)
+            weights[exact] = warm[exact]
+            on_frontier &= ~exact
+        if on_frontier.any():
+            mu_top = self.mu[rows, top][:, np.newaxis]
+            cov_top = self.cov[rows, :, top]
+            var_top = asset_var[rows, top][:, np.newaxis]
+            gap = mu_top - self.mu
+            with np.errstate(divide='ignore', invalid='ignore'):
+                bound = np.where(gap > 0, (var_top - cov_top) / gap, 0)
+            s_lo = np.zeros(self.n_boot)
+            s_hi = np.maximum(bound.max(axis=1), 0) * (1 + 1e-6) + 1e-12
+            # a coarse bisection is enough to find the holdings, which we
+            # then solve exactly, and only the resamples where that
+            # didn't work get the full bisection
+            coarse = self._bisect_frontier(w_min, tgt_stddev, s_lo, s_hi,
+                                           on_frontier, 20, max_iter=30,
+                                           tol=1e-6)
+            coarse, exact = self._polish_frontier(coarse, tgt_stddev,
+                                                  on_frontier)
+            remaining = on_frontier & ~exact
+            if remaining.any():
+                coarse = self._bisect_frontier(coarse, tgt_stddev, s_lo,
+                                               s_hi, remaining, bisect_iter)
+            weights[on_frontier] = coarse[on_frontier]
+
+        return weights
+
+    def efficient_frontier(self, tgt_stddevs: np.ndarray) -> np.ndarray:
+        """
+        Find the maximum return portfolio for each of several target
+            standard deviations for every resample, walking along the
+            frontier from the lowest target to the highest so that each
+            target starts from the holdings of its neighbour. The moments
+            and the ends of the frontier are shared by every target.
+        :param tgt_stddevs: The target standard deviations, either with
+            shape (K,) for all resamples or (n_boot, K) for one set per
+            resample.
+        :return weights: The weights with shape (n_boot, K, N), in the
+            same order as the targets. Targets that have no solution are
+            a row of NaNs.
+        """
+        tgt_stddevs = np.asarray(tgt_stddevs, dtype=float)
+        tgt_stddevs = np.broadcast_to(
+            tgt_stddevs, (self.n_boot, tgt_stddevs.shape[-1]))
+        weights = np.full((self.n_boot, tgt_stddevs.shape[1],
+                           self.n_assets), np.nan)
+
+        prev_weights = None
+        for k in np.argsort(tgt_stddevs.mean(axis=0)):
+            weights[:, k] = self.max_return(tgt_stddevs[:, k],
+                                            weights0=prev_weights)
+            prev_weights = weights[:, k]
+
+        return weights
+
+    def optimize(self, method: str = 'sharpe_ratio',
+                 tgt_stddev: Union[float, np.ndarray] = None) -> np.ndarray:
+        """
+        Run the optimization for every resample.
+        :param method: The method to use for optimization. Takes either
+            'sharpe_ratio' or 'max_return'.
+        :param tgt_stddev: The target standard deviation for the portfolio
+            if you need it to optimize with 'max_return', either one for
+            all resamples or one per resample.
+        :return weights: The weights with shape (n_boot, N). Resamples
+            that have no solution are a row of NaNs.
+        """
+        if method == 'sharpe_ratio':
+            return self.sharpe_ratio()
+
+        return self.max_return(tgt_stddev)
@@ -0,0 +1,102 @@
+"""
+Define metrics about many portfolios at once.
+:class BatchPortfolioMetrics: Calculate metrics for a stack of weight
+    vectors over the same returns.
+"""
+
+from PortfolioOptimizer import GlobalVariables as gv
+
+import numpy as np
+import pandas as pd
+
+from typing import Union
+
+
+class BatchPortfolioMetrics(object):
+    """
+    Calculate metrics for a stack of weight vectors over the same returns,
+    such as the weights from every bootstrap sample. The returns of every
+    portfolio are worked out once, in a single matrix product, and every
+    metric is read from them, so the metrics for a hundred portfolios cost
+    about the same as for one.
+    """
+    def __init__(self, returns: Union[pd.DataFrame, np.ndarray],
+                 weights: Union[list, np.ndarray]) -> None:
+        """
+        :param returns: The (T x N) returns of the assets in the
+            portfolios.
+        :param weights: The (K x N) weights, one row per portfolio. A
+            single weight vector is also accepted.
+        """
+        weights = np.asarray(weights, dtype=float)
+        if weights.ndim == 1:
+            weights = weights[np.newaxis, :]
+        self.weights = weights
+        # the (T x K) returns of every portfolio
+        self.port_returns = np.asarray(returns, dtype=float) @ weights.T
+
+    def mean(self) -> np.ndarray:
+        """
+        Calculate the mean of each portfolio.
+        :return mean: The annualized mean of each portfolio.
+        """
+        return self.port_returns.mean(axis=0) * 252
+
+    def stddev(self) -> np.ndarray:
+        """
+        Calculate the standard deviation of each portfolio.
+        :return stddev: The annualized standard deviation of each
+            portfolio.
+        """
+        return self.port_returns.std(axis=0) * np.sqrt(252)
+
+    def sharpe_ratio(self) -> np.ndarray:
+        """
+        Calculate the Sharpe ratio of each portfolio.
+        :return sharpe_ratio: The Sharpe ratio of each portfolio.
+        """
+        return self.mean() / self.stddev()
+
+    def max_drawdown(self) -> np.ndarray:
+        """
+        Calculate the largest drop from a peak of each portfolio.
+        :return max_drawdown: The largest drop from a peak in the value
+            of each portfolio, as a fraction of the peak.
+        """
+        wealth = np.cumprod(1 + self.port_returns, axis=0)
+        peaks = np.maximum.accumulate(wealth, axis=0)
+
+        return np.max(1 - wealth / peaks, axis=0)
+
+    def value_at_risk(self, level: float = gv.DEFAULT_VAR_LEVEL) \
+            -> np.ndarray:
+        """
+        Calculate the historical value at risk of each portfolio.
+        :param level: The confidence level, such as 0.95.
+        :return value_at_risk: The daily loss that each portfolio only
+            did worse than 1 - level of the time, as a positive number.
+        """
+        return -np.quantile(self.port_returns, 1 - level, axis=0)
+
+    def metrics(self, drawdown: bool = False, var: bool = False) -> dict:
+        """
+        Calculate every metric for each portfolio.
+        :param drawdown: Whether to include the max drawdown.
+        :param var: Whether to include the value at risk.
+        :return metrics: The metrics, each as an array with one value per
+            portfolio. Includes the average, volatility, and Sharpe ratio,
+            and the max drawdown and value at risk if asked for.
+        """
+        mean = self.mean()
+        stddev = self.stddev()
+        metrics = {
+            'Average': mean,
+            'Volatility': stddev,
+            'Sharpe Ratio': mean / stddev
+        }
+        if drawdown:
+            metrics['Max Drawdown'] = self.max_drawdown()
+        if var:
+            metrics['Value at Risk'] = self.value_at_risk()
+
+        return metrics
@@ -0,0 +1,228 @@
+"""
+Runs many portfolio requests at once, without the app.
+:class BatchRun: Runs the pipeline for a file of portfolio specs, sharing
+    the data, caches and worker pool between them, and writes the results.
+:func main: Runs a batch from the command line.
+"""
+
+from PortfolioOptimizer import GlobalVariables as gv
+from PortfolioOptimizer import SharedStates as shared
+from PortfolioOptimizer.DataTools import DataTools
+from PortfolioOptimizer.Pipeline import Pipeline
+from PortfolioOptimizer.TimingTools import get_timer, profile
+
+import argparse
+import contextlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import time
+
+from typing import Callable
+
+
+class BatchRun(object):
+    """
+    Runs the pipeline for a file of portfolio specs, sharing the data,
+    caches and worker pool between them, and writes the results. Each
+    spec is a set of investments and the objectives to run for them, so
+    a file of client portfolios can be scored overnight rather than one
+    click at a time in the app.
+    """
+    def __init__(self, pipeline: Pipeline = None,
+                 client_id: str = 'batch') -> None:
+        """
+        :param pipeline: The pipeline to run the specs with. If None, we
+            use one that checks the precomputed results first.
+        :param client_id: The client to queue worker pool tasks under.
+        """
+        self.pipeline = pipeline or Pipeline()
+        self.client_id = client_id
+
+    @staticmethod
+    def load_specs(path: str) -> list:
+        """
+        Load portfolio specs from a JSON file, which is either a list of
+            specs or one spec per line. Each spec has 'investments', a
+            list of investment names, and optionally 'objectives', a list
+            of objective names that defaults to every objective, and
+            'id', which defaults to the spec's position in the file.
+        :param path: The path of the file.
+        :return specs: The specs, with every field filled in.
+        """
+        with open(path) as f:
+            text = f.read().strip()
+        if text.startswith('['):
+            specs = json.loads(text)
+        else:
+            specs = [json.loads(x) for x in text.splitlines() if x.strip()]
+
+        return BatchRun.check_specs(specs)
+
+    @staticmethod
+    def check_specs(specs: list) -> list:
+        """
+        Check that every spec only names known investments and
+            objectives, and fill in the optional fields, so a bad spec
+            fails before anything runs rather than halfway through.
+        :param specs: The specs, as dictionaries.
+        :return specs: The specs, with every field filled in.
+        """
+        checked = []
+        for i, spec in enumerate(specs):
+            spec_id = str(spec.get('id', i))
+            investments = list(spec.get('investments') or [])
+            objectives = list(spec.get('objectives') or
+                              gv.OBJECTIVE_CHOICES.keys())
+            if not investments:
+                raise ValueError(f"Spec {spec_id} has no investments.")
+            unknown = [x for x in investments if x not in
+                       gv.SECURITY_MAPPING] + \
+                      [x for x in objectives if x not in
+                       gv.OBJECTIVE_CHOICES]
+            if unknown:
+                raise ValueError(f"Spec {spec_id} has unknown investments "
+                                 f"or objectives: {unknown}.")
+            checked.append({'id': spec_id, 'investments': investments,
+                            'objectives': objectives})
+
+        return checked
+
+    def run(self, return_data: pd.DataFrame, specs: list,
+            bootstrap: bool = True, tol: float = None,
+            on_result: Callable[[int, int], None] = None) -> pd.DataFrame:
+        """
+        Run the pipeline for every spec and objective.
+        :param return_data: The return data for all investments.
+        :param specs: The specs, as returned by check_specs.
+        :param bootstrap: Whether to bootstrap the optimizations.
+        :param tol: If given, the bootstraps stop once the standard error
+            of every average weight is under it, drawing more than the
+            usual number of samples if needed for data without gaps.
+        :param on_result: Called with the number of results done and the
+            total after each one, to report progress.
+        :return results: One row per spec and objective, with the spec's
+            id, investments and objective, a column with the weight of
+            every investment, which is NaN for those not in the spec, the
+            weight in cash, and the metrics for the portfolio and, for
+            the stock and bond mixes, the benchmark. The weights and
+            metrics are NaN if there is no solution.
+        """
+        total = sum(len(x['objectives']) for x in specs)
+        rows = []
+        for spec in specs:
+            for objective in spec['objectives']:
+                weights, metrics = self.pipeline.run(
+                    spec['investments'], objective, return_data,
+                    bootstrap=bootstrap, client_id=self.client_id, tol=tol)
+                rows.append(self._row(spec, objective, weights, metrics))
+                if on_result is not None:
+                    on_result(len(rows), total)
+
+        columns = ['id', 'investments', 'objective'] + \
+            list(gv.SECURITY_MAPPING.keys()) + ['Cash'] + \
+            [y + x for y in ('', 'Bench ') for x in
+             ('Average', 'Volatility', 'Sharpe Ratio')]
+
+        return pd.DataFrame(rows, columns=columns)
+
+    @staticmethod
+    def _row(spec: dict, objective: str, weights: pd.Series,
+             metrics: dict) -> dict:
+        """Get the row of results for a spec and objective."""
+        row = {'id': spec['id'], 'investments': '+'.join(spec['investments']),
+               'objective': objective}
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)
+            row.update(zip(spec['investments'], weights))
+            row['Cash'] = 1 - weights.sum()
+        if metrics is not None:
+            for name, values in metrics.items():
+                row[name] = values[0]
+                # the second value is for the benchmark, if there is one
+                if len(values) > 1:
+                    row['Bench ' + name] = values[1]
+
+        return row
+
+    @staticmethod
+    def write(results: pd.DataFrame, path: str) -> None:
+        """
+        Write the results as Parquet or JSON, depending on the extension
+            of the path.
+        :param results: The results, as returned by run.
+        :param path: The path to write to, ending in '.parquet' or
+            '.json'.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if path.endswith('.parquet'):
+            results.to_parquet(path, index=False)
+        elif path.endswith('.json'):
+            results.to_json(path, orient='records', indent=1)
+        else:
+            raise ValueError("The output path needs to end in '.parquet' "
+                             "or '.json'.")
+
+
+def main(argv: list = None) -> None:
+    """Runs a batch from the command line."""
+    parser = argparse.ArgumentParser(
+        description="Run the optimization for a file of portfolio specs.")
+    parser.add_argument('specs',
+                        help="a JSON file with a list of specs, or one "
+                             "spec per line")
+    parser.add_argument('output',
+                        help="where to write the results, ending in "
+                             "'.parquet' or '.json'")
+    parser.add_argument('--no-bootstrap', action='store_true',
+                        help="run the optimizations without bootstrapping")
+    parser.add_argument('--tol', type=float, default=None,
+                        help="stop each bootstrap once the standard error "
+                             "of every average weight is under this, "
+                             "drawing more samples if needed")
+    parser.add_argument('--timings', default=None,
+                        help="where to write the time spent in each stage, "
+                             "as JSON or, ending in '.prom', as Prometheus "
+                             "counters")
+    parser.add_argument('--profile', default=None,
+                        help="where to write a profile of the run, with "
+                             "pyinstrument if it ends in '.html' and "
+                             "cProfile otherwise")
+    parser.add_argument('--credentials', default=None,
+                        help="the BigQuery service account file to pull "
+                             "new data with, which defaults to the path "
+                             f"in {gv.GCP_CREDENTIALS_ENV}")
+    args = parser.parse_args(argv)
+    # check the output before a long run rather than after it
+    if not args.output.endswith(('.parquet', '.json')):
+        parser.error("the output path needs to end in '.parquet' or "
+                     "'.json'")
+
+    start_time = time.time()
+    specs = BatchRun.load_specs(args.specs)
+    # the data is pulled once and shared by every spec
+    return_data = shared.state_pull_return_data(
+        DataTools().pull_ticker_tables(), args.credentials)
+
+    def report(done, total):
+        print(f"\r{done} / {total} done", end='', flush=True)
+
+    with profile(args.profile) if args.profile else \
+            contextlib.nullcontext():
+        results = BatchRun().run(return_data, specs,
+                                 bootstrap=not args.no_bootstrap,
+                                 tol=args.tol, on_result=report)
+    BatchRun.write(results, args.output)
+    if args.timings is not None and args.timings.endswith('.prom'):
+        get_timer().to_prometheus(path=args.timings)
+    elif args.timings is not None:
+        get_timer().to_json(args.timings)
+    print(f"\nRan {len(results)} results in "
+          f"{round(time.time() - start_time, 1)} seconds.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,570 @@
+"""
+Measures how fast the optimization hot paths are, so a change can be
+shown to help or caught making things slower.
+:class Benchmark: Times the hot paths on synthetic or recorded return
+    data, keeps a history of the results and flags regressions.
+:class FakeBigQueryClient: A stand-in for the BigQuery client that
+    answers the price queries from tables in memory.
+:func main: Runs the benchmarks from the command line.
+"""
+
+from PortfolioOptimizer import GlobalVariables as gv
+from PortfolioOptimizer.AnalyticTools import AnalyticTools
+from PortfolioOptimizer.DataTools import DataTools
+from PortfolioOptimizer.GCPTools import GCPTools
+from PortfolioOptimizer.Optimizer import Optimizer
+from PortfolioOptimizer.PortfolioMetrics import PortfolioMetrics
+
+import argparse
+import json
+import numpy as np
+import os
+import pandas as pd
+import platform
+import pyarrow as pa
+import re
+import sys
+import time
+import tracemalloc
+
+from typing import Callable, Union
+
+
+class FakeBigQueryClient(object):
+    """
+    A stand-in for the BigQuery client that answers the queries
+    GCPTools._tables_sql builds, on their own or joined by UNION ALL,
+    from tables in memory. This lets the pull be checked without the
+    network. The results can be read as Arrow, or only as a DataFrame
+    like when the Storage client isn't available.
+    """
+    # one SELECT of GCPTools._tables_sql, with its optional date filter
+    STATEMENT = re.compile(r"SELECT '(\w+)' AS table_name, (.+) "
+                           r"FROM `[\w-]+\.\w+\.(\w+)`"
+                           r"(?: WHERE date > '([\d-]+)')?$")
+
+    def __init__(self, tables: dict, arrow: bool = True) -> None:
+        """
+        :param tables: The DataFrame of each table, by name.
+        :param arrow: Whether the results can be read as Arrow.
+        """
+        self.tables = tables
+        self.arrow = arrow
+
+    def query(self, sql_statement: str) -> '_FakeRows':
+        """
+        Run a query.
+        :param sql_statement: The query, as built by GCPTools.
+        :return rows: The rows, which stand in for both the query job and
+            its result.
+        """
+        dfs = []
+        for statement in sql_statement.split(' UNION ALL '):
+            match = self.STATEMENT.match(statement)
+            if match is None:
+                raise ValueError(f"Can't answer the query: {statement}")
+            label, columns, table_name, after = match.groups()
+            df = self.tables[table_name]
+            if after is not None:
+                df = df[df['date'] > pd.Timestamp(after).date()]
+            df = df[columns.split(', ')]
+            df.insert(0, 'table_name', label)
+            dfs.append(df)
+        rows = pd.concat(dfs, ignore_index=True)
+
+        return _FakeArrowRows(rows) if self.arrow else _FakeRows(rows)
+
+
+class _FakeRows(object):
+    """The result of a FakeBigQueryClient query."""
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.df = df
+
+    def result(self) -> '_FakeRows':
+        return self
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return self.df.copy()
+
+
+class _FakeArrowRows(_FakeRows):
+    """The result of a FakeBigQueryClient query that can be read as
+        Arrow."""
+    def to_arrow(self, create_bqstorage_client: bool = True) -> pa.Table:
+        return pa.Table.from_pandas(self.df, preserve_index=False)
+
+
+class Benchmark(object):
+    """
+    Times the hot paths on synthetic or recorded return data, keeps a
+    history of the results as JSON and flags regressions against an
+    earlier run. The synthetic data is drawn from a seeded factor model,
+    so the same settings always give the same data.
+    """
+    # the stock/bond mix used for the max_return cases
+    OBJECTIVE = '60% Stock / 40% Bond Equivalent'
+    SHARPE_OBJECTIVE = 'Max Sharpe Ratio (Return/Risk)'
+
+    def __init__(self, return_data: pd.DataFrame,
+                 repeat: int = gv.DEFAULT_BENCHMARK_REPEAT,
+                 seed: int = 0) -> None:
+        """
+        :param return_data: The return data to run on, which needs the
+            benchmark columns 'acwi' and 'bnd'.
+        :param repeat: The number of timed calls of each case. The slow
+            end-to-end cases use a fifth of this.
+        :param seed: The seed for the bootstraps and imputations.
+        """
+        self.return_data = return_data
+        self.repeat = repeat
+        self.seed = seed
+        # the optimizations run on the columns without missing data and
+        # the imputation on the rest
+        has_missing = return_data.isnull().any()
+        self.user_data = return_data.loc[:, ~has_missing]
+        self.missing_columns = list(return_data.columns[has_missing])
+
+    @staticmethod
+    def synthetic_data(rows: int = gv.DEFAULT_BENCHMARK_ROWS,
+                       cols: int = gv.DEFAULT_BENCHMARK_COLS,
+                       missing: int = gv.DEFAULT_BENCHMARK_MISSING,
+                       missing_frac: float = 0.5,
+                       seed: int = 0) -> pd.DataFrame:
+        """
+        Make a panel of daily returns from a factor model.
+        :param rows: The number of days.
+        :param cols: The number of investments, at least 2. The first
+            ones are named after the investments in the app, starting
+            with the benchmark's, and any beyond that are made up.
+        :param missing: The number of investments, taken from the end,
+            that start late, like newer funds.
+        :param missing_frac: The fraction of the days that the late
+            investments are missing.
+        :param seed: The seed for the data.
+        :return return_data: The returns for each investment.
+        """
+        tickers = [x[0].split('.')[0].lower() for x in
+                   gv.SECURITY_MAPPING.values()]
+        tickers = ['acwi', 'bnd'] + [x for x in tickers if
+                                     x not in ('acwi', 'bnd')]
+        tickers += [f'syn{i}' for i in range(max(cols - len(tickers), 0))]
+        tickers = tickers[:max(cols, 2)]
+
+        rng = np.random.default_rng(seed)
+        factors = rng.normal(size=(rows, 3)) * 0.008
+        loadings = rng.normal(size=(3, len(tickers))) * 0.6
+        returns = factors @ loadings + \
+            rng.normal(size=(rows, len(tickers))) * 0.004 + \
+            rng.normal(0.0003, 0.0002, len(tickers))
+        return_data = pd.DataFrame(
+            returns, index=pd.bdate_range('2010-01-04', periods=rows),
+            columns=tickers)
+        for col in tickers[len(tickers) - min(missing, len(tickers) - 2):]:
+            return_data.iloc[:int(rows * missing_frac),
+                             return_data.columns.get_loc(col)] = np.nan
+
+        return return_data
+
+    @staticmethod
+    def band_data(rows: int = gv.DEFAULT_BENCHMARK_ROWS,
+                  cols: int = gv.DEFAULT_BENCHMARK_COLS,
+                  seed: int = 0) -> pd.DataFrame:
+        """
+        Make synthetic data where the highest returning investment is
+            quieter than the stock/bond mixes, so their targets are past
+            the top of the efficient frontier and have to give up return
+            to take on volatility.
+        :param rows: The number of days.
+        :param cols: The number of investments, at least 3.
+        :param seed: The seed for the data.
+        :return return_data: The returns for each investment, with no
+            missing data.
+        """
+        return_data = Benchmark.synthetic_data(rows, max(cols, 3), 0,
+                                               seed=seed)
+        rng = np.random.default_rng(seed)
+        # a loud benchmark and a quiet investment with the best return
+        return_data['acwi'] *= 2.5
+        return_data.iloc[:, 2] = rng.normal(0.002, 0.006, rows)
+
+        return return_data
+
+    @staticmethod
+    def record_fixture(path: str = gv.BENCHMARK_FIXTURE_PATH) -> None:
+        """
+        Record the real return data as a fixture, so later runs time the
+            same real data without going to the network.
+        :param path: Where to write the fixture, as Parquet.
+        """
+        data_engine = DataTools()
+        return_data = data_engine.pull_return_data(
+            data_engine.pull_ticker_tables())
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return_data.to_parquet(path)
+
+    @staticmethod
+    def measure(fn: Callable[[], None], repeat: int) -> dict:
+        """
+        Time a function and find the most memory it uses.
+        :param fn: The function to time, which takes no arguments.
+        :param repeat: The number of timed calls, after one untimed call
+            to warm up any caches.
+        :return stats: The number of calls, the mean and the 50th, 90th
+            and 99th percentiles of the latency in milliseconds, the calls
+            per second and the peak memory in MB. The memory only counts
+            this process, not any worker processes.
+        """
+        fn()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        times = np.array(times) * 1000
+
+        # the memory is measured on a separate call since tracing slows
+        # everything down
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return {'calls': repeat,
+                'mean_ms': float(times.mean()),
+                'p50_ms': float(np.percentile(times, 50)),
+                'p90_ms': float(np.percentile(times, 90)),
+                'p99_ms': float(np.percentile(times, 99)),
+                'throughput_per_s': float(1000 / times.mean()),
+                'peak_mb': peak / 1024 ** 2}
+
+    def cases(self) -> dict:
+        """
+        Get the cases to time.
+        :return cases: The function for each case and the number of timed
+            calls, by name.
+        """
+        data_engine = DataTools()
+        analytics_engine = AnalyticTools()
+        user_data = self.user_data
+        slow = max(self.repeat // 5, 1)
+
+        # the same scaling and target as AnalyticTools.run_optimization
+        tgt_stddev = float(analytics_engine._stock_bond_vol(
+            self.return_data, self.OBJECTIVE)) * 100 ** 2
+        weights = np.ones(user_data.shape[1]) / user_data.shape[1]
+        investments = [f'Investment {i}' for i in range(user_data.shape[1])]
+
+        cases = {
+            'optimize[sharpe_ratio]': (lambda: Optimizer(
+                user_data * 100).optimize('sharpe_ratio'), self.repeat),
+            'optimize[max_return]': (lambda: Optimizer(
+                user_data * 100).optimize('max_return', tgt_stddev),
+                self.repeat),
+            'get_bootstrap_data_ts': (lambda: list(
+                data_engine.get_bootstrap_data_ts(
+                    user_data, self.seed, gv.DEFAULT_BOOTSTRAP_COUNT,
+                    trunc=gv.DEFAULT_BOOTSTRAP_TRUNC)), self.repeat),
+            'bootstrap_optimization': (
+                lambda: analytics_engine.bootstrap_optimization(
+                    user_data, 'sharpe_ratio', self.SHARPE_OBJECTIVE,
+                    self.return_data, client_id='benchmark',
+                    seed=self.seed), slow),
+            'PortfolioMetrics': (lambda: self._metrics(user_data, weights),
+                                 self.repeat),
+            'create_html_table': (lambda: self._html_table(investments,
+                                                           weights),
+                                  self.repeat),
+        }
+        if self.missing_columns:
+            cases['pmm'] = (lambda: list(data_engine.pmm(
+                self.return_data, gv.DEFAULT_IMPUTE_COUNT,
+                self.missing_columns, seed=self.seed,
+                client_id='benchmark')), slow)
+
+        return cases
+
+    @staticmethod
+    def _html_table(investments: list, weights: np.ndarray) -> None:
+        """Make the weights table like the app does."""
+        # this is the only case that needs streamlit, so the rest of the
+        # package can run without it
+        from PortfolioOptimizer.StreamlitTools import StreamlitTools
+        StreamlitTools().create_html_table(
+            50, 'Asset Classes', ['Weight (%)'],
+            {a: [w] for a, w in zip(investments, weights)}, 'percent',
+            decimals=0)
+
+    @staticmethod
+    def _metrics(user_data: pd.DataFrame, weights: np.ndarray) -> None:
+        """Work out every metric for a portfolio, like the app does."""
+        metrics_engine = PortfolioMetrics(user_data, weights)
+        metrics_engine.mean()
+        metrics_engine.stddev()
+        metrics_engine.sharpe_ratio()
+
+    def run(self, names: list = None) -> dict:
+        """
+        Time the cases.
+        :param names: The cases to time. If None, we time every case.
+        :return results: The stats for each case, by name, as returned
+            by measure.
+        """
+        results = {}
+        for name, (fn, repeat) in self.cases().items():
+            if names is None or name in names:
+                results[name] = self.measure(fn, repeat)
+
+        return results
+
+    def agreement(self, bs_count: int = 30) -> dict:
+        """
+        Check that the batched and process engines give the same average
+            weights for every objective, since the bootstrap can be run on
+            either one.
+        :param bs_count: The number of bootstrap samples of each run.
+        :return differences: The largest absolute difference between the
+            weights of the two engines for each objective, by name. It is
+            infinite if only one of the engines found a solution.
+        """
+        analytics_engine = AnalyticTools()
+        differences = {}
+        for objective, (obj_func, _) in gv.OBJECTIVE_CHOICES.items():
+            weights = [analytics_engine.bootstrap_optimization(
+                self.user_data, obj_func, objective, self.return_data,
+                client_id='benchmark', bs_count=bs_count, seed=self.seed,
+                engine=engine) for engine in ('batched', 'process')]
+            if weights[0] is None and weights[1] is None:
+                differences[objective] = 0.0
+            elif weights[0] is None or weights[1] is None:
+                differences[objective] = float('inf')
+            else:
+                differences[objective] = float(np.abs(
+                    weights[0].to_numpy() - weights[1].to_numpy()).max())
+
+        return differences
+
+    @staticmethod
+    def pull_agreement(tickers: int = 4, rows: int = 300,
+                       seed: int = 0) -> dict:
+        """
+        Check that DataTools.pull_price_data gives the same wide frame of
+            prices from one UNION ALL query as from one query per table,
+            whether or not the results can be read as Arrow, with a
+            FakeBigQueryClient holding synthetic prices. The tickers start
+            on different days, like newer funds.
+        :param tickers: The number of tickers.
+        :param rows: The number of days of the longest ticker.
+        :param seed: The seed for the prices.
+        :return matches: Whether each way of pulling, by name, matches
+            the prices in the tables.
+        """
+        return_data = Benchmark.synthetic_data(rows, tickers, tickers - 2,
+                                               seed=seed)
+        prices = (1 + return_data).cumprod()
+        tables = [f'{ticker}_daily' for ticker in prices.columns]
+        table_data = {}
+        for table, ticker in zip(tables, prices.columns):
+            price = prices[ticker].dropna()
+            table_data[table] = pd.DataFrame({
+                'date': price.index.date, 'adjclose': price.to_numpy(),
+                'volume': 1000})
+        after = prices.index[rows // 2]
+
+        data_engine = DataTools()
+        matches = {}
+        for arrow in (True, False):
+            gcp_engine = GCPTools('bigquery', None, None,
+                                  client=FakeBigQueryClient(table_data,
+                                                            arrow))
+            for concurrent in (False, True):
+                for since in (None, after):
+                    expected = prices if since is None else \
+                        prices.loc[prices.index > since]
+                    price_data = data_engine.pull_price_data(
+                        tables, gcp_engine, since, concurrent)
+                    name = ' '.join([
+                        'per-table' if concurrent else 'union',
+                        'arrow' if arrow else 'dataframe',
+                        'all' if since is None else 'after'])
+                    matches[name] = price_data.equals(expected)
+
+        return matches
+
+    @staticmethod
+    def load_history(path: str = gv.BENCHMARK_HISTORY_PATH) -> list:
+        """Load the earlier runs, oldest first."""
+        try:
+            with open(path) as f:
+                return json.load(f)['runs']
+        except (OSError, ValueError, KeyError):
+            return []
+
+    @staticmethod
+    def save_run(run: dict, path: str = gv.BENCHMARK_HISTORY_PATH) -> None:
+        """Add a run to the history."""
+        runs = Benchmark.load_history(path) + [run]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # write to a temporary file first so a reader never sees half a
+        # file
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'runs': runs}, f, indent=1)
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def find_baseline(runs: list, config: dict, label: str = None) \
+            -> Union[dict, None]:
+        """
+        Find the run to compare against.
+        :param runs: The earlier runs, oldest first.
+        :param config: The settings of the current run.
+        :param label: The label of the baseline run. If None, we use the
+            latest run with the same settings.
+        :return baseline: The baseline run, or None if there isn't one.
+        """
+        for run in reversed(runs):
+            if label is not None and run.get('label') == label:
+                return run
+            if label is None and run.get('config') == config:
+                return run
+        return None
+
+    @staticmethod
+    def regressions(results: dict, baseline: dict,
+                    tol: float = gv.BENCHMARK_REGRESSION_TOL) -> dict:
+        """
+        Flag the cases that got slower than the baseline.
+        :param results: The stats for each case from this run.
+        :param baseline: The baseline run.
+        :param tol: How much slower the median latency can get, as a
+            fraction, before it counts as a regression.
+        :return regressions: The ratio of the median latency to the
+            baseline's for each case that regressed, by name.
+        """
+        flagged = {}
+        for name, stats in results.items():
+            base = baseline['results'].get(name)
+            if base is None or not base['p50_ms']:
+                continue
+            ratio = stats['p50_ms'] / base['p50_ms']
+            if ratio > 1 + tol:
+                flagged[name] = ratio
+
+        return flagged
+
+
+def main(argv: list = None) -> None:
+    """Runs the benchmarks from the command line, and exits with an error
+        if any case regressed or, when checked, the engines disagree or
+        the price pulls don't match."""
+    parser = argparse.ArgumentParser(
+        description="Time the optimization hot paths.")
+    parser.add_argument('--rows', type=int,
+                        default=gv.DEFAULT_BENCHMARK_ROWS,
+                        help="the number of days of synthetic data")
+    parser.add_argument('--cols', type=int,
+                        default=gv.DEFAULT_BENCHMARK_COLS,
+                        help="the number of investments of synthetic data")
+    parser.add_argument('--missing', type=int,
+                        default=gv.DEFAULT_BENCHMARK_MISSING,
+                        help="the number of investments that start late")
+    parser.add_argument('--fixture', nargs='?',
+                        const=gv.BENCHMARK_FIXTURE_PATH,
+                        help="run on the recorded real data instead of "
+                             "synthetic data")
+    parser.add_argument('--record-fixture', action='store_true',
+                        help="record the real data as the fixture first")
+    parser.add_argument('--repeat', type=int,
+                        default=gv.DEFAULT_BENCHMARK_REPEAT,
+                        help="the number of timed calls of each case")
+    parser.add_argument('--cases', default=None,
+                        help="a comma separated list of the cases to run")
+    parser.add_argument('--label', default=None,
+                        help="a label to save the run under")
+    parser.add_argument('--baseline', default=None,
+                        help="the label of the run to compare against, "
+                             "rather than the latest with the same "
+                             "settings")
+    parser.add_argument('--tol', type=float,
+                        default=gv.BENCHMARK_REGRESSION_TOL,
+                        help="how much slower a case can get before it "
+                             "counts as a regression")
+    parser.add_argument('--history', default=gv.BENCHMARK_HISTORY_PATH,
+                        help="where to keep the history of runs")
+    parser.add_argument('--check-engines', action='store_true',
+                        help="instead of timing, check that the batched "
+                             "and process engines agree, on this data and "
+                             "on data past the top of the frontier")
+    parser.add_argument('--check-pull', action='store_true',
+                        help="instead of timing, check that pulling the "
+                             "prices in one query or one per table gives "
+                             "the same data, with a fake BigQuery client")
+    args = parser.parse_args(argv)
+
+    if args.check_pull:
+        matches = Benchmark.pull_agreement()
+        for name, match in matches.items():
+            print(f"{name:<26} {'ok' if match else 'MISMATCH'}")
+        if not all(matches.values()):
+            sys.exit(1)
+        return
+
+    if args.record_fixture:
+        Benchmark.record_fixture(args.fixture or gv.BENCHMARK_FIXTURE_PATH)
+    if args.fixture:
+        return_data = pd.read_parquet(args.fixture)
+        config = {'data': 'fixture', 'rows': return_data.shape[0],
+                  'cols': return_data.shape[1], 'repeat': args.repeat}
+    else:
+        return_data = Benchmark.synthetic_data(args.rows, args.cols,
+                                               args.missing)
+        config = {'data': 'synthetic', 'rows': args.rows,
+                  'cols': args.cols, 'missing': args.missing,
+                  'repeat': args.repeat}
+
+    if args.check_engines:
+        disagree = False
+        for name, data in (('data', return_data),
+                           ('band', Benchmark.band_data(args.rows,
+                                                        args.cols))):
+            for objective, diff in Benchmark(data).agreement().items():
+                flag = ''
+                if diff > gv.BENCHMARK_AGREEMENT_TOL:
+                    flag = '  DISAGREE'
+                    disagree = True
+                print(f"{name:<5} {objective:<33} {diff:9.2e}{flag}")
+        if disagree:
+            sys.exit(1)
+        return
+
+    names = None if args.cases is None else args.cases.split(',')
+    results = Benchmark(return_data, args.repeat).run(names)
+    run = {'label': args.label, 'time': pd.Timestamp.now().isoformat(),
+           'python': platform.python_version(), 'cpus': os.cpu_count(),
+           'config': config, 'results': results}
+
+    baseline = Benchmark.find_baseline(Benchmark.load_history(args.history),
+                                       config, args.baseline)
+    flagged = {} if baseline is None else \
+        Benchmark.regressions(results, baseline, args.tol)
+    Benchmark.save_run(run, args.history)
+
+    for name, stats in results.items():
+        flag = f"  REGRESSED x{flagged[name]:.2f}" if name in flagged else ''
+        print(f"{name:<26} p50 {stats['p50_ms']:9.2f} ms  "
+              f"p90 {stats['p90_ms']:9.2f} ms  "
+              f"{stats['throughput_per_s']:9.1f}/s  "
+              f"peak {stats['peak_mb']:7.1f} MB{flag}")
+    if baseline is None:
+        print("No baseline to compare against yet.")
+    if flagged:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
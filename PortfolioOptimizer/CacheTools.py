@@ -0,0 +1,323 @@
+"""
+Tools for caching data once per process so every session can share it.
+:class SharedCache: A thread-safe cache with a time to live, a memory
+    cap and one load per key no matter how many callers ask at once.
+:class PrecomputedResults: A lookup store of optimization results that
+    were worked out ahead of time.
+"""
+
+from PortfolioOptimizer import GlobalVariables as gv
+
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import pickle
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from types import MappingProxyType
+from typing import Any, Callable, Hashable, Tuple, Union
+
+
+class SharedCache(object):
+    """
+    A thread-safe cache with a time to live, a memory cap and one load
+    per key no matter how many callers ask at once. Values are made read
+    only before they are stored, since every caller gets the same copy.
+    When the cache is over its caps, the least recently used entries are
+    evicted first. Entries can also be persisted to disk, so they survive
+    a restart of the app.
+    """
+    def __init__(self, ttl: float = None, max_bytes: int = None,
+                 max_entries: int = None, cache_dir: str = None) -> None:
+        """
+        :param ttl: The number of seconds an entry stays valid. If None,
+            entries don't expire.
+        :param max_bytes: The most memory the cached values can use. If
+            None, there is no memory cap.
+        :param max_entries: The most entries to keep. If None, there is
+            no cap on the number of entries.
+        :param cache_dir: The directory to persist entries to. If None,
+            entries are only kept in memory. Keys need to have a stable
+            repr to be persisted.
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(value: Any) -> int:
+        """Estimate the memory a value uses."""
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            return int(np.sum(value.memory_usage(index=True)))
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (list, tuple)):
+            return sum(SharedCache._size(x) for x in value)
+        if isinstance(value, (dict, MappingProxyType)):
+            return sum(SharedCache._size(x) for x in value.values())
+        return sys.getsizeof(value)
+
+    @staticmethod
+    def freeze(value: Any) -> Any:
+        """
+        Make a value read only so a caller can't change the copy every
+            other caller shares.
+        :param value: The value to freeze.
+        :return value: The frozen value, which is a read-only copy for
+            NumPy and pandas data.
+        """
+        if isinstance(value, np.ndarray):
+            value = value.copy()
+            value.flags.writeable = False
+        elif isinstance(value, pd.DataFrame) and \
+                value.dtypes.nunique() == 1:
+            values = value.to_numpy(copy=True)
+            values.flags.writeable = False
+            value = pd.DataFrame(values, index=value.index,
+                                 columns=value.columns, copy=False)
+        elif isinstance(value, pd.Series):
+            values = value.to_numpy(copy=True)
+            values.flags.writeable = False
+            value = pd.Series(values, index=value.index, name=value.name,
+                              copy=False)
+        elif isinstance(value, list):
+            value = tuple(SharedCache.freeze(x) for x in value)
+        elif isinstance(value, tuple):
+            value = tuple(SharedCache.freeze(x) for x in value)
+        elif isinstance(value, dict):
+            value = MappingProxyType({k: SharedCache.freeze(v) for k, v in
+                                      value.items()})
+
+        return value
+
+    def _evict(self) -> None:
+        """Drop the least recently used entries until we are under the
+            caps. Must be called while holding the lock."""
+        while self._entries and (
+                (self.max_bytes is not None and
+                 self._nbytes > self.max_bytes) or
+                (self.max_entries is not None and
+                 len(self._entries) > self.max_entries)):
+            _, (_, _, nbytes) = self._entries.popitem(last=False)
+            self._nbytes -= nbytes
+
+    def _path(self, key: Hashable) -> str:
+        """Get the path an entry is persisted to."""
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, name + '.pkl')
+
+    def _load_from_disk(self, key: Hashable, missing: Any) -> Any:
+        """Load a persisted entry into memory if it exists and hasn't
+            expired."""
+        if self.cache_dir is None:
+            return missing
+        path = self._path(key)
+        try:
+            if self.ttl is not None and \
+                    time.time() - os.path.getmtime(path) > self.ttl:
+                return missing
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError, AttributeError):
+            return missing
+        return self.set(key, value, persist=False)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get a value if it is cached and hasn't expired.
+        :param key: The key of the value.
+        :param default: What to return if the value isn't cached.
+        :return value: The cached value or the default.
+        """
+        missing = object()
+        with self._lock:
+            entry = self._entries.get(key)
+            value = missing
+            if entry is not None:
+                value, expires, nbytes = entry
+                if expires is not None and expires < time.monotonic():
+                    del self._entries[key]
+                    self._nbytes -= nbytes
+                    value = missing
+                else:
+                    self._entries.move_to_end(key)
+        if value is missing:
+            value = self._load_from_disk(key, missing)
+        return default if value is missing else value
+
+    def set(self, key: Hashable, value: Any, persist: bool = True) -> Any:
+        """
+        Freeze and cache a value.
+        :param key: The key of the value.
+        :param value: The value to cache.
+        :param persist: Whether to also write the value to disk, if the
+            cache has a directory to persist to.
+        :return value: The frozen value that was cached.
+        """
+        if persist and self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._path(key)
+            # write to a temporary file first so a reader never sees
+            # half a file
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump(value, f)
+            os.replace(path + '.tmp', path)
+        value = self.freeze(value)
+        nbytes = self._size(value)
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[2]
+            self._entries[key] = (value, expires, nbytes)
+            self._nbytes += nbytes
+            self._evict()
+        return value
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Get a value, loading it if it isn't cached. If another caller is
+            already loading the same key, wait for that load rather than
+            starting a second one.
+        :param key: The key of the value.
+        :param loader: The function that loads the value.
+        :return value: The cached value.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+
+        with self._lock:
+            future = self._loading.get(key)
+            is_loader = future is None
+            if is_loader:
+                future = Future()
+                self._loading[key] = future
+        if not is_loader:
+            return future.result()
+
+        try:
+            value = self.set(key, loader())
+            future.set_result(value)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._loading[key]
+
+        return value
+
+    def clear(self) -> None:
+        """Drop every entry from memory."""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+
+class PrecomputedResults(object):
+    """
+    A lookup store of optimization results that were worked out ahead of
+    time, kept as one compact JSON file. Results are keyed by the version
+    of the return data, so they stop matching as soon as new data lands.
+    """
+    def __init__(self, path: str = gv.PRECOMPUTE_PATH) -> None:
+        """
+        :param path: The path of the JSON file.
+        """
+        self.path = path
+        self._results = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(version: str, investment_selection: list,
+            objective_selection: str, bootstrap: bool) -> str:
+        """Get the key for a result, which doesn't depend on the order of
+            the investments."""
+        return '|'.join([version, '+'.join(sorted(investment_selection)),
+                         objective_selection, str(bootstrap)])
+
+    def _load(self) -> dict:
+        """Get the results, reading the file again only if it changed."""
+        with self._lock:
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                self._results, self._mtime = {}, None
+                return self._results
+            if mtime != self._mtime:
+                try:
+                    with open(self.path) as f:
+                        self._results = json.load(f)['results']
+                except (OSError, ValueError, KeyError):
+                    self._results = {}
+                self._mtime = mtime
+            return self._results
+
+    def get(self, version: str, investment_selection: list,
+            objective_selection: str, bootstrap: bool) \
+            -> Union[Tuple[Union[pd.Series, None], Union[dict, None]], None]:
+        """
+        Get a precomputed result.
+        :param version: The version of the return data.
+        :param investment_selection: The investments selected.
+        :param objective_selection: The objective selected.
+        :param bootstrap: Whether the optimization was bootstrapped.
+        :return result: None if there is no precomputed result. Otherwise
+            the weights, in the same order as investment_selection, and
+            the averaged metrics, either of which are None if the
+            optimization had no solution.
+        """
+        result = self._load().get(self.key(
+            version, investment_selection, objective_selection, bootstrap))
+        if result is None:
+            return None
+
+        weights = result['weights']
+        if weights is not None:
+            weights = pd.Series([weights[x] for x in investment_selection])
+        return weights, result['metrics']
+
+    def save(self, version: str, results: dict) -> None:
+        """
+        Save results for a version of the return data. Results for any
+            other version are dropped, since they can't match anymore.
+        :param version: The version of the return data.
+        :param results: The results as {(investment_selection,
+            objective_selection, bootstrap): (weights, metrics)}, where
+            the weights are in the same order as investment_selection.
+        """
+        stored = {k: v for k, v in self._load().items() if
+                  k.startswith(version + '|')}
+        for (selection, objective, bootstrap), (weights, metrics) in \
+                results.items():
+            if weights is not None:
+                weights = {x: float(w) for x, w in zip(selection, weights)}
+            if metrics is not None:
+                metrics = {k: [float(x) for x in v] for k, v in
+                           metrics.items()}
+            stored[self.key(version, list(selection), objective,
+                            bootstrap)] = {'weights': weights,
+                                           'metrics': metrics}
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # write to a temporary file first so a reader never sees half a
+        # file
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'version': version, 'results': stored}, f,
+                      separators=(',', ':'))
+        os.replace(self.path + '.tmp', self.path)
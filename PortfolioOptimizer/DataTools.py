@@ -4,16 +4,29 @@ Tools for handling data and the info around it.
 """
 
 from PortfolioOptimizer import GlobalVariables as gv
+from PortfolioOptimizer.CacheTools import SharedCache
 from PortfolioOptimizer.GCPTools import GCPTools
+from PortfolioOptimizer.MomentTools import OnlineMoments
+from PortfolioOptimizer.PoolTools import get_pool
+from PortfolioOptimizer.PriceCache import PriceCache
+from PortfolioOptimizer.TimingTools import span
 
+import hashlib
+import json
+import numpy as np
+import os
 import pandas as pd
-import streamlit as st
 
 from arch.bootstrap import optimal_block_length
-from arch.bootstrap import StationaryBootstrap
+from itertools import repeat
 from statsmodels.imputation import mice
 from typing import Tuple, Union
 
+# the optimal block length of each column, shared by every session since
+# it only changes when the data does
+_BLOCK_LENGTH_CACHE = SharedCache(
+    max_entries=gv.BLOCK_LENGTH_CACHE_MAX_ENTRIES)
+
 
 class DataTools(object):
     """
@@ -31,37 +44,175 @@ class DataTools(object):
 
         return tables
 
-    def pull_return_data(self, tables: list) -> pd.DataFrame:
+    def _gcp_engine(self, credentials: Union[dict, str] = None) -> GCPTools:
+        """Connect to BigQuery with a service account, given as its info or
+            the path to its file. If credentials is None, we use the file
+            at the path in GCP_CREDENTIALS_ENV."""
+        if credentials is None:
+            credentials = os.environ.get(gv.GCP_CREDENTIALS_ENV)
+            if credentials is None:
+                raise ValueError(f"No BigQuery credentials were given and "
+                                 f"{gv.GCP_CREDENTIALS_ENV} isn't set.")
+        if isinstance(credentials, str):
+            with open(credentials) as f:
+                credentials = json.load(f)
+        return GCPTools('bigquery', 'https://www.googleapis.com/auth/bigquery',
+                        credentials)
+
+    def pull_price_data(self, tables: list, gcp_engine: GCPTools,
+                        after: pd.Timestamp = None,
+                        concurrent: bool = False) -> pd.DataFrame:
         """
-        Pull return data from BigQuery.
+        Pull the adjusted close from BigQuery.
         :param tables: The set of tables to pull from.
+        :param gcp_engine: The GCPTools to pull with.
+        :param after: If given, only pull the rows after this date.
+        :param concurrent: Whether to run one query per table at once
+            rather than one UNION ALL query.
+        :return price_data: The adjusted close for each ticker, with the
+            columns in the same order as the tables.
+        """
+        where = None
+        if after is not None:
+            where = f"date > '{after.strftime('%Y-%m-%d')}'"
+
+        # get the adjusted close for every table, in one query unless
+        # concurrent, then pivot so that each ticker is a column
+        long_data = gcp_engine.pull_tables_bigquery(
+            'portfoliooptimization-364417', 'assetclassprices', tables,
+            ['date', 'adjclose'], where=where, concurrent=concurrent)
+        price_data = long_data.pivot(index='date', columns='table_name',
+                                     values='adjclose')
+        price_data.index = pd.to_datetime(price_data.index)
+        price_data = price_data.sort_index()
+        # keep the columns in the same order as the tables
+        price_data = price_data.reindex(columns=tables)
+        price_data.columns = [table.split('_')[0] for table in tables]
+
+        return price_data
+
+    def pull_return_data(self, tables: list, gcp_engine: GCPTools = None,
+                         cache: PriceCache = None,
+                         credentials: Union[dict, str] = None) \
+            -> pd.DataFrame:
+        """
+        Pull return data, using the local price cache so that BigQuery is
+            only asked for the rows we don't have yet. The cached moments
+            of the returns are updated with just the new rows.
+        :param tables: The set of tables to pull from.
+        :param gcp_engine: The GCPTools to pull with. If None, we connect
+            to BigQuery with credentials when we need to.
+        :param cache: The PriceCache to use. If None, we use the default
+            cache directory.
+        :param credentials: The service account info, or the path to its
+            file, to connect to BigQuery with if gcp_engine is None. If
+            None, we use the file at the path in GCP_CREDENTIALS_ENV.
         :return returns: The returns for each ticker.
         """
-        gcp_engine = GCPTools('bigquery',
-                              'https://www.googleapis.com/auth/bigquery',
-                              st.secrets['gcp_bigquery_service_account'])
-
-        # get each set of price data and take the adjusted close
-        # combine all so they are in one dataframe
-        for i, table in enumerate(tables):
-            curr_price_data = gcp_engine.pull_df_bigquery(
-                'portfoliooptimization-364417', 'assetclassprices', table,
-                'date')
-            curr_price_data.index = pd.to_datetime(curr_price_data.index)
-            curr_price_data = curr_price_data[['adjclose']]
-            col_name = table.split('_')[0]
-            curr_price_data.columns = [col_name]
-            if i == 0:
-                price_data = curr_price_data
-            else:
-                price_data = pd.concat([price_data, curr_price_data], axis=1)
-
-        # calculate returns
-        returns = price_data.pct_change()
-        returns = returns.iloc[1:, :]
+        if cache is None:
+            cache = PriceCache()
+        cached = cache.load(tables)
+
+        # if the cached data is up to date we don't need the network
+        if cached is not None and cache.is_current(tables, cached[0]):
+            return cached[1]
+
+        if gcp_engine is None:
+            gcp_engine = self._gcp_engine(credentials)
+        if cached is None:
+            # a cold start, so pull everything and calculate returns
+            prices = self.pull_price_data(tables, gcp_engine)
+            with span('compute_returns', rows=prices.shape[0]):
+                returns = prices.pct_change()
+                returns = returns.iloc[1:, :]
+                moments = OnlineMoments(returns.columns).update(returns)
+        else:
+            # only pull the rows after the last ones we have, along with
+            # the last one, since the adjusted close of the whole history
+            # is restated after a dividend or split
+            prices, returns = cached
+            start = cache.refresh_start(prices)
+            new_prices = self.pull_price_data(
+                tables, gcp_engine, start - pd.Timedelta(days=1))
+            # tickers we took to have ended but are trading again have a
+            # gap, so they are pulled again in full like restated ones
+            restated = cache.restated(prices, new_prices) + \
+                cache.resumed(prices, new_prices)
+            if not restated and not (new_prices.index > start).any():
+                cache.mark_checked(tables)
+                return returns
+            with span('compute_returns', rows=new_prices.shape[0],
+                      restated=len(restated)):
+                # the rows after start are pulled again, so take them out
+                # of the moments and add them back once they are updated
+                moments = cache.load_moments(tables)
+                if moments is not None and moments.matches(returns) and \
+                        not restated:
+                    moments.downdate(returns.loc[returns.index > start])
+                else:
+                    moments = None
+                prices, returns = cache.append(prices, returns, new_prices,
+                                               start)
+                if restated:
+                    # the cached history of these is out of date, so pull
+                    # all of it again
+                    restated_tables = [table for table in tables if
+                                       table.split('_')[0] in restated]
+                    prices, returns = cache.reload(
+                        prices, returns, self.pull_price_data(
+                            restated_tables, gcp_engine))
+                if moments is not None:
+                    moments.update(returns.loc[returns.index > start])
+                else:
+                    moments = OnlineMoments(returns.columns).update(
+                        returns)
+        cache.save(tables, prices, returns)
+        cache.save_moments(tables, moments)
 
         return returns
 
+    def pull_return_moments(self, tables: list, returns: pd.DataFrame,
+                            cache: PriceCache = None) -> OnlineMoments:
+        """
+        Get the moments of the return data from the local price cache,
+            working them out again only if they don't match the returns.
+        :param tables: The set of tables the data was pulled from.
+        :param returns: The returns for each ticker, as returned by
+            pull_return_data.
+        :param cache: The PriceCache to use. If None, we use the default
+            cache directory.
+        :return moments: The moments of the returns.
+        """
+        if cache is None:
+            cache = PriceCache()
+        moments = cache.load_moments(tables)
+
+        if moments is None or not moments.matches(returns):
+            moments = OnlineMoments(returns.columns).update(returns)
+            cache.save_moments(tables, moments)
+
+        return moments
+
+    def data_version(self, data: pd.DataFrame) -> str:
+        """
+        Get a fingerprint of a set of data, so results can be cached by
+            it. It hashes the raw bytes of the dates and of every value,
+            so any change to a value or to their order gives a new one,
+            and it doesn't depend on the order of the columns.
+        :param data: The data to fingerprint.
+        :return version: The fingerprint.
+        """
+        columns = sorted(data.columns)
+        version = hashlib.sha1(repr((columns, data.shape)).encode())
+        version.update(pd.util.hash_pandas_object(
+            data.index).to_numpy().tobytes())
+        # a column at a time, so the data isn't copied to sort the columns
+        for col in columns:
+            version.update(np.ascontiguousarray(
+                data[col].to_numpy(dtype=float)).tobytes())
+
+        return version.hexdigest()
+
     def get_user_data(self, investment_selection: list,
                       return_data: pd.DataFrame) -> Tuple[pd.DataFrame, bool]:
         """
@@ -87,18 +238,122 @@ class DataTools(object):
 
         return user_data, missing_data
 
-    def _trunc_data(self, data: Union[pd.DataFrame, pd.Series],
-                    trunc: float) -> Union[pd.DataFrame, pd.Series]:
-        """Truncates a certain percentage of the data."""
+    def block_lengths(self, data: Union[pd.DataFrame, pd.Series],
+                      exponent: int = 1) -> pd.Series:
+        """
+        Get the optimal block length for the stationary bootstrap of each
+            column. A column's block length only depends on its own data,
+            so each one is worked out once per version of that column and
+            shared by every portfolio and session that uses it.
+        :param data: The data to get the block lengths for. Missing values
+            are dropped from each column.
+        :param exponent: The exponent to use for the data when determining
+            the optimal block length.
+        :return block_lengths: The block length of each column.
+        """
         if isinstance(data, pd.Series):
-            num_rows = int(round(len(data) * trunc, 0))
-            output_data = data.iloc[:num_rows]
-        else:
-            num_rows = int(round(data.shape[0] * trunc, 0))
-            output_data = data.iloc[:num_rows, :]
+            data = data.to_frame()
+
+        block_lengths = {}
+        for col in data.columns:
+            col_data = data[col]
+            if col_data.hasnans:
+                col_data = col_data.dropna()
+            # the same as data_version, but just for this column
+            values = col_data.to_numpy(dtype=float)
+            key = (exponent, hashlib.sha1(values.tobytes()).hexdigest(),
+                   str(col_data.index.min()), str(col_data.index.max()))
+
+            def load(col_data=col_data, col=col):
+                with span('block_length', column=col):
+                    opt = optimal_block_length(col_data ** exponent)
+                return float(opt['stationary'].iloc[0])
 
-        return output_data
+            block_lengths[col] = _BLOCK_LENGTH_CACHE.get_or_load(key, load)
 
+        return pd.Series(block_lengths, dtype=float)
+
+    def _block_length(self, data: Union[pd.DataFrame, pd.Series],
+                      opt_col: str = None, exponent: int = 1) -> float:
+        """Get the optimal block length for the stationary bootstrap
+            either as a given column or the max of all columns."""
+        # this is the case of choosing a column in a DataFrame to use
+        if isinstance(data, pd.DataFrame) and opt_col is not None:
+            data = data.loc[:, opt_col]
+        # this is the case of using the max of all columns
+        return round(self.block_lengths(data, exponent).max(), 0)
+
+    @staticmethod
+    def stationary_bootstrap_indices(num_rows: int, block_length: float,
+                                     seed: int, bs_count: int,
+                                     length: int = None) -> np.ndarray:
+        """
+        Draws the row positions for the stationary bootstrap of Politis and
+            Romano for every sample at once. Each position either starts a
+            new block at a random row, with probability 1/block_length so
+            blocks have geometric lengths, or follows on from the previous
+            position, wrapping around to the first row after the last.
+        :param num_rows: The number of rows in the data.
+        :param block_length: The average block length.
+        :param seed: The seed for the draws for reproducibility.
+        :param bs_count: The number of samples.
+        :param length: The number of positions to draw per sample. If None,
+            we draw num_rows.
+        :return indices: The row positions with shape (bs_count, length).
+        """
+        if length is None:
+            length = num_rows
+        rng = np.random.default_rng(seed)
+        # every sample starts a block at its first position
+        new_block = rng.random((bs_count, length)) < 1 / max(block_length, 1)
+        new_block[:, 0] = True
+
+        # work on the samples laid end to end, which is much faster than
+        # working along each row. every position belongs to the last block
+        # that started at or before it, and counts on from that block's
+        # random start
+        new_block = new_block.ravel()
+        block = np.cumsum(new_block) - 1
+        block_pos = np.flatnonzero(new_block)
+        starts = rng.integers(0, num_rows, size=block_pos.size)
+        indices = starts[block] + (np.arange(new_block.size) -
+                                   block_pos[block])
+        indices %= num_rows
+
+        return indices.reshape(bs_count, length)
+
+    def get_bootstrap_indices_ts(self, data: Union[pd.DataFrame, pd.Series],
+                                 seed: int, bs_count: int,
+                                 opt_col: str = None, exponent: int = 1,
+                                 trunc: float = None) -> np.ndarray:
+        """
+        Gets the row positions of bootstrap samples from a set of time
+            series data, rather than the data itself, so that the samples
+            can be built wherever the data already lives, such as with
+            data.to_numpy()[indices].
+        :param data: The data to bootstrap.
+        :param seed: The seed for bootstrapping for reproducibility.
+        :param bs_count: The number of iterations of the bootstrap.
+        :param opt_col: The name of the column to optimize the bootstrap
+            length on. If None, we will calculate for all columns and
+            then take the max.
+        :param exponent: The exponent to use for the data when determining
+            the optimal block length.
+        :param trunc: The percentage of data to keep.
+        :return indices: The row positions with shape (bs_count, L),
+            where L is the number of rows kept after truncation.
+        """
+        opt_value = self._block_length(data, opt_col, exponent)
+
+        # only draw the positions we keep after truncation
+        num_rows = data.shape[0]
+        length = num_rows
+        if trunc is not None:
+            length = int(round(num_rows * trunc, 0))
+
+        with span('bootstrap_draw', samples=bs_count):
+            return self.stationary_bootstrap_indices(num_rows, opt_value,
+                                                     seed, bs_count, length)
 
     def get_bootstrap_data_ts(self, data: Union[pd.DataFrame, pd.Series],
                               seed: int, bs_count: int,
@@ -118,54 +373,75 @@ class DataTools(object):
             squared data.
         :param trunc: The percentage of data to keep. So if trunc is 0.5,
             we will keep the top 50% of data. This is useful since
-            the StationaryBootstrap method will just reorder the data, but
+            the stationary bootstrap will just reorder the data, but
             using a subset with reduce the correlation with the original
             dataset.
         :return data[0][0]: The resulting data after bootstrap. This is a
             generator, so it will only output the current data.
         """
-        # alter the data to use the exponent
-        if exponent != 1:
-            data = data ** exponent
+        indices = self.get_bootstrap_indices_ts(data, seed, bs_count,
+                                                opt_col, exponent, trunc)
+        for sample_indices in indices:
+            yield data.iloc[sample_indices]
 
-        # get the optimal value for the block length either as a given
-        # column or the max of all columns
-        if isinstance(data, pd.Series):
-            opt = optimal_block_length(data)
-            opt_value = round(opt["stationary"], 0)
-        # this is the case of choosing a column in a DataFrame to use
-        elif opt_col is not None:
-            opt = optimal_block_length(data.loc[:, opt_col])
-            opt_value = round(opt.loc[opt_col, "stationary"], 0)
-        # this is the case of using the max of all columns
-        else:
-            opt = optimal_block_length(data)
-            opt_value = round(opt.max(axis=0)["stationary"], 0)
+    def impute_columns(self, data: pd.DataFrame, columns: list,
+                       max_predictors: int = gv.DEFAULT_IMPUTE_PREDICTORS) \
+            -> list:
+        """
+        Get the columns needed to impute a set of columns, which are the
+            columns themselves plus the columns with no missing data that
+            are most correlated with the ones that have missing data.
+        :param data: The data for all columns.
+        :param columns: The columns to impute.
+        :param max_predictors: The most extra columns to use as
+            predictors.
+        :return columns: The columns to impute with.
+        """
+        columns = list(columns)
+        missing = [x for x in columns if data[x].isnull().any()]
+        complete = [x for x in data.columns if x not in columns and
+                    not data[x].isnull().any()]
+        if not missing or not complete or max_predictors <= 0:
+            return columns
+
+        corr = data[complete + missing].corr().loc[complete, missing]
+        predictors = corr.abs().max(axis=1).nlargest(max_predictors)
+
+        return columns + list(predictors.index)
 
-        # run the bootstrap
-        bs = StationaryBootstrap(opt_value, data, seed=seed)
-        for bs_data in bs.bootstrap(bs_count):
-            output_data = bs_data[0][0]
-            # if we are truncating, do so
-            if trunc is not None:
-                output_data = self._trunc_data(output_data, trunc)
+    def _impute_chain(self, data: pd.DataFrame, seed: np.random.SeedSequence,
+                      n_iter: int) -> pd.DataFrame:
+        """Run one MICE chain with its own random state and return the
+            imputed data."""
+        with span('impute_chain', iterations=n_iter):
+            imp = mice.MICEData(data, rng=np.random.default_rng(seed))
+            imp.update_all(n_iter)
+        imp_data = imp.data
+        imp_data.index = data.index
 
-            yield output_data
+        return imp_data
 
-    def pmm(self, data: pd.DataFrame, d: int) -> pd.DataFrame:
+    def pmm(self, data: pd.DataFrame, d: int, columns: list = None,
+            seed: int = None, n_iter: int = gv.DEFAULT_IMPUTE_ITER,
+            client_id: str = 'default') -> pd.DataFrame:
         """
-        Perform predictive mean matching and yield a result.
+        Perform predictive mean matching and yield a result. Each
+            imputation is its own MICE chain with an independent seed, so
+            they run in parallel on the app-wide worker pool.
         :param data: The data to perform PMM on.
         :param d: The number of imputations to perform.
+        :param columns: The columns to impute. Only these columns and their
+            predictors from impute_columns are used. If None, we use all
+            columns.
+        :param seed: The seed for the imputations for reproducibility.
+        :param n_iter: The number of MICE iterations for each imputation.
+        :param client_id: The client, such as a session, to queue the
+            worker pool tasks under.
         :return imp_data: The data with PMM applied.
         """
-        # set up the imputer
-        imp = mice.MICEData(data)
-        for _ in range(d):
-            # perform PMM
-            imp.update_all()
-            # get the imputed data
-            imp_data = imp.data
-            imp_data.index = data.index
+        if columns is not None:
+            data = data[self.impute_columns(data, columns)]
+        seeds = np.random.SeedSequence(seed).spawn(d)
 
-            yield imp_data
+        yield from get_pool().map(client_id, self._impute_chain,
+                                  repeat(data), seeds, repeat(n_iter))
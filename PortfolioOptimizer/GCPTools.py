@@ -5,6 +5,12 @@ Classes:
     GCPTools: Creates connections and interactions with GCP.
 """
 
+from PortfolioOptimizer.TimingTools import span
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
 from google.cloud import bigquery
 from google.oauth2 import service_account
 
@@ -30,7 +36,9 @@ class GCPTools(object):
                 See scopes here:
                 https://developers.google.com/identity/protocols/oauth2/scopes
             credentials(string): Path to service account credentials.
-            client: The connection to GCP once set up.
+            client: The connection to GCP once set up. If this is passed
+                in, such as Benchmark.FakeBigQueryClient for checking the
+                pulls, we use it rather than connecting.
         """
 
         self.service_type = service_type
@@ -41,6 +49,8 @@ class GCPTools(object):
         # we connect to a GCP service here so that we don't need to
         # reconnect every time something runs because in some cases
         # we will be rerunning multiple times, such as storing new data
+        if self.client is not None:
+            return
         # set scopes and credentials
         scope = [self.scope]
         our_credentials = self.credentials
@@ -115,3 +125,103 @@ class GCPTools(object):
             df.sort_index(inplace=True)
 
         return df
+
+    def _tables_sql(self, project, dataset, tables, columns, where=None):
+        """
+        Build the query for a set of tables, labelling each row with the
+            table it came from.
+
+        Args:
+            project(string): The GCP project.
+            dataset(string): The GCP dataset.
+            tables(list): The GCP table names.
+            columns(list): The columns to select from each table.
+            where(string): An optional filter to apply to every table,
+                such as "date > '2022-09-30'".
+
+        Returns:
+            sql_statements(list): One SELECT statement per table.
+        """
+
+        column_str = ", ".join(columns)
+        sql_statements = []
+        for table_name in tables:
+            table_id = project + "." + dataset + "." + table_name
+            sql_statement = (f"SELECT '{table_name}' AS table_name, "
+                             f"{column_str} FROM `{table_id}`")
+            if where:
+                sql_statement += f" WHERE {where}"
+            sql_statements.append(sql_statement)
+
+        return sql_statements
+
+    def _query_df(self, sql_statement, tables=()):
+        """
+        Run a query and download the result as Arrow through the BigQuery
+            Storage read API, which is much faster than paging through
+            the rows. This falls back to the REST API if the Storage
+            client isn't available. The query is timed as one
+            'bigquery_pull' span, tagged with the tables it covers and
+            how many there are.
+
+        Args:
+            sql_statement(string): The query to run.
+            tables(list): The tables the query is for, to record with
+                its timing.
+
+        Returns:
+            df(DataFrame): The DataFrame with the data.
+        """
+
+        with span('bigquery_pull', tables=",".join(tables),
+                  table_count=len(tables)) as fields:
+            rows = self.client.query(sql_statement).result()
+            try:
+                df = rows.to_arrow(create_bqstorage_client=True).to_pandas()
+            except AttributeError:
+                df = rows.to_dataframe()
+            fields['rows'] = df.shape[0]
+
+        return df
+
+    def pull_tables_bigquery(self, project, dataset, tables, columns,
+                             where=None, concurrent=False, max_workers=8):
+        """
+        Pull a set of columns from many tables in BigQuery. By default
+            this is one UNION ALL query, so there is a single round trip
+            no matter how many tables there are, and so a single
+            'bigquery_pull' span for all of them rather than one per
+            table.
+
+        Args:
+            project(string): The GCP project.
+            dataset(string): The GCP dataset.
+            tables(list): The GCP table names.
+            columns(list): The columns to pull from each table.
+            where(string): An optional filter to apply to every table,
+                such as "date > '2022-09-30'".
+            concurrent(bool): If True, run one query per table at the
+                same time instead of one UNION ALL query.
+            max_workers(int): The most queries to run at once if
+                concurrent is True.
+
+        Returns:
+            df(DataFrame): The long DataFrame with the columns pulled and
+                a table_name column with the table each row came from.
+        """
+
+        sql_statements = self._tables_sql(project, dataset, tables, columns,
+                                          where)
+        if concurrent:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                dfs = list(executor.map(self._query_df, sql_statements,
+                                        [[x] for x in tables]))
+            df = pd.concat(dfs, ignore_index=True)
+        else:
+            df = self._query_df(" UNION ALL ".join(sql_statements),
+                                tables)
+
+        print("Pulled {} rows and {} columns from {} tables in {}.{}".format(
+            df.shape[0], len(columns), len(tables), project, dataset))
+
+        return df
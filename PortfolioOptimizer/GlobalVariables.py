@@ -2,6 +2,8 @@
 Global variables to use throughout.
 """
 
+import os
+
 # User options
 # Security mapping is {Investment Type: (ETF Ticker, ETF Name)}
 SECURITY_MAPPING = {'Global Stocks': ('ACWI.US', 'iShares MSCI ACWI', '0.33%'),
@@ -58,12 +60,115 @@ DEFAULT_INVESTMENTS = ['US Stocks', 'DM Stocks', 'EM Stocks', 'Global Bonds',
                        'Commodities']
 DEFAULT_OPTIMIZER_OPTIONS = ['Bootstrapping']
 
+# Data defaults
+# where the local copy of the price and return data is kept
+PRICE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                               'PortfolioOptimizer')
+# how long, in seconds, the return data shared by every session is kept
+# before checking for new data, and the most memory it can use
+RETURN_DATA_CACHE_TTL = 60 * 60
+RETURN_DATA_CACHE_MAX_BYTES = 512 * 1024 ** 2
+# the most versions of the return data to keep the moments of in memory
+MOMENT_CACHE_MAX_ENTRIES = 8
+# the most optimization results kept in memory for every session to share,
+# and where to persist them so they survive a restart (None to not persist)
+RESULT_CACHE_MAX_ENTRIES = 1024
+RESULT_CACHE_DIR = None
+# where the precompute job writes the results the app checks first
+PRECOMPUTE_PATH = os.path.join(PRICE_CACHE_DIR, 'precomputed.json')
+# a ticker whose last price is this many business days behind the newest
+# one is taken to have stopped trading, so refreshes don't go back for it
+PRICE_ENDED_DAYS = 10
+# the environment variable with the path to the BigQuery service account
+# file, for runs outside the app which has its own secrets
+GCP_CREDENTIALS_ENV = 'GOOGLE_APPLICATION_CREDENTIALS'
+
 # Bootstrap defaults
 DEFAULT_BOOTSTRAP_COUNT = 100
 DEFAULT_BOOTSTRAP_TRUNC = 0.6
+# for an adaptive number of samples, the largest standard error of the
+# average weights to stop at (None always draws DEFAULT_BOOTSTRAP_COUNT),
+# the fewest and most samples to draw and how many to draw at a time.
+# this is only for headless runs, since the app streams its samples and
+# uses DEFAULT_EARLY_STOP_TOL to stop early instead
+DEFAULT_BOOTSTRAP_TOL = None
+DEFAULT_BOOTSTRAP_MIN_COUNT = 50
+DEFAULT_BOOTSTRAP_MAX_COUNT = 500
+DEFAULT_BOOTSTRAP_BATCH_SIZE = 50
+# 'batched' solves every resample together in one vectorized pass and
+# 'process' runs an SLSQP optimization per resample in a process pool
+DEFAULT_BOOTSTRAP_ENGINE = 'batched'
+# the number of samples in each task when the samples for every
+# imputation are run on the worker pool together. None splits them so
+# each worker gets about two tasks
+DEFAULT_BOOTSTRAP_CHUNK_SIZE = None
+# the most per-column optimal block lengths to keep, which covers every
+# investment for both exponents across a few versions of the data
+BLOCK_LENGTH_CACHE_MAX_ENTRIES = 1024
+# while results are streamed to the display, the number of samples in
+# each task, which is smaller than usual so updates come more often
+DEFAULT_STREAM_CHUNK_SIZE = 10
+# the number of standard errors on either side of the running average
+# for the confidence bands while results are streamed
+DEFAULT_CONFIDENCE_Z = 1.96
+# stop early once the standard error of every running average weight is
+# under this, after at least this many samples of each imputation
+DEFAULT_EARLY_STOP_TOL = 0.01
+DEFAULT_EARLY_STOP_MIN_SAMPLES = 20
+
+# Metrics defaults
+# the confidence level for the value at risk
+DEFAULT_VAR_LEVEL = 0.95
+
+# Worker pool defaults
+# None uses one worker process per CPU
+DEFAULT_POOL_WORKERS = None
+# the most tasks one session can have waiting before it has to wait too
+DEFAULT_POOL_MAX_QUEUED = 256
+# the most shared memory blocks each worker keeps attached, which is about
+# one for each run going at once
+SHARED_ARRAY_MAX_ATTACHED = 4
 
 # Imputation defaults
 DEFAULT_IMPUTE_COUNT = 5
+# the number of MICE iterations each imputation runs from its own start,
+# which is the average burn-in the imputations of one long chain got.
+# it is fixed so the imputed data doesn't depend on the number of workers
+DEFAULT_IMPUTE_ITER = 3
+# the most investments with full data to use to predict the missing data
+DEFAULT_IMPUTE_PREDICTORS = 5
+# the most sets of imputed data kept in memory for every session to share
+IMPUTE_CACHE_MAX_ENTRIES = 64
+
+# Timing defaults
+# the most stage timings each process keeps in memory
+TIMING_MAX_SPANS = 10000
+# where every process appends each stage timing as a line of JSON, and
+# where the app writes the totals as Prometheus counters after each run
+# (None to not write them)
+TIMING_LOG_PATH = None
+TIMING_PROMETHEUS_PATH = None
+# the start of the name of every Prometheus counter
+TIMING_METRIC_PREFIX = 'portfolio_optimizer_stage'
+
+# Benchmark defaults
+# the days, investments and late starting investments of the synthetic data
+DEFAULT_BENCHMARK_ROWS = 2500
+DEFAULT_BENCHMARK_COLS = 10
+DEFAULT_BENCHMARK_MISSING = 2
+# the number of timed calls of each case
+DEFAULT_BENCHMARK_REPEAT = 20
+# where the history of runs and the recorded real data are kept
+BENCHMARK_HISTORY_PATH = os.path.join(PRICE_CACHE_DIR, 'benchmark',
+                                      'history.json')
+BENCHMARK_FIXTURE_PATH = os.path.join(PRICE_CACHE_DIR, 'benchmark',
+                                      'returns.parquet')
+# how much slower, as a fraction, the median latency of a case can get
+# before it counts as a regression
+BENCHMARK_REGRESSION_TOL = 0.2
+# the largest difference in any weight between the batched and process
+# engines before they count as disagreeing
+BENCHMARK_AGREEMENT_TOL = 1e-3
 
 # Display
 CSS_TABLE_STYLE = '''
@@ -0,0 +1,198 @@
+"""
+Tools for keeping statistics of the return data up to date as rows are
+added, without going back over the full history.
+:class OnlineMoments: The counts, means and covariances of the return
+    data, updated a batch of rows at a time.
+"""
+
+import numpy as np
+import pandas as pd
+
+from typing import Union
+
+
+class OnlineMoments(object):
+    """
+    The counts, means and covariances of the return data, updated a batch
+    of rows at a time. Missing values are handled pairwise like
+    DataFrame.cov, so every pair of columns keeps its own count, the
+    means of both columns over the rows they share and the sum of the
+    products of their deviations. Batches are combined with the parallel
+    form of Welford's update, so adding a day costs the same no matter
+    how long the history is, and rows that get replaced can be taken out
+    again the same way.
+    """
+    def __init__(self, columns: list) -> None:
+        """
+        :param columns: The columns of the data.
+        """
+        self.columns = list(columns)
+        size = len(self.columns)
+        # counts[i, j] is the number of rows where both i and j are known,
+        # means[i, j] is the mean of i over those rows and
+        # comoments[i, j] is the sum of the products of the deviations
+        self.counts = np.zeros((size, size))
+        self.means = np.zeros((size, size))
+        self.comoments = np.zeros((size, size))
+        # the number of rows seen, including any that are all missing,
+        # and the index of the last one
+        self.rows = 0
+        self.end = None
+
+    def _batch(self, data: pd.DataFrame) -> tuple:
+        """Get the pairwise counts, means and comoments of a batch of
+            rows."""
+        values = data.reindex(columns=self.columns).to_numpy(dtype=float)
+        known = ~np.isnan(values)
+        # center each column on its batch mean first, which keeps the
+        # sums of products small and doesn't change the comoments
+        filled = np.where(known, values, 0)
+        shift = filled.sum(axis=0) / np.maximum(known.sum(axis=0), 1)
+        centered = np.where(known, values - shift, 0)
+        known = known.astype(float)
+
+        counts = known.T @ known
+        sums = centered.T @ known
+        products = centered.T @ centered
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = np.where(counts > 0, sums / counts, 0)
+            comoments = np.where(counts > 0, products - sums * sums.T /
+                                 counts, 0)
+        means = np.where(counts > 0, means + shift[:, None], 0)
+
+        return counts, means, comoments
+
+    def update(self, data: pd.DataFrame) -> 'OnlineMoments':
+        """
+        Add a batch of rows.
+        :param data: The rows to add, which come after any rows already
+            added.
+        :return moments: The updated moments.
+        """
+        if data.empty:
+            return self
+        counts, means, comoments = self._batch(data)
+
+        total = self.counts + counts
+        delta = means - self.means
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(total > 0, counts / total, 0)
+        self.means = np.where(total > 0, self.means + delta * weight, 0)
+        self.comoments = self.comoments + comoments + \
+            delta * delta.T * self.counts * weight
+        self.counts = total
+        self.rows += data.shape[0]
+        self.end = str(data.index.max())
+
+        return self
+
+    def downdate(self, data: pd.DataFrame) -> 'OnlineMoments':
+        """
+        Take out a batch of rows that were added before, such as rows
+            that are about to be pulled again. The rows need to be at
+            the end of the data, since the last index isn't changed.
+        :param data: The rows to take out.
+        :return moments: The updated moments.
+        """
+        if data.empty:
+            return self
+        counts, means, comoments = self._batch(data)
+
+        kept = self.counts - counts
+        with np.errstate(divide='ignore', invalid='ignore'):
+            kept_means = np.where(kept > 0, (self.counts * self.means -
+                                             counts * means) / kept, 0)
+            weight = np.where(self.counts > 0, counts / self.counts, 0)
+        delta = means - kept_means
+        self.comoments = np.where(
+            kept > 0, self.comoments - comoments -
+            delta * delta.T * kept * weight, 0)
+        self.means = kept_means
+        self.counts = kept
+        self.rows -= data.shape[0]
+
+        return self
+
+    def matches(self, data: pd.DataFrame) -> bool:
+        """
+        Check whether the moments are for a set of data, without going
+            over the values.
+        :param data: The data the moments should be for.
+        :return matches: Whether the moments have the same columns, rows
+            and counts as the data.
+        """
+        if list(data.columns) != self.columns or \
+                data.shape[0] != self.rows:
+            return False
+        if self.rows and str(data.index.max()) != self.end:
+            return False
+
+        return np.array_equal(data.count().to_numpy(),
+                              np.diagonal(self.counts))
+
+    def _columns(self, columns: list = None) -> Union[list, np.ndarray]:
+        """Get the positions of a set of columns."""
+        if columns is None:
+            return np.arange(len(self.columns))
+        return [self.columns.index(x) for x in columns]
+
+    def count(self, columns: list = None) -> pd.Series:
+        """
+        Get the number of known values in each column.
+        :param columns: The columns to get. If None, we use every column.
+        :return count: The number of known values in each column.
+        """
+        pos = self._columns(columns)
+        return pd.Series(np.diagonal(self.counts)[pos],
+                         index=np.array(self.columns)[pos]).astype(int)
+
+    def mean(self, columns: list = None) -> pd.Series:
+        """
+        Get the mean of each column over its known values.
+        :param columns: The columns to get. If None, we use every column.
+        :return mean: The mean of each column.
+        """
+        pos = self._columns(columns)
+        counts = np.diagonal(self.counts)[pos]
+        return pd.Series(np.where(counts > 0, np.diagonal(self.means)[pos],
+                                  np.nan),
+                         index=np.array(self.columns)[pos])
+
+    def cov(self, columns: list = None, ddof: int = 1) -> pd.DataFrame:
+        """
+        Get the covariance of each pair of columns over the rows where
+            both are known, which is the same as DataFrame.cov.
+        :param columns: The columns to get. If None, we use every column.
+        :param ddof: The delta degrees of freedom. Use 0 for the
+            population covariance, which matches np.std.
+        :return cov: The covariance of each pair of columns, which is NaN
+            if a pair doesn't have enough rows in common.
+        """
+        pos = self._columns(columns)
+        counts = self.counts[np.ix_(pos, pos)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = np.where(counts > ddof, self.comoments[np.ix_(pos, pos)] /
+                           (counts - ddof), np.nan)
+        labels = np.array(self.columns)[pos]
+        return pd.DataFrame(cov, index=labels, columns=labels)
+
+    def to_arrays(self) -> dict:
+        """Get the moments as a dictionary of arrays, to be saved with
+            np.savez."""
+        return {'columns': np.array(self.columns, dtype=str),
+                'counts': self.counts, 'means': self.means,
+                'comoments': self.comoments, 'rows': np.array(self.rows),
+                'end': np.array('' if self.end is None else self.end)}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> 'OnlineMoments':
+        """Get the moments back from a dictionary of arrays, as made by
+            to_arrays."""
+        moments = cls([str(x) for x in arrays['columns']])
+        moments.counts = np.array(arrays['counts'], dtype=float)
+        moments.means = np.array(arrays['means'], dtype=float)
+        moments.comoments = np.array(arrays['comoments'], dtype=float)
+        moments.rows = int(arrays['rows'])
+        moments.end = str(arrays['end']) or None
+
+        return moments
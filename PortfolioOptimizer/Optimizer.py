@@ -1,10 +1,15 @@
 """
 An optimizer for portfolio optimization.
 :class Optimizer: Helps with the setup and run of an optimization.
+:class SolverStats: Totals of the telemetry from many optimizations.
 """
 
+from PortfolioOptimizer.BatchOptimizer import BatchOptimizer
+from PortfolioOptimizer.TimingTools import get_timer
+
 import numpy as np
 import pandas as pd
+import time
 
 from scipy.optimize import minimize
 from typing import Union
@@ -14,19 +19,59 @@ class Optimizer(object):
     """
     Helps with the setup and run of an optimization.
     """
-    def __init__(self, returns: pd.DataFrame) -> None:
+    def __init__(self, returns: pd.DataFrame, moments: bool = True,
+                 mu: np.ndarray = None, cov: np.ndarray = None) -> None:
         """
         :param returns: The returns of the different assets you want in
             the portfolio.
+        :param moments: Whether to calculate the mean and covariance of
+            the returns once up front and evaluate the objectives and
+            constraints from them, with analytic gradients, rather than
+            from the full history on every evaluation.
+        :param mu: The mean of the returns, on the same scale as returns,
+            such as from OnlineMoments. If given with cov, we use them
+            rather than going over the returns.
+        :param cov: The population covariance of the returns, on the same
+            scale as returns.
         """
         # the optimizer can fail to move if the returns are too small
         self.returns = returns * 100
+        self.moments = moments or (mu is not None and cov is not None)
+        if mu is not None and cov is not None:
+            self.mu = np.asarray(mu, dtype=float) * 100
+            self.cov = np.asarray(cov, dtype=float) * 100 ** 2
+        elif self.moments:
+            # use the population covariance so that the standard deviation
+            # matches np.std of the portfolio returns
+            rets = self.returns.to_numpy(dtype=float)
+            self.mu = rets.mean(axis=0)
+            centered = rets - self.mu
+            self.cov = centered.T @ centered / rets.shape[0]
         # set up the starting weights
         self.x0 = np.ones(self.returns.shape[1]) / self.returns.shape[1]
         # set up the bounds - we want the holdings to be long-only
         self.bnds = tuple((0, 1) for _ in range(self.returns.shape[1]))
         # set up constraints later
         self.cons = None
+        # the number of SLSQP iterations and of objective and gradient
+        # evaluations the last optimization took, including any retry
+        self.nit = 0
+        self.nfev = 0
+        self.njev = 0
+        # which solves the last optimization ran: 'exact' or 'exact+cash'
+        # if it was read off the traced frontier, either fully invested or
+        # with a cash sleeve, 'full' for only the fully-invested SLSQP
+        # solve, 'cash' for only the one that allows cash, 'full+cash' if
+        # the fully-invested one failed and fell back to cash, and 'none'
+        # if the target was ruled out up front
+        self.path = 'none'
+        # the telemetry of the last optimization, as a dictionary
+        self.telemetry = None
+        # the range of volatility a long-only portfolio can have and the
+        # segments of the efficient frontier, found when first needed
+        self._stddev_range = None
+        self._segments = None
+        self._trace = None
 
     def sharpe_ratio(self, weights: Union[list, np.ndarray]) -> float:
         """
@@ -35,8 +80,12 @@ class Optimizer(object):
         :return neg_sharpe_ratio: The negative of the Sharpe Ratio since
             we want to maximize it, but are using a minimizer.
         """
-        avg = np.average(np.dot(weights, self.returns.T))
-        stddev = np.std(np.dot(weights, self.returns.T))
+        if self.moments:
+            avg = np.dot(weights, self.mu)
+            stddev = self.stddev(weights)
+        else:
+            avg = np.average(np.dot(weights, self.returns.T))
+            stddev = np.std(np.dot(weights, self.returns.T))
         sharpe_ratio = avg / stddev
         neg_sharpe_ratio = -1 * sharpe_ratio
 
@@ -49,7 +98,10 @@ class Optimizer(object):
         :return neg_avg_return: The negative of the average return since
             we want to maximize it, but are using a minimizer.
         """
-        avg = np.mean(np.dot(weights, self.returns.T))
+        if self.moments:
+            avg = np.dot(weights, self.mu)
+        else:
+            avg = np.mean(np.dot(weights, self.returns.T))
         neg_avg_return = -1 * avg
 
         return neg_avg_return
@@ -60,49 +112,387 @@ class Optimizer(object):
         :param weights: The weights for the portfolio.
         :return stddev: The standard deviation of the portfolio.
         """
-        stddev = np.std(np.dot(weights, self.returns.T))
+        if self.moments:
+            stddev = np.sqrt(np.dot(weights, np.dot(self.cov, weights)))
+        else:
+            stddev = np.std(np.dot(weights, self.returns.T))
 
         return stddev
 
+    def sharpe_ratio_jac(self, weights: Union[list, np.ndarray]) \
+            -> np.ndarray:
+        """
+        Calculate the gradient of the negative Sharpe Ratio.
+        :param weights: The weights for the portfolio.
+        :return jac: The gradient with respect to the weights.
+        """
+        avg = np.dot(weights, self.mu)
+        stddev = self.stddev(weights)
+        jac = -1 * (self.mu * stddev - avg * self.stddev_jac(weights)) / \
+            stddev ** 2
+
+        return jac
+
+    def max_return_jac(self, weights: Union[list, np.ndarray]) -> np.ndarray:
+        """
+        Calculate the gradient of the negative average return.
+        :param weights: The weights for the portfolio.
+        :return jac: The gradient with respect to the weights.
+        """
+        return -1 * self.mu
+
+    def stddev_jac(self, weights: Union[list, np.ndarray]) -> np.ndarray:
+        """
+        Calculate the gradient of the standard deviation.
+        :param weights: The weights for the portfolio.
+        :return jac: The gradient with respect to the weights.
+        """
+        jac = np.dot(self.cov, weights) / self.stddev(weights)
+
+        return jac
+
+    def stddev_range(self) -> tuple:
+        """
+        Get bounds on the standard deviations a long-only, fully-invested
+            portfolio can have, which only need the covariance. The bottom
+            is the minimum variance portfolio when short positions are
+            allowed, which is in closed form and can only be lower than
+            the long-only one. The top is the most volatile asset.
+        :return min_stddev: The lower bound on the standard deviation.
+        :return max_stddev: The standard deviation of the most volatile
+            asset.
+        """
+        if self._stddev_range is None:
+            if self.moments:
+                cov = self.cov
+            else:
+                cov = np.cov(self.returns.to_numpy(dtype=float),
+                             rowvar=False, bias=True)
+            cov = np.atleast_2d(cov)
+            ones = np.ones(cov.shape[0])
+            try:
+                min_var = 1 / np.dot(ones, np.linalg.solve(cov, ones))
+            # a singular covariance has a portfolio with no variance
+            except np.linalg.LinAlgError:
+                min_var = 0
+            max_stddev = np.sqrt(np.max(np.diagonal(cov)))
+            self._stddev_range = (np.sqrt(max(min_var, 0)), max_stddev)
+
+        return self._stddev_range
+
+    def _frontier_line(self, support: np.ndarray) -> tuple:
+        """
+        Solve the fully-invested problem min 0.5 * w'Sw - s * mu'w on the
+            given holdings. For fixed holdings the solution is affine in
+            s, w = w_a + s * w_c, and so is the budget multiplier.
+        :param support: A boolean mask of the assets that are held.
+        :return w_a: The weights at s = 0.
+        :return w_c: The change in weights per unit of s.
+        :return nu_a: The budget multiplier at s = 0.
+        :return nu_c: The change in the budget multiplier per unit of s.
+            np.linalg.LinAlgError is raised if the holdings are singular
+            or close to it, such as when one is a mix of the others.
+        """
+        held = np.flatnonzero(support)
+        size = held.size
+        kkt = np.ones((size + 1, size + 1))
+        kkt[:size, :size] = self.cov[held[:, np.newaxis], held]
+        kkt[size, size] = 0
+        # a singular system doesn't always raise, it can just give a
+        # meaningless answer
+        if np.linalg.cond(kkt) > 1e12:
+            raise np.linalg.LinAlgError("The holdings are singular.")
+        rhs = np.zeros((size + 1, 2))
+        rhs[size, 0] = 1
+        rhs[:size, 1] = self.mu[held]
+        sol = np.linalg.solve(kkt, rhs)
+
+        w_a = np.zeros(len(self.mu))
+        w_c = np.zeros(len(self.mu))
+        w_a[held] = sol[:size, 0]
+        w_c[held] = sol[:size, 1]
+
+        return w_a, w_c, sol[size, 0], sol[size, 1]
+
+    def _frontier_segment(self, i: int) -> Union[tuple, None]:
+        """
+        Get a segment of the long-only, fully-invested efficient frontier,
+            tracing it as far as needed with the critical line algorithm.
+            Frontier portfolios solve min 0.5 * w'Sw - s * mu'w, and
+            between the values of s where an asset is added or dropped
+            they are affine in s. We start from the highest returning
+            asset, where s is large, and walk down to the minimum variance
+            portfolio at s = 0, working out where the next asset is
+            added, when its multiplier reaches 0, or dropped, when its
+            weight does. The segments found are kept, so later targets
+            carry on from where the last one stopped.
+        :param i: The position of the segment from the top down.
+        :return segment: The segment as (s_lo, s_hi, w_a, w_c, nu_a,
+            nu_c), as in _frontier_line, or None if the frontier ends
+            before it. self._trace is None once the whole frontier is
+            traced, or False if it can't be, such as if the covariance
+            is singular.
+        """
+        if self._segments is None:
+            support = np.zeros(len(self.mu), dtype=bool)
+            support[np.argmax(self.mu)] = True
+            self._segments = []
+            self._trace = (support, np.inf)
+        while len(self._segments) <= i:
+            # each asset is normally added or dropped once, so the limit
+            # is only a guard against cycling on ties
+            if not self._trace or \
+                    len(self._segments) > 4 * len(self.mu) + 4:
+                self._trace = self._trace and False
+                return None
+            support, s_hi = self._trace
+            try:
+                w_a, w_c, nu_a, nu_c = self._frontier_line(support)
+            except np.linalg.LinAlgError:
+                self._trace = False
+                return None
+            # the multipliers of the assets that aren't held, which are
+            # also affine in s and need to stay non-negative
+            mult_a = np.dot(self.cov, w_a) + nu_a
+            mult_c = np.dot(self.cov, w_c) - self.mu + nu_c
+            drop = support & (w_c > 1e-12)
+            add = ~support & (mult_c > 1e-12)
+            events = np.full(len(self.mu), -np.inf)
+            events[drop] = -w_a[drop] / w_c[drop]
+            events[add] = -mult_a[add] / mult_c[add]
+            # only events below where this segment starts count, so an
+            # asset just added isn't dropped again straight away
+            events[events >= s_hi - 1e-9 * min(abs(s_hi), 1e9)] = -np.inf
+            s_lo = max(events.max(), 0)
+            self._segments.append((s_lo, s_hi, w_a, w_c, nu_a, nu_c))
+            if s_lo <= 0:
+                self._trace = None
+            else:
+                support = support ^ (events >= s_lo - 1e-9 * s_lo)
+                self._trace = (support, s_lo) if support.any() else False
+
+        return self._segments[i]
+
+    def _max_return_exact(self, tgt_stddev: float) -> Union[tuple, None]:
+        """
+        Find the maximum return portfolio for a target standard deviation
+            on the traced frontier, which is exact, deterministic and much
+            faster than a solve. The volatility rises with s along the
+            frontier, so the target is on one segment, where it is a
+            quadratic in s. A target below the minimum variance portfolio
+            is met with a cash sleeve, which is best held next to the max
+            Sharpe Ratio portfolio, found where the budget multiplier is
+            0. A target above the highest returning asset's volatility,
+            where getting to the target means giving up return, is solved
+            exactly over every pair of assets the same way as the batched
+            engine, so the two agree.
+        :param tgt_stddev: The target standard deviation.
+        :return weights: The weights, which sum to less than 1 if there
+            is cash.
+        :return path: 'exact' if fully invested or 'exact+cash' if not.
+            None is returned instead of both if the frontier can't be
+            traced, or if the answer fails the check of its optimality
+            conditions and volatility, so the caller can fall back to a
+            solve.
+        """
+        tgt_var = tgt_stddev ** 2
+        i = 0
+        tangent = None
+        while True:
+            segment = self._frontier_segment(i)
+            if segment is None:
+                break
+            s_lo, s_hi, w_a, w_c, nu_a, nu_c = segment
+            # the variance on the segment is a * s^2 + 2 * b * s + c
+            cov_c = np.dot(self.cov, w_c)
+            quad_a = np.dot(w_c, cov_c)
+            quad_b = np.dot(w_a, cov_c)
+            quad_c = np.dot(w_a, np.dot(self.cov, w_a))
+            # the first segment only holds the top asset
+            if i == 0 and tgt_var > quad_c * (1 + 1e-9):
+                weights = BatchOptimizer.max_return_on_edges(
+                    self.mu[np.newaxis], self.cov[np.newaxis],
+                    np.array([tgt_stddev]))[0]
+                if np.isnan(weights).any():
+                    return None
+                return weights, 'exact'
+            if tgt_var >= (quad_a * s_lo ** 2 + 2 * quad_b * s_lo +
+                           quad_c) * (1 - 1e-12):
+                eps = 1e-12 * max(quad_c, np.finfo(float).tiny)
+                if abs(quad_a) > eps:
+                    s_val = (-quad_b + np.sqrt(max(
+                        quad_b ** 2 - quad_a * (quad_c - tgt_var), 0))) / \
+                        quad_a
+                # the weights hardly move along the segment, such as when
+                # only one asset is held, so the variance is linear in s
+                # or doesn't change at all
+                elif abs(quad_b) > eps:
+                    s_val = (tgt_var - quad_c) / (2 * quad_b)
+                else:
+                    s_val = s_lo
+                s_val = min(max(s_val, s_lo), s_hi)
+                weights = self._clean(w_a + s_val * w_c)
+                if not self._is_optimal(segment, s_val) or \
+                        not self._meets(weights, tgt_stddev):
+                    self._trace = False
+                    return None
+                return weights, 'exact'
+            if nu_c != 0 and s_lo <= -nu_a / nu_c <= s_hi:
+                s_val = -nu_a / nu_c
+                tangent = self._clean(w_a + s_val * w_c)
+                if not self._is_optimal(segment, s_val):
+                    self._trace = False
+                    return None
+            i += 1
+
+        # the target is below the minimum variance portfolio. if no asset
+        # has a positive mean there is no tangent portfolio
+        if self._trace is False or tangent is None:
+            return None
+        weights = tangent * tgt_stddev / self.stddev(tangent)
+        if not self._meets(weights, tgt_stddev):
+            self._trace = False
+            return None
+
+        return weights, 'exact+cash'
+
+    def _is_optimal(self, segment: tuple, s_val: float) -> bool:
+        """Check the optimality conditions of a point on a traced
+            segment, which rounding on a badly conditioned covariance can
+            break: the weights are non-negative and no asset that isn't
+            held would add to the objective."""
+        _, _, w_a, w_c, nu_a, nu_c = segment
+        weights = w_a + s_val * w_c
+        mult = np.dot(self.cov, weights) - s_val * self.mu + \
+            nu_a + s_val * nu_c
+        scale = np.abs(self.cov).max() + abs(s_val) * np.abs(self.mu).max()
+        tol = 1e-6 * max(scale, np.finfo(float).tiny)
+
+        return bool(np.all(np.isfinite(weights)) and
+                    weights.min() >= -1e-6 and mult.min() >= -tol)
+
+    def _meets(self, weights: np.ndarray, tgt_stddev: float) -> bool:
+        """Check that exact weights are finite and have the target
+            standard deviation."""
+        return bool(np.all(np.isfinite(weights)) and
+                    abs(self.stddev(weights) - tgt_stddev) <=
+                    1e-6 * tgt_stddev)
+
+    @staticmethod
+    def _clean(weights: np.ndarray) -> np.ndarray:
+        """Clip the rounding noise off exact weights and renormalize."""
+        weights = np.maximum(weights, 0)
+
+        return weights / weights.sum()
+
     def optimize(self, method: str = 'sharpe_ratio',
-                 tgt_stddev: float = None) -> pd.DataFrame:
+                 tgt_stddev: float = None,
+                 x0: np.ndarray = None) -> pd.DataFrame:
         """
         Run the optimization to get the weights for the portfolio.
         :param method: The method to use for optimization. Takes either
             'sharpe_ratio' or 'max_return'.
         :param tgt_stddev: The target standard deviation for the portfolio
             if you need it to optimize with 'max_return'.
-        :return results: The results of the optimization.
+        :param x0: The weights to start from, such as the solution of a
+            nearby problem or another bootstrap sample. If None, we start
+            from equal weights.
+        :return results: The results of the optimization. The number of
+            iterations and evaluations it took are kept in self.nit,
+            self.nfev and self.njev, and all of its telemetry in
+            self.telemetry.
         """
+        start = time.perf_counter()
+        results = self._optimize(method, tgt_stddev, x0)
+        seconds = time.perf_counter() - start
+
+        fields = {'method': method, 'path': self.path, 'nit': self.nit,
+                  'nfev': self.nfev, 'njev': self.njev,
+                  'solved': results is not None}
+        get_timer().record('solve', seconds, **fields)
+        self.telemetry = dict(fields, seconds=seconds)
+
+        return results
+
+    def _optimize(self, method: str, tgt_stddev: float,
+                  x0: np.ndarray) -> Union[np.ndarray, None]:
+        """Run the optimization, with the same parameters as
+            optimize."""
+        if x0 is None:
+            x0 = self.x0
+        self.nit = self.nfev = self.njev = 0
+        self.path = 'none'
+        # check whether the target can be met before spending a solve on
+        # it. a target below the minimum variance portfolio can only be
+        # met by holding cash, and one above the most volatile asset
+        # can't be met at all. targets between the bound and the long-only
+        # minimum variance portfolio still need the failed solve to tell
+        fully_invested = True
+        if method == 'max_return':
+            min_stddev, max_stddev = self.stddev_range()
+            if tgt_stddev > max_stddev * (1 + 1e-9):
+                return None
+            # with the moments, the answer can be read off the traced
+            # frontier without a solve
+            if self.moments:
+                exact = self._max_return_exact(tgt_stddev)
+                if exact is not None:
+                    weights, self.path = exact
+                    return weights
+            fully_invested = tgt_stddev >= min_stddev
+        # the gradients are only known in closed form if we have the
+        # moments, otherwise they are left to finite differences
+        if self.moments:
+            sum_jac = lambda x: np.ones_like(x)
+            stddev_jac = self.stddev_jac
+        else:
+            sum_jac = stddev_jac = None
+
         # get the objective function and set constraints
         if method == 'sharpe_ratio':
             func = self.sharpe_ratio
+            jac = self.sharpe_ratio_jac if self.moments else None
             # we want the sum of the weights to be 1
-            self.cons = ({'type': 'eq', 'fun': lambda x: np.sum(x) - 1})
+            self.cons = ({'type': 'eq', 'fun': lambda x: np.sum(x) - 1,
+                          'jac': sum_jac})
         else:
             func = self.max_return
+            jac = self.max_return_jac if self.moments else None
             # we want the sum of the weights to be 1 and the std dev
             # to be equal to the target
             self.cons = (
-                {'type': 'eq', 'fun': lambda x: np.sum(x) - 1},
-                {'type': 'eq', 'fun': lambda x: self.stddev(x) - tgt_stddev})
+                {'type': 'eq', 'fun': lambda x: np.sum(x) - 1,
+                 'jac': sum_jac},
+                {'type': 'eq', 'fun': lambda x: self.stddev(x) - tgt_stddev,
+                 'jac': stddev_jac})
 
         # run the optimization
-        results = minimize(func, self.x0, bounds=self.bnds,
-                           constraints=self.cons)
+        if fully_invested:
+            results = minimize(func, x0, jac=jac, bounds=self.bnds,
+                               constraints=self.cons)
+            self._count(results)
+            self.path = 'full'
 
         # if the optimization failed and we are looking for max return,
         # try again with the standard deviation as a constraint but allow
         # the weights to be between 0 and 1, which would mean that if this
         # succeeds, we would have a portfolio with less than 100% invested
         # and the rest would be cash
-        if not results.success and method == 'max_return':
+        if method == 'max_return' and (not fully_invested or
+                                       not results.success):
+            neg_sum_jac = None if sum_jac is None else \
+                lambda x: -1 * np.ones_like(x)
             self.cons = (
-                {'type': 'eq', 'fun': lambda x: self.stddev(x) - tgt_stddev},
-                {'type': 'ineq', 'fun': lambda x: np.sum(x)},
-                {'type': 'ineq', 'fun': lambda x: 1 - np.sum(x)})
-            results = minimize(func, self.x0, bounds=self.bnds,
+                {'type': 'eq', 'fun': lambda x: self.stddev(x) - tgt_stddev,
+                 'jac': stddev_jac},
+                {'type': 'ineq', 'fun': lambda x: np.sum(x),
+                 'jac': sum_jac},
+                {'type': 'ineq', 'fun': lambda x: 1 - np.sum(x),
+                 'jac': neg_sum_jac})
+            results = minimize(func, x0, jac=jac, bounds=self.bnds,
                                constraints=self.cons)
+            self._count(results)
+            self.path = 'full+cash' if fully_invested else 'cash'
 
         # if the optimization fails, return None
         # this should only happen if the target standard deviation is
@@ -111,3 +501,99 @@ class Optimizer(object):
             return None
 
         return results.x
+
+    def _count(self, results) -> None:
+        """Add the iterations and evaluations of a solve to the counts
+            for the optimization."""
+        self.nit += results.nit
+        self.nfev += results.nfev
+        # finite differences don't report gradient evaluations
+        self.njev += getattr(results, 'njev', 0)
+
+    def efficient_frontier(self, tgt_stddevs: list) -> list:
+        """
+        Run the max_return optimization for each of several target
+            standard deviations, walking along the frontier from the
+            lowest target to the highest so that each solve starts from
+            the solution of its neighbour. The moments are shared by
+            every solve.
+        :param tgt_stddevs: The target standard deviations.
+        :return results: The results of each optimization, in the same
+            order as the targets, which are None if there is no solution.
+        """
+        results = [None] * len(tgt_stddevs)
+        x0 = None
+        for i in np.argsort(tgt_stddevs):
+            results[i] = self.optimize('max_return', tgt_stddevs[i], x0=x0)
+            if results[i] is not None:
+                x0 = results[i]
+
+        return results
+
+
+class SolverStats(object):
+    """
+    Totals of the telemetry from many optimizations, such as every
+    bootstrap sample of a run. A sample without a solution is thrown away,
+    so the time spent on it is kept apart to show how much of the work
+    is wasted.
+    """
+    def __init__(self) -> None:
+        self.calls = 0
+        self.solved = 0
+        self.seconds = 0.0
+        self.discarded_seconds = 0.0
+        self.nit = 0
+        self.nfev = 0
+        self.njev = 0
+        # the number of optimizations down each path, as in Optimizer.path
+        self.paths = {}
+
+    def add(self, telemetry: dict) -> None:
+        """
+        Add the telemetry of one optimization.
+        :param telemetry: The telemetry, as in Optimizer.telemetry.
+        """
+        self.calls += 1
+        self.solved += bool(telemetry['solved'])
+        self.seconds += telemetry['seconds']
+        if not telemetry['solved']:
+            self.discarded_seconds += telemetry['seconds']
+        self.nit += telemetry['nit']
+        self.nfev += telemetry['nfev']
+        self.njev += telemetry['njev']
+        self.paths[telemetry['path']] = \
+            self.paths.get(telemetry['path'], 0) + 1
+
+    def add_batch(self, samples: int, solved: int, seconds: float) -> None:
+        """
+        Add a batch of optimizations that were solved together, such as
+            with the BatchOptimizer, which has no count of iterations for
+            each. The time is split evenly between them.
+        :param samples: The number of optimizations.
+        :param solved: The number of them with a solution.
+        :param seconds: How long the batch took.
+        """
+        self.calls += samples
+        self.solved += solved
+        self.seconds += seconds
+        if samples:
+            self.discarded_seconds += seconds * (samples - solved) / samples
+        self.paths['batched'] = self.paths.get('batched', 0) + samples
+
+    def summary(self) -> dict:
+        """
+        Get the totals.
+        :return summary: The number of optimizations, solved and
+            discarded, the seconds spent on them and on the discarded
+            ones, the share of the time that was discarded, the iterations
+            and evaluations and the number down each path.
+        """
+        return {'calls': self.calls, 'solved': self.solved,
+                'discarded': self.calls - self.solved,
+                'seconds': self.seconds,
+                'discarded_seconds': self.discarded_seconds,
+                'discarded_share': self.discarded_seconds / self.seconds
+                if self.seconds else 0.0,
+                'nit': self.nit, 'nfev': self.nfev, 'njev': self.njev,
+                'paths': dict(self.paths)}
@@ -0,0 +1,220 @@
+"""
+Runs the portfolio optimization from return data to metrics, without
+any display.
+:class Pipeline: Runs the imputation, optimization and metrics for a
+    portfolio.
+"""
+
+from PortfolioOptimizer import GlobalVariables as gv
+from PortfolioOptimizer import SharedStates as shared
+from PortfolioOptimizer.AnalyticTools import AnalyticTools
+from PortfolioOptimizer.CacheTools import PrecomputedResults
+from PortfolioOptimizer.DataTools import DataTools
+
+import pandas as pd
+
+from typing import Callable, Tuple, Union
+
+
+class Pipeline(object):
+    """
+    Runs the imputation, optimization and metrics for a portfolio.
+    """
+    def __init__(self, store: PrecomputedResults = None,
+                 use_store: bool = True) -> None:
+        """
+        :param store: The precomputed results to check before running
+            anything. If None, we use the default store.
+        :param use_store: Whether to check the precomputed results at
+            all, which the precompute job turns off.
+        """
+        if store is None and use_store:
+            store = PrecomputedResults()
+        self.store = store
+
+    def run(self, investment_selection: list, objective_selection: str,
+            return_data: pd.DataFrame, bootstrap: bool = True,
+            client_id: str = 'default',
+            on_progress: Callable[[float, pd.DataFrame, pd.DataFrame],
+                                  None] = None,
+            tol: float = None) \
+            -> Tuple[Union[pd.Series, None], Union[dict, None]]:
+        """
+        Get the weights and metrics for a portfolio.
+        :param investment_selection: The investments the user selected.
+        :param objective_selection: The objective the user selected.
+        :param return_data: The return data for all investments.
+        :param bootstrap: Whether to bootstrap the optimization.
+        :param client_id: The client, such as a session, to queue worker
+            pool tasks under.
+        :param on_progress: Called with the fraction of samples done and
+            the running averages of the weights and metrics, with their
+            confidence bands, while the bootstraps run, so a display can
+            update as results arrive.
+        :param tol: If given, the bootstraps stop once the standard error
+            of every average weight is under it. Without imputation or
+            on_progress, they also draw more than the usual number of
+            samples if the weights haven't settled. That adaptive mode is
+            only for headless runs such as BatchRun, since the app always
+            streams with on_progress and so only ever stops early.
+        :return weights: The weights for the investments, in the same
+            order as investment_selection, or None if there are none.
+        :return metrics: The averaged metrics for the portfolio and the
+            benchmark, or None if there are no weights.
+        """
+        data_engine = DataTools()
+        analytics_engine = AnalyticTools()
+
+        # use the precomputed result if there is one
+        if self.store is not None:
+            result = self.store.get(data_engine.data_version(return_data),
+                                    investment_selection,
+                                    objective_selection, bootstrap)
+            if result is not None:
+                return result
+
+        # get data for the selected investments
+        user_return_data, any_missing = data_engine.get_user_data(
+            investment_selection, return_data)
+
+        # we need to know the objective function throughout
+        obj_func = gv.OBJECTIVE_CHOICES[objective_selection][0]
+        # if we don't have missing data, we can just run the analysis
+        if not any_missing:
+            # run the optimization, potentially with bootstraps
+            if bootstrap and on_progress is not None:
+                # stream the samples as they finish, the same way as for
+                # imputed data but with just the one set of data
+                weights, metrics = \
+                    shared.state_imputed_bootstrap_optimization(
+                        [user_return_data], obj_func, objective_selection,
+                        return_data, client_id=client_id,
+                        on_progress=on_progress, tol=tol)[0]
+            elif bootstrap:
+                weights, metrics = shared.state_bootstrap_optimization(
+                    user_return_data, obj_func, objective_selection,
+                    return_data, client_id=client_id, tol=tol)
+            else:
+                # the full sample only needs the moments of the data,
+                # which are kept up to date as new rows land
+                moments = shared.state_return_moments(return_data)
+                weights = analytics_engine.run_optimization(
+                    user_return_data, obj_func, objective_selection,
+                    return_data, moments=moments)
+                # run the metrics
+                try:
+                    metrics = analytics_engine.portfolio_metrics(
+                        user_return_data, weights, obj_func,
+                        objective_selection, return_data, {},
+                        moments=moments)
+                # we need to handle if all the weights are None
+                except TypeError:
+                    metrics = None
+            if metrics is not None:
+                metrics = analytics_engine.average_metrics(metrics)
+        else:
+            # if we have missing data, we need to impute it and run the
+            # analysis for each set of imputed data
+            imp_data = shared.state_pmm(return_data, gv.DEFAULT_IMPUTE_COUNT,
+                                        user_return_data.columns,
+                                        client_id=client_id)
+            imp_user_data = [data_engine.get_user_data(
+                investment_selection, x)[0] for x in imp_data]
+            # run the optimizations with bootstraps for every imputation
+            # at once, or one after the other without
+            if bootstrap:
+                imp_results = shared.state_imputed_bootstrap_optimization(
+                    imp_user_data, obj_func, objective_selection,
+                    return_data, client_id=client_id,
+                    on_progress=on_progress, tol=tol)
+            else:
+                imp_results = [(analytics_engine.run_optimization(
+                    x, obj_func, objective_selection, return_data), None)
+                    for x in imp_user_data]
+            imp_weights = []
+            imp_metrics = {}
+            for user_return_data, (curr_weights, curr_metrics) in zip(
+                    imp_user_data, imp_results):
+                # if the volatility of the benchmark is higher than any of
+                # the investments, we can't get weights under 100% so we
+                # return None and skip this imputation
+                if curr_weights is not None:
+                    imp_weights.append(curr_weights)
+                    # record the metrics
+                    if curr_metrics is None:
+                        curr_metrics = analytics_engine.portfolio_metrics(
+                            user_return_data, curr_weights, obj_func,
+                            objective_selection, return_data, {})
+                    imp_metrics = analytics_engine.combine_metrics(
+                        imp_metrics, curr_metrics)
+            # average the weights and metrics, handling if all the weights
+            # are None
+            if imp_weights:
+                weights = pd.DataFrame(imp_weights).mean()
+                metrics = analytics_engine.average_metrics(imp_metrics)
+            else:
+                weights = None
+                metrics = None
+
+        return weights, metrics
+
+    def run_frontier(self, investment_selection: list,
+                     return_data: pd.DataFrame, bootstrap: bool = True,
+                     objective_selections: list = None,
+                     client_id: str = 'default') -> dict:
+        """
+        Get the weights and metrics for several stock and bond mixes at
+            once, by walking along the efficient frontier.
+        :param investment_selection: The investments the user selected.
+        :param return_data: The return data for all investments.
+        :param bootstrap: Whether to bootstrap the optimizations.
+        :param objective_selections: The objective selections for the
+            stock and bond mixes. If None, we use every max_return
+            objective.
+        :param client_id: The client, such as a session, to queue worker
+            pool tasks under.
+        :return results: The weights and averaged metrics for each
+            objective selection, which are both None if there are no
+            weights.
+        """
+        data_engine = DataTools()
+        analytics_engine = AnalyticTools()
+
+        # get data for the selected investments, imputing it if any is
+        # missing
+        user_return_data, any_missing = data_engine.get_user_data(
+            investment_selection, return_data)
+        imp_user_data = [user_return_data]
+        if any_missing:
+            imp_data = shared.state_pmm(return_data, gv.DEFAULT_IMPUTE_COUNT,
+                                        user_return_data.columns,
+                                        client_id=client_id)
+            imp_user_data = [data_engine.get_user_data(
+                investment_selection, x)[0] for x in imp_data]
+
+        frontiers = [analytics_engine.frontier_optimization(
+            x, return_data, objective_selections, bootstrap) for x in
+            imp_user_data]
+
+        # average the weights and metrics for each mix across the
+        # imputations, skipping any that have no weights
+        results = {}
+        for objective_selection in frontiers[0]:
+            imp_weights = []
+            imp_metrics = {}
+            for user_return_data, frontier in zip(imp_user_data, frontiers):
+                curr_weights = frontier[objective_selection]
+                if curr_weights is not None:
+                    imp_weights.append(curr_weights)
+                    imp_metrics = analytics_engine.combine_metrics(
+                        imp_metrics, analytics_engine.portfolio_metrics(
+                            user_return_data, curr_weights, 'max_return',
+                            objective_selection, return_data, {}))
+            if imp_weights:
+                results[objective_selection] = (
+                    pd.DataFrame(imp_weights).mean(),
+                    analytics_engine.average_metrics(imp_metrics))
+            else:
+                results[objective_selection] = (None, None)
+
+        return results
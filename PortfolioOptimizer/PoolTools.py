@@ -0,0 +1,223 @@
+"""
+Tools for running work on a long-lived pool of worker processes.
+:class WorkerPool: A process pool shared by every session in the app,
+    with back-pressure and fair queueing between sessions.
+:func get_pool: Get the app-wide WorkerPool, creating it if needed.
+"""
+
+from PortfolioOptimizer import GlobalVariables as gv
+
+import os
+import threading
+
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker
+from typing import Any, Callable, Iterable, Iterator
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def _warm_imports() -> None:
+    """Import the heavy packages once when a worker starts, so that the
+        first task each worker gets doesn't pay for it."""
+    import numpy
+    import pandas
+    import scipy.optimize
+    from PortfolioOptimizer import Optimizer
+
+
+def get_pool() -> 'WorkerPool':
+    """Get the app-wide WorkerPool, creating it if needed. Since modules
+        are only imported once per server process, every session and
+        rerun shares the same pool."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = WorkerPool()
+    return _POOL
+
+
+class WorkerPool(object):
+    """
+    A process pool shared by every session in the app. The processes are
+    started once, with the heavy imports already done, and reused for
+    every run. Tasks are queued per client and handed to the processes
+    round-robin across clients, so one heavy run can't starve the rest,
+    and a client that queues too many tasks blocks until some finish.
+    """
+    def __init__(self, max_workers: int = gv.DEFAULT_POOL_WORKERS,
+                 max_queued: int = gv.DEFAULT_POOL_MAX_QUEUED) -> None:
+        """
+        :param max_workers: The number of worker processes. If None, we
+            use one per CPU.
+        :param max_queued: The most tasks a single client can have waiting
+            to run before submitting more blocks.
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queued = max_queued
+        # keep the executor's own queue shallow so that the order tasks
+        # run in is decided by our fair queue
+        self.max_in_flight = self.max_workers * 2
+
+        self._executor = None
+        self._queues = OrderedDict()
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._dispatcher = None
+        self._shutdown = False
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Get the executor, starting the worker processes if needed."""
+        if self._executor is None:
+            # start the resource tracker before the workers are forked so
+            # they share it. otherwise each worker starts its own, which
+            # never hears that the shared memory it attached to was freed
+            resource_tracker.ensure_running()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, initializer=_warm_imports)
+            # start every process now rather than on demand, so the
+            # imports happen before the first real tasks arrive
+            for _ in range(self.max_workers):
+                self._executor.submit(_warm_imports)
+        return self._executor
+
+    def _start_dispatcher(self) -> None:
+        """Start the thread that hands queued tasks to the executor."""
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._dispatcher = threading.Thread(target=self._dispatch,
+                                                daemon=True)
+            self._dispatcher.start()
+
+    def _next_task(self) -> tuple:
+        """Take the next task round-robin across the clients with queued
+            tasks. Must be called while holding the condition."""
+        client_id, queue = next(iter(self._queues.items()))
+        task = queue.popleft()
+        # move the client to the back so the others get a turn
+        self._queues.move_to_end(client_id)
+        if not queue:
+            del self._queues[client_id]
+        return task
+
+    def _dispatch(self) -> None:
+        """Hand queued tasks to the executor while it has capacity."""
+        while True:
+            with self._cond:
+                while not self._shutdown and (
+                        not self._queues or
+                        self._in_flight >= self.max_in_flight):
+                    self._cond.wait()
+                if self._shutdown:
+                    return
+                proxy, fn, args = self._next_task()
+                self._in_flight += 1
+                # a queued task may have room for its client now
+                self._cond.notify_all()
+
+            if not proxy.set_running_or_notify_cancel():
+                self._task_done()
+                continue
+            try:
+                executor = self._get_executor()
+                try:
+                    future = executor.submit(fn, *args)
+                except BrokenProcessPool:
+                    # a worker died, so start a fresh set of processes
+                    self._drop_executor(executor)
+                    executor = self._get_executor()
+                    future = executor.submit(fn, *args)
+            except Exception as e:
+                proxy.set_exception(e)
+                self._task_done()
+                continue
+            future.add_done_callback(
+                lambda done, proxy=proxy, executor=executor:
+                self._copy_result(done, proxy, executor))
+
+    def _drop_executor(self, executor: ProcessPoolExecutor) -> None:
+        """Shut down an executor whose workers died, so its processes and
+            threads are cleaned up, and make the next task start a fresh
+            one. Does nothing if it was already replaced."""
+        with self._cond:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _copy_result(self, done: Future, proxy: Future,
+                     executor: ProcessPoolExecutor) -> None:
+        """Pass the executor's result on to the future the client has."""
+        if done.exception() is not None:
+            if isinstance(done.exception(), BrokenProcessPool):
+                self._drop_executor(executor)
+            proxy.set_exception(done.exception())
+        else:
+            proxy.set_result(done.result())
+        self._task_done()
+
+    def _task_done(self) -> None:
+        """Free up a slot for the dispatcher."""
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def submit(self, client_id: str, fn: Callable, *args: Any) -> Future:
+        """
+        Queue a task for a client. Blocks while the client already has
+            max_queued tasks waiting to run.
+        :param client_id: The client, such as a session, the task is for.
+        :param fn: The function to run, which needs to be picklable.
+        :param args: The arguments for the function.
+        :return future: The future for the result of the task.
+        """
+        proxy = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("The worker pool has been shut down.")
+            while len(self._queues.get(client_id, ())) >= self.max_queued:
+                self._cond.wait()
+            self._queues.setdefault(client_id, deque()).append(
+                (proxy, fn, args))
+            self._start_dispatcher()
+            self._cond.notify_all()
+        return proxy
+
+    def map(self, client_id: str, fn: Callable,
+            *iterables: Iterable) -> Iterator:
+        """
+        Run a function over the iterables for a client, like
+            Executor.map.
+        :param client_id: The client, such as a session, the tasks are
+            for.
+        :param fn: The function to run, which needs to be picklable.
+        :param iterables: The arguments for each task.
+        :return results: The results, in the order of the arguments.
+        """
+        futures = [self.submit(client_id, fn, *args) for args in
+                   zip(*iterables)]
+
+        def result_iterator():
+            try:
+                for future in futures:
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+        return result_iterator()
+
+    def shutdown(self) -> None:
+        """Stop the dispatcher and the worker processes."""
+        with self._cond:
+            self._shutdown = True
+            for queue in self._queues.values():
+                for proxy, _, _ in queue:
+                    proxy.cancel()
+            self._queues.clear()
+            self._cond.notify_all()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
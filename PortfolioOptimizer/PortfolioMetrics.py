@@ -11,21 +11,45 @@ class PortfolioMetrics(object):
     """
     Calculate metrics about the portfolio.
     """
-    def __init__(self, returns: pd.DataFrame, weights: list) -> None:
+    def __init__(self, returns: pd.DataFrame, weights: list,
+                 mu: np.ndarray = None, cov: np.ndarray = None) -> None:
         """
         :param returns: The returns of the different assets you want in
             the portfolio.
         :param weights: The weights for the portfolio.
+        :param mu: The mean of the returns, such as from OnlineMoments.
+            If given with cov, the metrics are worked out from them
+            rather than from the full history.
+        :param cov: The population covariance of the returns.
         """
         self.returns = returns
         self.weights = weights
+        self.mu = mu
+        self.cov = cov
+        # the returns of the portfolio, worked out once when first needed
+        self._port_returns = None
+
+    def port_returns(self) -> np.ndarray:
+        """
+        Calculate the returns of the portfolio, once for every metric.
+        :return port_returns: The returns of the portfolio.
+        """
+        if self._port_returns is None:
+            self._port_returns = np.dot(self.weights, self.returns.T)
+
+        return self._port_returns
 
     def stddev(self):
         """
         Calculate the standard deviation.
         :return stddev: The standard deviation of the portfolio.
         """
-        stddev = np.std(np.dot(self.weights, self.returns.T)) * np.sqrt(252)
+        if self.mu is not None and self.cov is not None:
+            weights = np.asarray(self.weights, dtype=float)
+            stddev = np.sqrt(weights @ np.asarray(self.cov) @ weights) * \
+                np.sqrt(252)
+        else:
+            stddev = np.std(self.port_returns()) * np.sqrt(252)
 
         return stddev
 
@@ -34,7 +58,10 @@ class PortfolioMetrics(object):
         Calculate the mean.
         :return mean: The mean of the portfolio.
         """
-        mean = np.mean(np.dot(self.weights, self.returns.T)) * 252
+        if self.mu is not None and self.cov is not None:
+            mean = np.dot(self.weights, self.mu) * 252
+        else:
+            mean = np.mean(self.port_returns()) * 252
 
         return mean
 
@@ -0,0 +1,111 @@
+"""
+Works out optimization results ahead of time so the app can look them up
+instead of running them while the user waits.
+:class Precompute: Runs the pipeline for a set of portfolios and every
+    objective, and saves the results to the lookup store.
+:func main: Runs the precompute job from the command line.
+"""
+
+from PortfolioOptimizer import GlobalVariables as gv
+from PortfolioOptimizer.CacheTools import PrecomputedResults
+from PortfolioOptimizer.DataTools import DataTools
+from PortfolioOptimizer.Pipeline import Pipeline
+
+import argparse
+import pandas as pd
+import time
+
+from itertools import combinations
+
+
+class Precompute(object):
+    """
+    Runs the pipeline for a set of portfolios and every objective, and
+    saves the results to the lookup store. Meant to be run as a job
+    whenever new data lands, so that the common portfolios are ready
+    before anyone asks for them.
+    """
+    def __init__(self, store: PrecomputedResults = None) -> None:
+        """
+        :param store: The lookup store to save the results to. If None,
+            we use the default store.
+        """
+        self.store = store or PrecomputedResults()
+
+    @staticmethod
+    def portfolios(max_size: int = 0) -> list:
+        """
+        Get the portfolios to precompute.
+        :param max_size: Also include every combination of the
+            investments with 2 to max_size investments in it.
+        :return portfolios: The default portfolio followed by any
+            combinations, each as a list of investments.
+        """
+        portfolios = [list(gv.DEFAULT_INVESTMENTS)]
+        for size in range(2, max_size + 1):
+            for portfolio in combinations(gv.SECURITY_MAPPING.keys(), size):
+                if sorted(portfolio) != sorted(gv.DEFAULT_INVESTMENTS):
+                    portfolios.append(list(portfolio))
+        return portfolios
+
+    def run(self, return_data: pd.DataFrame, portfolios: list,
+            objectives: list = None, bootstrap: bool = True) -> int:
+        """
+        Run the pipeline for every portfolio and objective and save the
+            results.
+        :param return_data: The return data for all investments.
+        :param portfolios: The portfolios to run, each as a list of
+            investments.
+        :param objectives: The objectives to run. If None, we run every
+            objective.
+        :param bootstrap: Whether to bootstrap the optimizations.
+        :return count: The number of results saved.
+        """
+        if objectives is None:
+            objectives = list(gv.OBJECTIVE_CHOICES.keys())
+        pipeline = Pipeline(use_store=False)
+
+        results = {}
+        for portfolio in portfolios:
+            for objective in objectives:
+                results[(tuple(portfolio), objective, bootstrap)] = \
+                    pipeline.run(portfolio, objective, return_data,
+                                 bootstrap=bootstrap, client_id='precompute')
+
+        self.store.save(DataTools().data_version(return_data), results)
+
+        return len(results)
+
+
+def main(argv: list = None) -> None:
+    """Runs the precompute job from the command line."""
+    parser = argparse.ArgumentParser(
+        description="Precompute optimization results for the app to look "
+                    "up.")
+    parser.add_argument('--max-size', type=int, default=0,
+                        help="also precompute every combination of the "
+                             "investments with up to this many in it")
+    parser.add_argument('--no-bootstrap', action='store_true',
+                        help="run the optimizations without bootstrapping")
+    parser.add_argument('--path', default=gv.PRECOMPUTE_PATH,
+                        help="where to write the lookup store")
+    parser.add_argument('--credentials', default=None,
+                        help="the BigQuery service account file to pull "
+                             "new data with, which defaults to the path "
+                             f"in {gv.GCP_CREDENTIALS_ENV}")
+    args = parser.parse_args(argv)
+
+    start_time = time.time()
+    data_engine = DataTools()
+    return_data = data_engine.pull_return_data(
+        data_engine.pull_ticker_tables(), credentials=args.credentials)
+
+    job = Precompute(PrecomputedResults(args.path))
+    count = job.run(return_data, job.portfolios(args.max_size),
+                    bootstrap=not args.no_bootstrap)
+    print(f"Precomputed {count} results in "
+          f"{round(time.time() - start_time, 1)} seconds.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""
+A local cache of price and return data.
+:class PriceCache: Keeps the wide adjusted close and return panels on
+    disk as Parquet so we only need to pull new rows from BigQuery, along
+    with the running moments of the returns.
+"""
+
+from PortfolioOptimizer import GlobalVariables as gv
+from PortfolioOptimizer.MomentTools import OnlineMoments
+
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+
+from typing import Tuple, Union
+
+
+class PriceCache(object):
+    """
+    Keeps the wide adjusted close and return panels on disk as Parquet,
+    keyed by the list of tables, so we only need to pull new rows from
+    BigQuery. The running moments of the returns are kept next to them,
+    so they can be updated with the new rows rather than worked out from
+    the full history again.
+    """
+    def __init__(self, cache_dir: str = gv.PRICE_CACHE_DIR) -> None:
+        """
+        :param cache_dir: The directory to keep the cache files in.
+        """
+        self.cache_dir = cache_dir
+
+    def _path(self, tables: list, name: str) -> str:
+        """Get the path of a cache file for a set of tables."""
+        key = hashlib.sha1(','.join(tables).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f'{name}_{key}')
+
+    def load(self, tables: list) \
+            -> Union[Tuple[pd.DataFrame, pd.DataFrame], None]:
+        """
+        Load the cached price and return data for a set of tables.
+        :param tables: The set of tables the data was pulled from.
+        :return prices: The adjusted close for each ticker, or None if
+            nothing is cached.
+        :return returns: The returns for each ticker, or None if nothing
+            is cached.
+        """
+        try:
+            prices = pd.read_parquet(self._path(tables, 'prices') +
+                                     '.parquet')
+            returns = pd.read_parquet(self._path(tables, 'returns') +
+                                      '.parquet')
+        except (OSError, ValueError):
+            return None
+
+        return prices, returns
+
+    def save(self, tables: list, prices: pd.DataFrame,
+             returns: pd.DataFrame) -> None:
+        """
+        Save the price and return data for a set of tables, and record
+            that they were just checked for new data.
+        :param tables: The set of tables the data was pulled from.
+        :param prices: The adjusted close for each ticker.
+        :param returns: The returns for each ticker.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write to temporary files first so a reader never sees half a
+        # file, then swap them in
+        for name, data in (('prices', prices), ('returns', returns)):
+            path = self._path(tables, name) + '.parquet'
+            data.to_parquet(path + '.tmp')
+            os.replace(path + '.tmp', path)
+        self.mark_checked(tables)
+
+    def load_moments(self, tables: list) -> Union[OnlineMoments, None]:
+        """
+        Load the cached moments of the returns for a set of tables.
+        :param tables: The set of tables the data was pulled from.
+        :return moments: The moments of the returns, or None if nothing
+            is cached.
+        """
+        try:
+            with np.load(self._path(tables, 'moments') + '.npz') as arrays:
+                return OnlineMoments.from_arrays(arrays)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save_moments(self, tables: list, moments: OnlineMoments) -> None:
+        """
+        Save the moments of the returns for a set of tables.
+        :param tables: The set of tables the data was pulled from.
+        :param moments: The moments of the returns.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(tables, 'moments') + '.npz'
+        # np.savez adds the extension if the path doesn't have it
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **moments.to_arrays())
+        os.replace(path + '.tmp', path)
+
+    def mark_checked(self, tables: list) -> None:
+        """Record that the data for a set of tables was just checked for
+            new rows."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self._path(tables, 'meta') + '.json', 'w') as f:
+            json.dump({'checked': pd.Timestamp.now().isoformat()}, f)
+
+    def is_current(self, tables: list, prices: pd.DataFrame) -> bool:
+        """
+        Check whether the cached data is up to date without going to the
+            network. It is if every ticker that hasn't ended has the last
+            complete trading day, or if we already checked for new data
+            today, which covers holidays.
+        :param tables: The set of tables the data was pulled from.
+        :param prices: The cached adjusted close for each ticker.
+        :return is_current: Whether the cached data is up to date.
+        """
+        today = pd.Timestamp.now().normalize()
+        last_trading_day = today - pd.offsets.BDay(1)
+        # every ticker still trading needs the day, not just the one that
+        # updated last
+        if self.refresh_start(prices) >= last_trading_day:
+            return True
+
+        try:
+            with open(self._path(tables, 'meta') + '.json') as f:
+                checked = pd.Timestamp(json.load(f)['checked'])
+        except (OSError, ValueError, KeyError):
+            return False
+
+        return checked.normalize() >= today
+
+    @staticmethod
+    def _last_dates(prices: pd.DataFrame) -> pd.Series:
+        """Get each ticker's last date with a price, leaving out tickers
+            without any."""
+        return prices.apply(lambda x: x.last_valid_index()).dropna()
+
+    @staticmethod
+    def ended(prices: pd.DataFrame) -> list:
+        """
+        Find the tickers that have stopped trading, such as delisted
+            funds, which are the ones whose last price is more than
+            PRICE_ENDED_DAYS business days behind the newest.
+        :param prices: The cached adjusted close for each ticker.
+        :return tickers: The tickers that have ended.
+        """
+        last_dates = PriceCache._last_dates(prices)
+        if last_dates.empty:
+            return []
+        cutoff = last_dates.max() - pd.offsets.BDay(gv.PRICE_ENDED_DAYS)
+
+        return list(last_dates.index[last_dates < cutoff])
+
+    @staticmethod
+    def refresh_start(prices: pd.DataFrame) -> pd.Timestamp:
+        """
+        Get the date to pull new rows after. Tables can update at
+            different times, so this is the earliest of each ticker's
+            last date with a price, which makes sure a ticker that was
+            behind gets its missing rows. Tickers that have ended are
+            left out, so one of them doesn't make every refresh pull
+            everything since it stopped. The rows from this date on
+            should be pulled too, so they can be checked with restated.
+        :param prices: The cached adjusted close for each ticker.
+        :return start: The date to pull rows after.
+        """
+        last_dates = PriceCache._last_dates(prices)
+        last_dates = last_dates.drop(PriceCache.ended(prices))
+        if last_dates.empty:
+            return prices.index.min()
+
+        return last_dates.min()
+
+    @staticmethod
+    def resumed(prices: pd.DataFrame, new_prices: pd.DataFrame) -> list:
+        """
+        Find the tickers that we took to have ended but have new prices,
+            which leaves a gap between their cached rows and the new
+            ones, so their whole history needs to be pulled again.
+        :param prices: The cached adjusted close for each ticker.
+        :param new_prices: The adjusted close pulled after refresh_start.
+        :return tickers: The tickers that have started trading again.
+        """
+        ended = [x for x in PriceCache.ended(prices) if
+                 x in new_prices.columns]
+        new_dates = PriceCache._last_dates(new_prices[ended])
+
+        return [x for x in ended if x in new_dates.index and
+                new_dates[x] > prices[x].last_valid_index()]
+
+    @staticmethod
+    def restated(prices: pd.DataFrame, new_prices: pd.DataFrame,
+                 rtol: float = 1e-9) -> list:
+        """
+        Find the tickers whose adjusted close was restated, which happens
+            to the whole history after a dividend or split, by comparing
+            the rows pulled again with the cached ones.
+        :param prices: The cached adjusted close for each ticker.
+        :param new_prices: The adjusted close pulled again, including
+            some rows that are already cached.
+        :param rtol: The relative difference that counts as restated.
+        :return tickers: The restated tickers.
+        """
+        dates = prices.index.intersection(new_prices.index)
+        old = prices.loc[dates]
+        new = new_prices.reindex(index=dates, columns=prices.columns)
+        both = old.notna() & new.notna()
+        changed = both & ~np.isclose(old, new, rtol=rtol, atol=0)
+
+        return list(prices.columns[changed.any().to_numpy()])
+
+    @staticmethod
+    def reload(prices: pd.DataFrame, returns: pd.DataFrame,
+               full_prices: pd.DataFrame) -> Tuple[pd.DataFrame,
+                                                   pd.DataFrame]:
+        """
+        Swap in the full history of some tickers, such as ones that were
+            restated, and calculate their returns again.
+        :param prices: The adjusted close for each ticker.
+        :param returns: The returns for each ticker.
+        :param full_prices: The full adjusted close for the tickers to
+            swap in.
+        :return prices: The updated adjusted close for each ticker.
+        :return returns: The updated returns for each ticker.
+        """
+        index = prices.index.union(full_prices.index)
+        prices = prices.reindex(index)
+        prices[full_prices.columns] = full_prices.reindex(index)
+        returns = returns.reindex(index[1:])
+        returns[full_prices.columns] = \
+            prices[full_prices.columns].pct_change().iloc[1:, :]
+
+        return prices, returns
+
+    @staticmethod
+    def append(prices: pd.DataFrame, returns: pd.DataFrame,
+               new_prices: pd.DataFrame, start: pd.Timestamp) \
+            -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Append new rows to the cached data, only calculating the returns
+            for the new rows.
+        :param prices: The cached adjusted close for each ticker.
+        :param returns: The cached returns for each ticker.
+        :param new_prices: The adjusted close for each ticker for the
+            dates after start. Any rows up to start are left out.
+        :param start: The date the new rows were pulled after.
+        :return prices: The updated adjusted close for each ticker.
+        :return returns: The updated returns for each ticker.
+        """
+        new_prices = new_prices.loc[new_prices.index > start].reindex(
+            columns=prices.columns)
+        kept_prices = prices.loc[:start]
+        # the returns for the new rows only need the last row we kept
+        tail = pd.concat([kept_prices.iloc[-1:], new_prices])
+        new_returns = tail.pct_change().iloc[1:, :]
+
+        prices = pd.concat([kept_prices, new_prices])
+        returns = pd.concat([returns.loc[:start], new_returns])
+
+        return prices, returns
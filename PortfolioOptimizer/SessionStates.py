@@ -1,12 +1,27 @@
 """Wrappers for variables that can be stored in SessionStates. This is
 useful for storing variables that are the outputs of class functions,
-which are hard to cache."""
+which are hard to cache. The variables shared by every session are kept in
+SharedStates, and these wrap them with the session's id and the app's
+secrets."""
 
-from PortfolioOptimizer.AnalyticTools import AnalyticTools
+from PortfolioOptimizer import SharedStates as shared
 from PortfolioOptimizer.DataTools import DataTools
+from PortfolioOptimizer.SharedStates import result_key, \
+    state_bootstrap_distribution, state_return_moments
 
 import pandas as pd
 import streamlit as st
+import uuid
+
+from typing import Callable
+
+
+def state_session_id() -> str:
+    """Get an id for the session, which we use to share the worker pool
+        fairly between sessions."""
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
 
 
 def state_pull_ticker_tables() -> list:
@@ -21,56 +36,44 @@ def state_pull_ticker_tables() -> list:
 
 
 def state_pull_return_data(tables: list) -> pd.DataFrame:
-    """Get the asset class return data."""
-    if 'return_data' in st.session_state and \
-            st.session_state.return_tables == tables:
-        return_data = st.session_state.return_data
-    else:
-        data_engine = DataTools()
-        return_data = data_engine.pull_return_data(tables)
-        st.session_state.return_data = return_data
-        st.session_state.return_tables = tables
-    return return_data
+    """Get the asset class return data shared by every session, pulling
+        any new data with the app's service account."""
+    return shared.state_pull_return_data(
+        tables, st.secrets['gcp_bigquery_service_account'])
 
 
 def state_bootstrap_optimization(user_return_data: pd.DataFrame,
                                  obj_func: str, objective_selection: str,
-                                 return_data: pd.DataFrame) -> pd.DataFrame:
-    """Bootstrap the return data and run the optimization based on the
-        user's asset choices returns and the objective function
-        selected by the user."""
-    if 'bs_weights' in st.session_state and \
-            st.session_state.bs_user_return_data.equals(user_return_data) and \
-            st.session_state.bs_obj_func == obj_func and \
-            st.session_state.bs_objective_selection == objective_selection \
-            and st.session_state.bs_return_data.equals(return_data):
-        weights = st.session_state.bs_weights
-    else:
-        analytics_engine = AnalyticTools()
-        weights = analytics_engine.bootstrap_optimization(
-            user_return_data, obj_func, objective_selection,
-            return_data)
-        st.session_state.bs_user_return_data = user_return_data
-        st.session_state.bs_obj_func = obj_func
-        st.session_state.bs_objective_selection = objective_selection
-        st.session_state.bs_return_data = return_data
-        st.session_state.bs_weights = weights
-    return weights
+                                 return_data: pd.DataFrame,
+                                 seed: int = None,
+                                 client_id: str = None,
+                                 tol: float = None) -> tuple:
+    """Get the shared bootstrapped optimization, as in
+        SharedStates.state_bootstrap_optimization. If client_id is None,
+        we use the session's id."""
+    return shared.state_bootstrap_optimization(
+        user_return_data, obj_func, objective_selection, return_data,
+        seed=seed, client_id=client_id or state_session_id(), tol=tol)
 
 
-def state_pmm(data: pd.DataFrame, d: int) -> list:
-    """Impute missing data using the predictive mean matching method."""
-    if 'imp_data' in st.session_state and st.session_state.pmm_data.equals(
-            data) and st.session_state.pmm_d == d:
-        imp_data = st.session_state.imp_data
-    else:
-        data_engine = DataTools()
-        imp_data_gen = data_engine.pmm(data, d)
-        imp_data = []
-        for _ in range(d):
-            curr_data = next(imp_data_gen).copy()
-            imp_data.append(curr_data)
-        st.session_state.pmm_data = data
-        st.session_state.pmm_d = d
-        st.session_state.imp_data = imp_data
-    return imp_data
+def state_imputed_bootstrap_optimization(
+        imp_user_data: list, obj_func: str, objective_selection: str,
+        return_data: pd.DataFrame, seed: int = None, client_id: str = None,
+        on_progress: Callable[[float, pd.DataFrame, pd.DataFrame],
+                              None] = None,
+        tol: float = None) -> list:
+    """Get the shared bootstrapped optimizations of every imputation, as
+        in SharedStates.state_imputed_bootstrap_optimization. If client_id
+        is None, we use the session's id."""
+    return shared.state_imputed_bootstrap_optimization(
+        imp_user_data, obj_func, objective_selection, return_data,
+        seed=seed, client_id=client_id or state_session_id(),
+        on_progress=on_progress, tol=tol)
+
+
+def state_pmm(data: pd.DataFrame, d: int, columns: list = None,
+              client_id: str = None) -> list:
+    """Get the shared imputed data, as in SharedStates.state_pmm. If
+        client_id is None, we use the session's id."""
+    return shared.state_pmm(data, d, columns,
+                            client_id=client_id or state_session_id())
@@ -0,0 +1,92 @@
+"""
+Tools for sharing data with worker processes without pickling it.
+:class SharedArray: Holds a NumPy array in shared memory so that worker
+    processes can read it in place.
+"""
+
+from PortfolioOptimizer import GlobalVariables as gv
+
+import numpy as np
+
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from typing import Tuple
+
+# the shared memory blocks the current process is attached to, by name and
+# least recently used first, so workers only attach once per run no matter
+# how many tasks they get, even with several runs going at once
+_ATTACHED = OrderedDict()
+
+
+class SharedArray(object):
+    """
+    Holds a NumPy array in shared memory so that worker processes can
+    read it in place. Use it as a context manager in the parent so the
+    block is freed once the workers are done with it.
+    """
+    def __init__(self, data: np.ndarray) -> None:
+        """
+        :param data: The array to place in shared memory. It is copied
+            once into the shared block.
+        """
+        data = np.ascontiguousarray(data)
+        self.shape = data.shape
+        self.dtype = data.dtype.str
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=max(data.nbytes, 1))
+        self.array = np.ndarray(self.shape, dtype=self.dtype,
+                                buffer=self.shm.buf)
+        self.array[:] = data
+
+    @property
+    def spec(self) -> Tuple[str, tuple, str]:
+        """The name, shape and dtype that workers need to attach."""
+        return self.shm.name, self.shape, self.dtype
+
+    def close(self) -> None:
+        """Release and free the shared memory block."""
+        self.array = None
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self) -> 'SharedArray':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    @staticmethod
+    def attach(spec: Tuple[str, tuple, str]) -> np.ndarray:
+        """
+        Get a read-only view of a shared array from a worker process.
+        :param spec: The name, shape and dtype from SharedArray.spec.
+        :return array: The view of the shared array.
+        """
+        name, shape, dtype = spec
+        if name in _ATTACHED:
+            _ATTACHED.move_to_end(name)
+        else:
+            # only keep the latest few blocks attached so a long-lived
+            # worker doesn't hold on to every run's data
+            while len(_ATTACHED) >= gv.SHARED_ARRAY_MAX_ATTACHED:
+                _, (old_shm, old_array) = _ATTACHED.popitem(last=False)
+                # our view of the block has to go before it can close
+                del old_array
+                try:
+                    old_shm.close()
+                # a caller still holds a view of the old block, so leave
+                # it to be closed when that is garbage collected
+                except BufferError:
+                    pass
+            # the parent owns the block, so the worker shouldn't track it.
+            # before Python 3.13 attaching always tracks it, but workers
+            # share the parent's resource tracker so that is harmless
+            try:
+                shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                shm = shared_memory.SharedMemory(name=name)
+            array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            array.flags.writeable = False
+            _ATTACHED[name] = (shm, array)
+
+        return _ATTACHED[name][1]
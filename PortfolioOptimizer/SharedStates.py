@@ -0,0 +1,251 @@
+"""Variables shared by every session of the app and by the runs outside
+it, such as BatchRun. These don't need streamlit, so the app wraps them in
+SessionStates with the session's id."""
+
+from PortfolioOptimizer import GlobalVariables as gv
+from PortfolioOptimizer.AnalyticTools import AnalyticTools
+from PortfolioOptimizer.CacheTools import SharedCache
+from PortfolioOptimizer.DataTools import DataTools
+from PortfolioOptimizer.MomentTools import OnlineMoments
+
+import pandas as pd
+
+from typing import Callable, Union
+
+# caches that live as long as the process does and are shared by every
+# session
+_RETURN_DATA_CACHE = SharedCache(ttl=gv.RETURN_DATA_CACHE_TTL,
+                                 max_bytes=gv.RETURN_DATA_CACHE_MAX_BYTES)
+_MOMENT_CACHE = SharedCache(max_entries=gv.MOMENT_CACHE_MAX_ENTRIES)
+_IMPUTE_CACHE = SharedCache(max_entries=gv.IMPUTE_CACHE_MAX_ENTRIES)
+_RESULT_CACHE = SharedCache(max_entries=gv.RESULT_CACHE_MAX_ENTRIES,
+                            cache_dir=gv.RESULT_CACHE_DIR)
+
+
+def state_pull_return_data(tables: list,
+                           credentials: Union[dict, str] = None) \
+        -> pd.DataFrame:
+    """Get the asset class return data. This is one read-only copy shared
+        by every session, and if many sessions ask at once only one of
+        them pulls it. The block lengths for the bootstrap are worked out
+        for every investment as soon as new data is pulled, and the
+        moments of the returns are kept for state_return_moments. If new
+        data is needed, we connect to BigQuery with credentials, as in
+        DataTools.pull_return_data."""
+    data_engine = DataTools()
+
+    def load():
+        return_data = data_engine.pull_return_data(tables,
+                                                   credentials=credentials)
+        _MOMENT_CACHE.set(data_engine.data_version(return_data),
+                          data_engine.pull_return_moments(tables,
+                                                          return_data))
+        # work out every investment's block length for the bootstrap now,
+        # so no run has to wait for it
+        for exponent in (1, 2):
+            data_engine.block_lengths(return_data, exponent)
+        return return_data
+
+    return_data = _RETURN_DATA_CACHE.get_or_load(tuple(tables), load)
+    return return_data
+
+
+def state_return_moments(return_data: pd.DataFrame) \
+        -> Union[OnlineMoments, None]:
+    """Get the moments of the return data, if it was pulled with
+        state_pull_return_data. Otherwise, such as for imputed data, there
+        are none and we return None."""
+    data_engine = DataTools()
+    return _MOMENT_CACHE.get(data_engine.data_version(return_data))
+
+
+def result_key(user_return_data: pd.DataFrame, obj_func: str,
+               objective_selection: str, return_data: pd.DataFrame,
+               bs_count: int = gv.DEFAULT_BOOTSTRAP_COUNT,
+               trunc: float = gv.DEFAULT_BOOTSTRAP_TRUNC,
+               seed: int = None, tol: float = None) -> tuple:
+    """Get the key for an optimization result, which only needs cheap
+        fingerprints of the data rather than the data itself. A result
+        that was stopped early at a tolerance is kept apart from a full
+        one."""
+    data_engine = DataTools()
+    return (data_engine.data_version(return_data),
+            data_engine.data_version(user_return_data),
+            tuple(sorted(user_return_data.columns)), obj_func,
+            objective_selection, bs_count, trunc, seed, tol)
+
+
+def state_bootstrap_optimization(user_return_data: pd.DataFrame,
+                                 obj_func: str, objective_selection: str,
+                                 return_data: pd.DataFrame,
+                                 seed: int = None,
+                                 client_id: str = 'default',
+                                 tol: float = None) -> tuple:
+    """Bootstrap the return data and run the optimization based on the
+        user's asset choices returns and the objective function
+        selected by the user, as well as the metrics for the resulting
+        portfolio. Results are shared by every session, so a common
+        portfolio only needs to be optimized once. If seed is None, any
+        earlier result for the same inputs is reused. The worker pool
+        tasks are queued under client_id. If tol is given, the number of
+        samples adapts until the average weights settle within it."""
+    key = result_key(user_return_data, obj_func, objective_selection,
+                     return_data, seed=seed, tol=tol)
+
+    def run() -> dict:
+        analytics_engine = AnalyticTools()
+        bs_weights = analytics_engine.bootstrap_weights(
+            user_return_data, obj_func, objective_selection,
+            return_data, client_id=client_id, seed=seed, tol=tol)
+        weights = pd.DataFrame(bs_weights).mean() if bs_weights else None
+        return _bootstrap_result(user_return_data, weights, obj_func,
+                                 objective_selection, return_data,
+                                 bs_weights)
+
+    return _unpack_result(_RESULT_CACHE.get_or_load(key, run),
+                          user_return_data)
+
+
+def _bootstrap_result(user_return_data: pd.DataFrame, weights: pd.Series,
+                      obj_func: str, objective_selection: str,
+                      return_data: pd.DataFrame,
+                      bs_weights: list = None) -> dict:
+    """Get the result to cache for a set of bootstrapped weights, which
+        also has the metrics for the resulting portfolio and, if we have
+        the weights of every sample, the metrics of each of them."""
+    analytics_engine = AnalyticTools()
+    # keep the weights by ticker so the same assets in a different order
+    # can use the result
+    if weights is not None:
+        weights = pd.Series(weights.to_numpy(),
+                            index=user_return_data.columns)
+    try:
+        metrics = analytics_engine.portfolio_metrics(
+            user_return_data, weights, obj_func, objective_selection,
+            return_data, {})
+    # we need to handle if all the weights are None
+    except TypeError:
+        metrics = None
+    distribution = None
+    if bs_weights is not None:
+        distribution = analytics_engine.bootstrap_metrics(user_return_data,
+                                                          bs_weights)
+    return {'weights': weights, 'metrics': metrics,
+            'distribution': distribution}
+
+
+def _unpack_result(result: dict, user_return_data: pd.DataFrame) -> tuple:
+    """Get the weights, in the user's order, and metrics from a cached
+        result."""
+    weights = result['weights']
+    if weights is not None:
+        weights = weights[user_return_data.columns].reset_index(drop=True)
+    return weights, result['metrics']
+
+
+def state_bootstrap_distribution(user_return_data: pd.DataFrame,
+                                 obj_func: str, objective_selection: str,
+                                 return_data: pd.DataFrame,
+                                 seed: int = None,
+                                 tol: float = None) -> Union[dict, None]:
+    """Get the metrics of every bootstrap sample's portfolio from a
+        shared result, as arrays with one value per sample. Returns None
+        if the optimization hasn't been run or had no solution."""
+    result = _RESULT_CACHE.get(result_key(
+        user_return_data, obj_func, objective_selection, return_data,
+        seed=seed, tol=tol))
+    if result is None:
+        return None
+    return result.get('distribution')
+
+
+def state_imputed_bootstrap_optimization(
+        imp_user_data: list, obj_func: str, objective_selection: str,
+        return_data: pd.DataFrame, seed: int = None,
+        client_id: str = 'default',
+        on_progress: Callable[[float, pd.DataFrame, pd.DataFrame],
+                              None] = None,
+        tol: float = None) -> list:
+    """Bootstrap every imputation of the user's return data and run the
+        optimizations, as well as the metrics for each resulting
+        portfolio. Imputations with a shared result are reused and the
+        rest are run together on the worker pool. As each chunk of samples
+        finishes, on_progress is called with the fraction of samples done
+        and the running averages of the weights, in the user's order, and
+        of the metrics, with their confidence bands, as returned by
+        AnalyticTools.running_summary. If tol is given, we stop early once
+        the standard error of every running average weight is under it.
+        The worker pool tasks are queued under client_id."""
+    keys = [result_key(x, obj_func, objective_selection, return_data,
+                       seed=seed, tol=tol) for x in imp_user_data]
+    results = [_RESULT_CACHE.get(x) for x in keys]
+    todo = [i for i, x in enumerate(results) if x is None]
+
+    if todo:
+        analytics_engine = AnalyticTools()
+        columns = imp_user_data[0].columns
+        bs_weights = {i: [] for i in todo}
+        bs_metrics = []
+        sample_counts = {i: 0 for i in todo}
+        total = len(todo) * gv.DEFAULT_BOOTSTRAP_COUNT
+        done = 0
+        # smaller tasks so the display updates more often
+        chunk_size = gv.DEFAULT_BOOTSTRAP_CHUNK_SIZE
+        if on_progress is not None or tol is not None:
+            chunk_size = gv.DEFAULT_STREAM_CHUNK_SIZE
+        for j, count, curr_weights in \
+                analytics_engine.imputed_bootstrap_optimization(
+                    [imp_user_data[i] for i in todo], obj_func,
+                    objective_selection, return_data,
+                    client_id=client_id, seed=seed,
+                    chunk_size=chunk_size):
+            bs_weights[todo[j]].extend(curr_weights)
+            sample_counts[todo[j]] += count
+            done += count
+            all_weights = [x for y in bs_weights.values() for x in y]
+            if not all_weights:
+                continue
+
+            if on_progress is not None:
+                bs_metrics.append(analytics_engine.bootstrap_metrics(
+                    imp_user_data[todo[j]], curr_weights, drawdown=False,
+                    var=False))
+            weights_summary, metrics_summary = \
+                analytics_engine.running_summary(
+                    all_weights, bs_metrics, columns)
+            if on_progress is not None:
+                on_progress(done / total, weights_summary, metrics_summary)
+            # stop once the weights have settled, as long as every
+            # imputation has enough samples
+            if tol is not None and \
+                    min(sample_counts.values()) >= \
+                    gv.DEFAULT_EARLY_STOP_MIN_SAMPLES and \
+                    weights_summary['Std Error'].max() <= tol:
+                break
+
+        for i in todo:
+            weights = None
+            if bs_weights[i]:
+                weights = pd.DataFrame(bs_weights[i]).mean()
+            results[i] = _RESULT_CACHE.set(keys[i], _bootstrap_result(
+                imp_user_data[i], weights, obj_func, objective_selection,
+                return_data, bs_weights[i]))
+
+    return [_unpack_result(x, y) for x, y in zip(results, imp_user_data)]
+
+
+def state_pmm(data: pd.DataFrame, d: int, columns: list = None,
+              client_id: str = 'default') -> list:
+    """Impute missing data using the predictive mean matching method. The
+        imputed data is one read-only copy shared by every session, keyed
+        by the version of the data and the columns imputed. The worker
+        pool tasks are queued under client_id."""
+    data_engine = DataTools()
+    key = (data_engine.data_version(data),
+           None if columns is None else tuple(sorted(columns)), d,
+           gv.DEFAULT_IMPUTE_ITER)
+
+    def load():
+        return list(data_engine.pmm(data, d, columns, client_id=client_id))
+
+    return _IMPUTE_CACHE.get_or_load(key, load)
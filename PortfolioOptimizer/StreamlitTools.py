@@ -5,6 +5,8 @@ Classes:
     StreamlitTools: Creates visuals for the web apps.
 """
 
+from PortfolioOptimizer.TimingTools import span
+
 import numpy as np
 import streamlit as st
 
@@ -325,20 +327,21 @@ class StreamlitTools(object):
         # get 20 total and make the math easier)
         # we also use 98 as the highest number since we need to have at least
         # 1 for each margin
-        if len(col_headers) >= cols_for_center:
-            st.markdown(table, unsafe_allow_html=True)
-        else:
-            table_width = 100 - (cols_for_center - len(col_headers)) * (100 / (
-                    cols_for_center + 1))
-            margin_width = int(100 - table_width) / 2
-            col_widths = [margin_width, table_width, margin_width]
-
-            # display the table
-            table_col1, table_col2, table_col3 = st.columns(col_widths)
-            with table_col2:
+        with span('render', columns=len(col_headers)):
+            if len(col_headers) >= cols_for_center:
                 st.markdown(table, unsafe_allow_html=True)
+            else:
+                table_width = 100 - (cols_for_center - len(col_headers)) * (
+                        100 / (cols_for_center + 1))
+                margin_width = int(100 - table_width) / 2
+                col_widths = [margin_width, table_width, margin_width]
+
+                # display the table
+                table_col1, table_col2, table_col3 = st.columns(col_widths)
+                with table_col2:
+                    st.markdown(table, unsafe_allow_html=True)
 
-            return col_widths
+                return col_widths
 
 
     def get_metric_headers(self, obj_func: str) -> list:
@@ -0,0 +1,223 @@
+"""
+Tools for seeing where the time goes in a run.
+:class StageTimer: Records how long each stage of a run takes as spans,
+    and exports them as JSON or Prometheus counters.
+:func get_timer: Get the process-wide StageTimer, creating it if needed.
+:func span: Time a stage with the process-wide StageTimer.
+:func profile: Profile everything run inside it with cProfile or
+    pyinstrument.
+"""
+
+from PortfolioOptimizer import GlobalVariables as gv
+
+import cProfile
+import json
+import os
+import re
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator
+
+_TIMER = None
+_TIMER_LOCK = threading.Lock()
+
+
+def get_timer() -> 'StageTimer':
+    """Get the process-wide StageTimer, creating it if needed. Worker
+        processes get their own, so their spans only reach the parent
+        through the JSON log."""
+    global _TIMER
+    with _TIMER_LOCK:
+        if _TIMER is None:
+            _TIMER = StageTimer()
+    return _TIMER
+
+
+@contextmanager
+def span(stage: str, **fields) -> Iterator[dict]:
+    """
+    Time a stage with the process-wide StageTimer.
+    :param stage: The name of the stage, such as 'solve'.
+    :param fields: Anything else to record with the span, such as the
+        table being pulled.
+    :return fields: The fields, which more can be added to before the
+        stage ends, such as the number of solver iterations.
+    """
+    with get_timer().span(stage, **fields) as fields:
+        yield fields
+
+
+@contextmanager
+def profile(path: str) -> Iterator[None]:
+    """
+    Profile everything run inside it, for a one off look at a run. A path
+        ending in '.html' uses pyinstrument, which needs to be installed
+        and shows the time spent in each call stack, and anything else
+        uses cProfile, which can be read with pstats or snakeviz.
+    :param path: Where to write the profile.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if path.endswith('.html'):
+        # only needed for this, so it isn't a requirement of the app
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(path, 'w') as f:
+                f.write(profiler.output_html())
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+
+
+class StageTimer(object):
+    """
+    Records how long each stage of a run takes, such as each BigQuery
+    query, imputation chain or solve, as spans. A price pull is one query
+    for all of its tables unless it is run concurrently, so its span is
+    tagged with the tables rather than there being one per table. The
+    latest spans are kept in memory along with running totals for each
+    stage, which include the sum of any numeric fields, such as solver
+    iterations, other than shares such as 'discarded_share'. Every span
+    can also be written to a JSON log as it ends, which is the only way to
+    see the spans from worker processes.
+    """
+    def __init__(self, max_spans: int = gv.TIMING_MAX_SPANS,
+                 log_path: str = gv.TIMING_LOG_PATH) -> None:
+        """
+        :param max_spans: The most spans to keep in memory. The totals
+            cover every span.
+        :param log_path: Where to append every span as a line of JSON. If
+            None, the spans are only kept in memory.
+        """
+        self.spans = deque(maxlen=max_spans)
+        self.totals = {}
+        self.log_path = log_path
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage: str, **fields) -> Iterator[dict]:
+        """
+        Time a stage.
+        :param stage: The name of the stage.
+        :param fields: Anything else to record with the span.
+        :return fields: The fields, which more can be added to before the
+            stage ends. If the stage raises, the error is added too.
+        """
+        start = time.perf_counter()
+        try:
+            yield fields
+        except BaseException as e:
+            fields['error'] = type(e).__name__
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start, **fields)
+
+    def record(self, stage: str, seconds: float, **fields) -> None:
+        """
+        Record a span that was timed some other way.
+        :param stage: The name of the stage.
+        :param seconds: How long the stage took.
+        :param fields: Anything else to record with the span.
+        """
+        entry = {'stage': stage, 'start': time.time() - seconds,
+                 'seconds': seconds, 'pid': os.getpid()}
+        entry.update(fields)
+        with self._lock:
+            self.spans.append(entry)
+            totals = self.totals.setdefault(stage, {'calls': 0,
+                                                    'seconds': 0.0})
+            totals['calls'] += 1
+            totals['seconds'] += seconds
+            for name, value in fields.items():
+                # sum the numeric fields, which counts the true ones for
+                # flags like whether a solve succeeded. a share of
+                # something isn't a total, so it is only kept on the span
+                if isinstance(value, (bool, int, float)) and \
+                        not name.endswith('_share'):
+                    totals[name] = totals.get(name, 0) + value
+            if self.log_path is not None:
+                # a single write of a whole line, so lines from different
+                # processes don't get mixed up
+                with open(self.log_path, 'a') as f:
+                    f.write(json.dumps(entry, default=str) + '\n')
+
+    def summary(self) -> dict:
+        """
+        Get the totals for each stage.
+        :return totals: The number of calls, the total seconds and the sum
+            of each numeric field, by stage.
+        """
+        with self._lock:
+            return {k: dict(v) for k, v in self.totals.items()}
+
+    def reset(self) -> None:
+        """Forget every span and total, such as at the start of a run."""
+        with self._lock:
+            self.spans.clear()
+            self.totals = {}
+
+    def to_json(self, path: str = None) -> str:
+        """
+        Get the spans in memory and the totals as JSON.
+        :param path: If given, where to write it too.
+        :return text: The spans and totals as JSON.
+        """
+        with self._lock:
+            text = json.dumps({'spans': list(self.spans),
+                               'totals': self.totals}, indent=1,
+                              default=str)
+        if path is not None:
+            self._write(text, path)
+
+        return text
+
+    def to_prometheus(self, prefix: str = gv.TIMING_METRIC_PREFIX,
+                      path: str = None) -> str:
+        """
+        Get the totals as Prometheus counters, one per total labelled by
+            stage, such as {prefix}_seconds_total{stage="solve"}.
+        :param prefix: The start of the name of every counter.
+        :param path: If given, where to write it too, such as the
+            directory of node_exporter's textfile collector.
+        :return text: The counters in the Prometheus text format.
+        """
+        counters = {}
+        for stage, totals in self.summary().items():
+            for name, value in totals.items():
+                name = re.sub(r'[^a-zA-Z0-9_]', '_', name)
+                counters.setdefault(f'{prefix}_{name}_total', []).append(
+                    f'{prefix}_{name}_total{{stage="{stage}"}} '
+                    f'{float(value)!r}')
+        lines = []
+        for name, samples in counters.items():
+            lines.append(f'# TYPE {name} counter')
+            lines.extend(samples)
+        text = '\n'.join(lines) + '\n'
+        if path is not None:
+            self._write(text, path)
+
+        return text
+
+    @staticmethod
+    def _write(text: str, path: str) -> None:
+        """Write a file in one go, so a reader never sees half of it."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            f.write(text)
+        os.replace(path + '.tmp', path)
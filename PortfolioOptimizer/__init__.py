@@ -1,8 +1,19 @@
 from PortfolioOptimizer import GlobalVariables
-from PortfolioOptimizer import SessionStates
+from PortfolioOptimizer import SharedStates
 from PortfolioOptimizer.AnalyticTools import AnalyticTools
+from PortfolioOptimizer.BatchOptimizer import BatchOptimizer
+from PortfolioOptimizer.BatchPortfolioMetrics import BatchPortfolioMetrics
+from PortfolioOptimizer.BatchRun import BatchRun
+from PortfolioOptimizer.Benchmark import Benchmark
+from PortfolioOptimizer.CacheTools import PrecomputedResults, SharedCache
 from PortfolioOptimizer.DataTools import DataTools
 from PortfolioOptimizer.GCPTools import GCPTools
+from PortfolioOptimizer.MomentTools import OnlineMoments
 from PortfolioOptimizer.Optimizer import Optimizer
+from PortfolioOptimizer.Pipeline import Pipeline
+from PortfolioOptimizer.PoolTools import WorkerPool
 from PortfolioOptimizer.PortfolioMetrics import PortfolioMetrics
-from PortfolioOptimizer.StreamlitTools import StreamlitTools
+from PortfolioOptimizer.Precompute import Precompute
+from PortfolioOptimizer.PriceCache import PriceCache
+from PortfolioOptimizer.SharedMemoryTools import SharedArray
+from PortfolioOptimizer.TimingTools import StageTimer
@@ -4,12 +4,12 @@ Runs the portfolio optimizer.
 
 from PortfolioOptimizer import GlobalVariables as gv
 from PortfolioOptimizer import SessionStates as sstate
-from PortfolioOptimizer.AnalyticTools import AnalyticTools
 from PortfolioOptimizer.DataTools import DataTools
+from PortfolioOptimizer.Pipeline import Pipeline
 from PortfolioOptimizer.StreamlitTools import StreamlitTools
+from PortfolioOptimizer.TimingTools import get_timer
 
 import numpy as np
-import pandas as pd
 import streamlit as st
 import time
 
@@ -41,7 +41,6 @@ def main():
 
     # define tools for use throughout
     data_engine = DataTools()
-    analytics_engine = AnalyticTools()
     format_engine = StreamlitTools()
 
     ####################################################################
@@ -90,6 +89,10 @@ def main():
     optimizer_option_selection = st.sidebar.multiselect(
         "Which optimization methods would you like to use?",
         gv.OPTIMIZER_CHOICES, default=gv.DEFAULT_OPTIMIZER_OPTIONS)
+    compare_selection = st.sidebar.checkbox(
+        "Compare every stock/bond mix", value=False)
+    early_stop_selection = st.sidebar.checkbox(
+        "Stop once the holdings settle", value=False)
     st.sidebar.write('')
 
     # only run if the user wants to
@@ -106,72 +109,54 @@ def main():
         tables = data_engine.pull_ticker_tables()
         return_data = sstate.state_pull_return_data(tables)
 
-        # get data for the selected investments
-        user_return_data, any_missing = data_engine.get_user_data(
-            investment_selection, return_data)
-
         ################################################################
         # Run Analysis
         ################################################################
 
         # we need to know the objective function throughout
         obj_func = gv.OBJECTIVE_CHOICES[objective_selection][0]
-        # if we don't have missing data, we can just run the analysis
-        if not any_missing:
-            # run the optimization, potentially with bootstraps
-            if 'Bootstrapping' in optimizer_option_selection:
-                weights = sstate.state_bootstrap_optimization(
-                    user_return_data, obj_func, objective_selection,
-                    return_data)
-            else:
-                weights = analytics_engine.run_optimization(
-                    user_return_data, obj_func, objective_selection,
-                    return_data)
-            # run the metrics
-            try:
-                metrics = analytics_engine.portfolio_metrics(
-                    user_return_data, weights, obj_func, objective_selection,
-                    return_data, {})
-                metrics = analytics_engine.average_metrics(metrics)
-            # we need to handle if all the weights are None
-            except TypeError:
-                metrics = None
-        else:
-            # if we have missing data, we need to impute it and run the
-            # analysis for each set of imputed data
-            imp_data = sstate.state_pmm(return_data, gv.DEFAULT_IMPUTE_COUNT)
-            imp_weights = []
-            imp_metrics = {}
-            for i in range(gv.DEFAULT_IMPUTE_COUNT):
-                user_return_data, _ = data_engine.get_user_data(
-                    investment_selection, imp_data[i])
-                # run the optimization, potentially with bootstraps, and
-                # record the weights
-                if 'Bootstrapping' in optimizer_option_selection:
-                    curr_weights = sstate.state_bootstrap_optimization(
-                        user_return_data, obj_func, objective_selection,
-                        return_data)
-                else:
-                    curr_weights = analytics_engine.run_optimization(
-                        user_return_data, obj_func, objective_selection,
-                        return_data)
-                # if the volatility of the benchmark is higher than any of
-                # the investments, we can't get weights under 100% so we
-                # return None and skip this iteration
-                if curr_weights is not None:
-                    imp_weights.append(curr_weights)
-                # record the metrics
-                imp_metrics = analytics_engine.portfolio_metrics(
-                    user_return_data, curr_weights, obj_func,
-                    objective_selection, return_data, imp_metrics)
-            # average the weights and metrics
-            try:
-                weights = pd.DataFrame(imp_weights).mean()
-                metrics = analytics_engine.average_metrics(imp_metrics)
-            # we need to handle if all the weights are None
-            except TypeError:
-                weights = None
-                metrics = None
+        # run the imputation, optimization and metrics, using the
+        # precomputed results if there are any, and show the running
+        # holdings and metrics as the bootstraps finish. since the results
+        # are streamed, the tolerance can only stop the bootstraps early.
+        # drawing more samples until the holdings settle is left to
+        # headless runs, which don't stream
+        progress_bar = st.progress(0.0)
+        stream_placeholder = st.empty()
+
+        def show_progress(done, weights_summary, metrics_summary):
+            progress_bar.progress(done)
+            # the holdings so far, with the band they are likely to end
+            # up in, updated in place
+            stream_headers = ['Weight (%)', 'Lower (%)', 'Upper (%)']
+            stream_items = {a: list(w) for a, w in zip(
+                investment_selection,
+                weights_summary[['Mean', 'Lower', 'Upper']].clip(
+                    0, 1).to_numpy())}
+            stream_format_type = ['percent'] * len(stream_items)
+            stream_decimals = [0] * len(stream_items)
+            if metrics_summary is not None:
+                for name, row in metrics_summary.iterrows():
+                    stream_items[name] = list(
+                        row[['Mean', 'Lower', 'Upper']])
+                    stream_format_type.append(
+                        'float' if name == 'Sharpe Ratio' else 'percent')
+                    stream_decimals.append(1)
+            stream_table = format_engine.create_html_table(
+                50, 'Running Holdings', stream_headers, stream_items,
+                stream_format_type, decimals=stream_decimals,
+                blank_after=[investment_selection[-1]])
+            stream_placeholder.markdown(gv.CSS_TABLE_STYLE + stream_table,
+                                        unsafe_allow_html=True)
+
+        weights, metrics = Pipeline().run(
+            investment_selection, objective_selection, return_data,
+            bootstrap='Bootstrapping' in optimizer_option_selection,
+            client_id=sstate.state_session_id(),
+            on_progress=show_progress,
+            tol=gv.DEFAULT_EARLY_STOP_TOL if early_stop_selection else None)
+        progress_bar.empty()
+        stream_placeholder.empty()
 
         ################################################################
         # Display if no Weights
@@ -282,6 +267,65 @@ def main():
                          "for the entire dataset. However, it should be "
                          "relatively close.")
 
+        ################################################################
+        # Display Stock / Bond Mix Comparison
+        ################################################################
+
+        if compare_selection:
+            st.write('')
+            st.write('')
+            cmp_title_cols = st.columns(3)
+            with cmp_title_cols[1]:
+                cmp_writing = "Stock / Bond Mix Comparison"
+                cmp_format = f'<p style="text-align: center; ' \
+                             f'font-size: 26px; font-weight: bold;">' \
+                             f'{cmp_writing}</p>'
+                st.markdown(cmp_format, unsafe_allow_html=True)
+
+            # every mix is solved in one pass along the efficient frontier
+            frontier = Pipeline().run_frontier(
+                investment_selection, return_data,
+                bootstrap='Bootstrapping' in optimizer_option_selection,
+                client_id=sstate.state_session_id())
+
+            # use HTML / CSS styling to create a table
+            st.markdown(gv.CSS_TABLE_STYLE, unsafe_allow_html=True)
+            # create the table with a row per mix
+            cmp_table_index_width = 25
+            cmp_table_title = 'Objective'
+            cmp_table_headers = investment_selection + [
+                'Cash', 'Average', 'Volatility', 'Sharpe Ratio']
+            cmp_table_line_items = {}
+            for cmp_objective, (cmp_weights, cmp_metrics) in \
+                    frontier.items():
+                # the mix has no weights if the benchmark volatility is
+                # higher than any of the investments
+                if cmp_weights is None:
+                    cmp_table_line_items[cmp_objective] = \
+                        ['-'] * len(cmp_table_headers)
+                else:
+                    cmp_table_line_items[cmp_objective] = \
+                        list(cmp_weights) + [1 - cmp_weights.sum()] + [
+                            cmp_metrics['Average'][0],
+                            cmp_metrics['Volatility'][0],
+                            cmp_metrics['Sharpe Ratio'][0]]
+            cmp_table_format_type = ['percent'] * (len(cmp_table_headers) -
+                                                   1) + ['float']
+            cmp_table_decimal_places = [0] * (len(investment_selection) +
+                                              1) + [1, 1, 1]
+            cmp_table = format_engine.create_html_table(
+                cmp_table_index_width, cmp_table_title, cmp_table_headers,
+                cmp_table_line_items,
+                [cmp_table_format_type] * len(cmp_table_line_items),
+                decimals=[cmp_table_decimal_places] *
+                len(cmp_table_line_items))
+            # display the table
+            format_engine.display_table(cmp_table, cmp_table_headers, 10)
+
+        # export the time spent in each stage so far, if asked to
+        if gv.TIMING_PROMETHEUS_PATH is not None:
+            get_timer().to_prometheus(path=gv.TIMING_PROMETHEUS_PATH)
+
         ##############################################################
         # ALLOW USER TO RUN BACKTEST, PMM BOOTSTRAPPING
 